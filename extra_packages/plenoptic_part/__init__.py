@@ -2,4 +2,7 @@
 
 from .tools import clamps, display, optim
 from .simulate.ventral_stream import PooledV1, PooledRGC, PooledMoments
+from .simulate.scaling_sweep import PooledV1Sweep
+from .simulate.representation_cache import RepresentationCache, use_representation_cache
+from .simulate.model_registry import ModelRegistry, model_registry
 from .synthesize.metamer import Metamer
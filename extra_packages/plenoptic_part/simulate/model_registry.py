@@ -0,0 +1,106 @@
+"""process-level registry of models, keyed by their reduced state dict
+
+Every time we load a saved metamer, we re-initialize its model from its
+``state_dict_reduced`` (which means creating or loading all its
+windows). When we load many metamers that share the same model (e.g., to
+compute distances or make figures), that's the same model over and over
+again, so ``from_state_dict_reduced`` instead gets the model from the
+registry here, which only initializes each model once and then hands out
+the same instance. The registry holds onto at most ``capacity`` models,
+dropping the least recently used one when it's full.
+
+Since the instance is shared, anything done to it (moving it with
+``to()``, calling forward, which sets its ``representation``, etc.) is
+seen by everyone using it. If you need to modify it, ask for a copy (see
+``from_state_dict_reduced``'s ``shared`` argument).
+"""
+import hashlib
+from collections import OrderedDict
+from .representation_cache import _hash_update
+
+
+class ModelRegistry(object):
+    r"""Size-bounded cache of initialized models, keyed by ``state_dict_reduced``
+
+    Parameters
+    ----------
+    capacity : int, optional
+        The maximum number of models to hold onto. If 0, we don't hold
+        onto any, and so every call initializes a new model.
+
+    Attributes
+    ----------
+    hits : int
+        The number of times we returned a model we already had
+    misses : int
+        The number of times we had to initialize a model
+
+    """
+
+    def __init__(self, capacity=4):
+        self._models = OrderedDict()
+        self._capacity = capacity
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def capacity(self):
+        r"""The maximum number of models to hold onto"""
+        return self._capacity
+
+    @capacity.setter
+    def capacity(self, capacity):
+        self._capacity = capacity
+        self._evict()
+
+    def __len__(self):
+        return len(self._models)
+
+    @staticmethod
+    def key(state_dict_reduced):
+        r"""Get the registry key for this ``state_dict_reduced``"""
+        h = hashlib.sha1()
+        _hash_update(h, state_dict_reduced)
+        return h.hexdigest()
+
+    def get(self, state_dict_reduced, constructor):
+        r"""Get the model for this ``state_dict_reduced``, initializing it if necessary
+
+        Parameters
+        ----------
+        state_dict_reduced : dict
+            The reduced state dict of the model
+        constructor : callable
+            Function which takes ``state_dict_reduced`` and returns the
+            initialized model, used if we don't have it yet.
+
+        Returns
+        -------
+        model : torch.nn.Module
+            The (shared) model
+
+        """
+        key = self.key(state_dict_reduced)
+        try:
+            model = self._models[key]
+            self._models.move_to_end(key)
+            self.hits += 1
+        except KeyError:
+            model = constructor(state_dict_reduced)
+            self.misses += 1
+            self._models[key] = model
+            self._evict()
+        return model
+
+    def _evict(self):
+        """drop the least recently used models until we're within capacity"""
+        while len(self._models) > max(self._capacity, 0):
+            self._models.popitem(last=False)
+
+    def clear(self):
+        r"""Drop all models"""
+        self._models = OrderedDict()
+
+
+# the registry used by the models' from_state_dict_reduced methods
+model_registry = ModelRegistry()
@@ -0,0 +1,735 @@
+"""alternative ways of storing and applying the pooling windows
+
+``PoolingWindows`` stores the windows separably, as dense angle and
+eccentricity windows, each the size of the image. The classes here wrap
+an initialized ``PoolingWindows`` object and pool with the same windows,
+stored or applied differently.
+
+The windows can also be stored in reduced precision (``window_dtype``,
+e.g., float16 or bfloat16), which halves their memory: they're smooth
+weights between 0 and 1, so they lose very little. We then cast the
+windows back to the input's dtype a chunk at a time when pooling (for
+the sparse windows, one eccentricity band at a time; for the dense
+ones, as many windows as fit in each chunk's memory), so that pooling
+is still accumulated in the input's precision without ever holding a
+full-precision copy of all the windows.
+
+Finally, ``SubsetPoolingWindows`` pools with only some of the windows of
+any of the above, for stochastic synthesis.
+"""
+import torch
+from torch import nn
+
+
+def windows_nbytes(windows):
+    r"""The number of bytes used to store the pooling windows
+
+    Parameters
+    ----------
+    windows : PoolingWindows or SparsePoolingWindows
+        The windows object
+
+    Returns
+    -------
+    nbytes : int
+        Number of bytes used by the windows tensors (for the dense
+        ``PoolingWindows``, the angle and eccentricity windows; for
+        ``SparsePoolingWindows``, the indices and values of the sparse
+        windows)
+
+    """
+    if isinstance(windows, SparsePoolingWindows):
+        return windows.nbytes
+    nbytes = 0
+    for w in [windows.angle_windows, windows.ecc_windows]:
+        for v in w.values():
+            nbytes += v.numel() * v.element_size()
+    return nbytes
+
+
+def _get_dtype(dtype):
+    """get the torch.dtype, if dtype is a str (e.g., 'float16')"""
+    if isinstance(dtype, str):
+        return getattr(torch, dtype)
+    return dtype
+
+
+class _WrappedPoolingWindows(nn.Module):
+    r"""Base class for objects that pool with the windows of a PoolingWindows object
+
+    Subclasses must implement ``_pool(x, scale, weights)`` and
+    ``_project(pooled_x, scale)``, which handle a single tensor, and
+    ``_cast_windows(dtype)``, which changes the dtype of their stored
+    windows; this class handles dictionaries and falls back to the
+    wrapped object for all other attributes and methods.
+
+    Parameters
+    ----------
+    windows : PoolingWindows
+        The initialized windows object to wrap
+
+    Attributes
+    ----------
+    window_dtype : torch.dtype or None
+        If not None, the dtype the windows are stored in, regardless of
+        the dtype ``to()`` is called with (see ``set_window_dtype``).
+
+    """
+
+    def __init__(self, windows):
+        super().__init__()
+        # we don't register the wrapped object as a sub-module, so we
+        # control what gets moved around by to()
+        object.__setattr__(self, '_dense', windows)
+        self.window_dtype = None
+
+    def set_window_dtype(self, window_dtype):
+        r"""Store the windows in window_dtype
+
+        The windows will stay in this dtype, even if ``to()`` is called
+        with another one (e.g., when casting the whole model to
+        float32), and are cast to the input's dtype (a chunk at a time)
+        when pooling.
+
+        Parameters
+        ----------
+        window_dtype : torch.dtype, str, or None
+            The dtype to store the windows in, e.g. ``torch.float16``
+            or ``'bfloat16'``. If None, the windows follow ``to()`` as
+            normal.
+
+        """
+        self.window_dtype = _get_dtype(window_dtype)
+        if self.window_dtype is not None:
+            self._cast_windows(self.window_dtype)
+
+    def __getattr__(self, name):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            dense = self.__dict__.get('_dense')
+            if dense is None:
+                raise
+            return getattr(dense, name)
+
+    def forward(self, x, idx=0, weights=None):
+        r"""Window and pool the input
+
+        This gives the same output as ``PoolingWindows.forward``.
+
+        Parameters
+        ----------
+        x : dict or torch.Tensor
+            Either a 4d tensor (batch, channel, height, width) or a
+            dictionary of them, whose keys are ``(scale, orientation)``
+            tuples or strs (which use the windows at scale ``idx``).
+        idx : int, optional
+            The scale of windows to use for tensors (and str keys).
+        weights : torch.Tensor or None, optional
+            If not None, multiply the pooled values at each scale by
+            ``weights[scale]``, which must broadcast with the (batch,
+            channel, eccentricity, angle) pooled values (see
+            ``ObserverModel._sf_weighting``).
+
+        Returns
+        -------
+        pooled_x : dict or torch.Tensor
+            3d tensor (batch, channel, windows) or dictionary of them,
+            same as ``x``.
+
+        """
+        if isinstance(x, dict):
+            pooled_x = {}
+            for k, v in x.items():
+                scale = k[0] if isinstance(k, tuple) else idx
+                pooled_x[k] = self._pool(v, scale, weights)
+            return pooled_x
+        return self._pool(x, idx, weights)
+
+    def project(self, pooled_x, idx=0):
+        r"""Project pooled values back onto the image
+
+        This gives the same output as ``PoolingWindows.project``: each
+        pixel gets the sum of the values of the windows it belongs to,
+        weighted by the window values at that pixel.
+
+        Parameters
+        ----------
+        pooled_x : dict or torch.Tensor
+            3d tensor (batch, channel, windows) or dictionary of them,
+            as returned by ``forward``.
+        idx : int, optional
+            The scale of windows to use for tensors (and str keys).
+
+        Returns
+        -------
+        x : dict or torch.Tensor
+            4d tensor (batch, channel, height, width) or dictionary of
+            them, same as ``pooled_x``.
+
+        """
+        if isinstance(pooled_x, dict):
+            x = {}
+            for k, v in pooled_x.items():
+                scale = k[0] if isinstance(k, tuple) else idx
+                x[k] = self._project(v, scale)
+            return x
+        return self._project(pooled_x, idx)
+
+
+class SparsePoolingWindows(_WrappedPoolingWindows):
+    r"""Pool with the windows of a PoolingWindows object, stored sparsely
+
+    ``PoolingWindows`` stores, for each scale, ``n_angles`` angle windows
+    and ``n_eccentricities`` eccentricity windows, all dense and the size
+    of the image at that scale, and pools by multiplying the image
+    against both. Each pooling window (the product of one angle and one
+    eccentricity window) is only non-zero in a small region, so here we
+    compute those products once and store them as a sparse ``(n_windows,
+    height*width)`` matrix, dropping all values smaller than
+    ``threshold`` times the largest value. Pooling and projecting are
+    then sparse matrix products. For small scaling values, this uses a
+    small fraction of the memory of the dense windows (for the gaussian
+    windows, whose tails extend across the whole image, this depends on
+    ``threshold``).
+
+    Once the sparse windows have been computed, we replace the dense
+    windows in the wrapped ``PoolingWindows`` object with shape-only
+    placeholders (expanded zero tensors, which use no memory), so their
+    shapes can still be checked. All other attributes and methods (e.g.,
+    ``plot_window_widths``) are those of the wrapped object, except
+    those that need the actual dense windows, like ``plot_windows``.
+
+    Parameters
+    ----------
+    windows : PoolingWindows
+        The initialized windows object to wrap. Its dense windows will be
+        replaced by placeholders.
+    threshold : float, optional
+        Window values smaller than ``threshold`` times the largest value
+        are dropped. If 0, we only drop exact zeros, and pooling is exact
+        (up to floating point error).
+
+    Attributes
+    ----------
+    windows : dict
+        Dictionary, with one key per scale, containing the sparse
+        ``(n_windows, height*width)`` windows. Windows are ordered
+        eccentricity-major (as in the output of ``PoolingWindows``).
+    n_angles : dict
+        The number of angle windows at each scale
+    n_eccentricities : dict
+        The number of eccentricity windows at each scale
+    img_shapes : dict
+        The (height, width) of the image at each scale
+
+    """
+
+    def __init__(self, windows, threshold=1e-6):
+        super().__init__(windows)
+        self.threshold = threshold
+        self.windows = {}
+        self.n_angles = {}
+        self.n_eccentricities = {}
+        self.img_shapes = {}
+        for scale, angle in windows.angle_windows.items():
+            ecc = windows.ecc_windows[scale]
+            self.windows[scale] = self._sparsify(angle, ecc, threshold)
+            self.n_angles[scale] = angle.shape[0]
+            self.n_eccentricities[scale] = ecc.shape[0]
+            self.img_shapes[scale] = tuple(angle.shape[-2:])
+            windows.angle_windows[scale] = self._placeholder(angle)
+            windows.ecc_windows[scale] = self._placeholder(ecc)
+
+    @staticmethod
+    def _placeholder(tensor):
+        """tensor with the same shape, dtype, and device, but no memory"""
+        return torch.zeros(1, dtype=tensor.dtype, device=tensor.device).expand(tensor.shape)
+
+    @staticmethod
+    def _sparsify(angle, ecc, threshold, max_block=2**24):
+        r"""Compute the sparse product of angle and eccentricity windows
+
+        We go through the eccentricity windows one at a time, only
+        multiplying against the angle windows within that eccentricity
+        window's support (and, if that's still large, a block of angle
+        windows at a time), so we never hold more than ``max_block``
+        dense products in memory.
+
+        Parameters
+        ----------
+        angle : torch.Tensor
+            The ``(n_angles, height, width)`` angle windows
+        ecc : torch.Tensor
+            The ``(n_eccentricities, height, width)`` eccentricity
+            windows
+        threshold : float
+            Products smaller than ``threshold`` times the largest
+            possible product are dropped.
+        max_block : int, optional
+            The maximum number of products to compute at once
+
+        Returns
+        -------
+        windows : torch.Tensor
+            Sparse, coalesced tensor of shape ``(n_eccentricities *
+            n_angles, height*width)``
+
+        """
+        n_angles = angle.shape[0]
+        angle = angle.flatten(1)
+        ecc = ecc.flatten(1)
+        angle_max = angle.max()
+        thresh = threshold * angle_max * ecc.max()
+        rows, cols, vals = [], [], []
+        for e in range(ecc.shape[0]):
+            pix = torch.nonzero(ecc[e] * angle_max > thresh).squeeze(1)
+            if pix.numel() == 0:
+                continue
+            block = max(1, max_block // pix.numel())
+            for a in range(0, n_angles, block):
+                prod = angle[a:a+block, pix] * ecc[e, pix]
+                a_idx, p_idx = torch.nonzero(prod > thresh, as_tuple=True)
+                rows.append(e * n_angles + a + a_idx)
+                cols.append(pix[p_idx])
+                vals.append(prod[a_idx, p_idx])
+        indices = torch.stack([torch.cat(rows), torch.cat(cols)])
+        return torch.sparse_coo_tensor(indices, torch.cat(vals),
+                                       (ecc.shape[0] * n_angles, angle.shape[1])).coalesce()
+
+    @property
+    def nbytes(self):
+        """number of bytes used to store the sparse windows"""
+        nbytes = 0
+        for w in self.windows.values():
+            nbytes += w.indices().numel() * w.indices().element_size()
+            nbytes += w.values().numel() * w.values().element_size()
+        return nbytes
+
+    def _cast_windows(self, dtype):
+        """change the dtype of the sparse windows"""
+        for k, v in self.windows.items():
+            self.windows[k] = v.to(dtype)
+
+    def _row_chunks(self, scale, dtype):
+        """the sparse windows from scale in dtype, one eccentricity band at a time
+
+        Yields the index of the first window and the (sparse) windows
+        for that band. If the windows are stored in reduced precision,
+        this way we only cast one band at a time to dtype.
+
+        """
+        windows = self.windows[scale]
+        if windows.dtype == dtype:
+            yield 0, windows
+            return
+        n_rows, n_pix = windows.shape
+        chunk_size = self.n_angles[scale]
+        indices, values = windows.indices(), windows.values()
+        # the windows are coalesced, so their indices are sorted by row
+        # and each chunk's non-zero values are contiguous
+        bounds = torch.arange(0, n_rows + chunk_size, chunk_size, device=indices.device)
+        offsets = torch.searchsorted(indices[0].contiguous(), bounds.clamp(max=n_rows)).tolist()
+        for i, start in enumerate(range(0, n_rows, chunk_size)):
+            idx = indices[:, offsets[i]:offsets[i+1]].clone()
+            idx[0] -= start
+            yield start, torch.sparse_coo_tensor(idx, values[offsets[i]:offsets[i+1]].to(dtype),
+                                                 (min(chunk_size, n_rows - start), n_pix))
+
+    def _pool(self, x, scale, weights=None):
+        """pool the 4d tensor x with the windows from scale"""
+        b, c = x.shape[:2]
+        flat = x.reshape(b * c, -1).t()
+        pooled = torch.cat([torch.sparse.mm(w, flat) for _, w in self._row_chunks(scale, x.dtype)])
+        pooled = pooled.t().reshape(b, c, self.n_eccentricities[scale], self.n_angles[scale])
+        if weights is not None:
+            pooled = pooled * weights[scale]
+        return pooled.flatten(2, 3)
+
+    def _project(self, pooled_x, scale):
+        """project the 3d tensor pooled_x back into image space, using windows from scale"""
+        b, c = pooled_x.shape[:2]
+        flat = pooled_x.reshape(b * c, -1).t()
+        x = 0
+        for start, w in self._row_chunks(scale, pooled_x.dtype):
+            x = x + torch.sparse.mm(w.t(), flat[start:start+w.shape[0]])
+        return x.t().reshape(b, c, *self.img_shapes[scale])
+
+    def to(self, *args, **kwargs):
+        r"""Move and/or cast the sparse windows
+
+        See ``torch.nn.Module.to`` for arguments.
+
+        """
+        for k, v in self.windows.items():
+            self.windows[k] = v.to(*args, **kwargs)
+        if self.window_dtype is not None:
+            self._cast_windows(self.window_dtype)
+        nn.Module.to(self, *args, **kwargs)
+        return self
+
+    def plot_windows(self, *args, **kwargs):
+        raise Exception("Can't plot windows with the sparse window backend! Initialize the model "
+                        "with window_backend='dense' instead")
+
+    def plot_window_checks(self, *args, **kwargs):
+        raise Exception("Can't plot windows with the sparse window backend! Initialize the model "
+                        "with window_backend='dense' instead")
+
+
+def _angle_chunk_size(x, angle, chunk_size):
+    """number of angle windows to cast to x's dtype at once, when pooling chunk_size ecc windows"""
+    if angle.dtype == x.dtype:
+        return angle.shape[0]
+    # then the windows are stored in reduced precision. we don't want to
+    # cast all of them at once, so we cast as many as fit in the memory
+    # of each chunk's intermediate tensor (batch, channel, chunk_size,
+    # pixels)
+    return max(1, x.shape[0] * x.shape[1] * chunk_size)
+
+
+def _pool_chunks(x, angle, ecc, chunk_size):
+    """pool 3d x (batch, channel, pixels) with chunk_size eccentricity windows at a time"""
+    # if the windows are stored in reduced precision, we still compute in
+    # x's dtype, casting them a chunk at a time
+    angle_chunk_size = _angle_chunk_size(x, angle, chunk_size)
+    pooled = x.new_empty((*x.shape[:2], ecc.shape[0], angle.shape[0]))
+    for e in range(0, ecc.shape[0], chunk_size):
+        windowed = x.unsqueeze(2) * ecc[e:e+chunk_size].to(x.dtype)
+        for a in range(0, angle.shape[0], angle_chunk_size):
+            pooled[:, :, e:e+chunk_size, a:a+angle_chunk_size] = torch.matmul(
+                windowed, angle[a:a+angle_chunk_size].to(x.dtype).t())
+    return pooled
+
+
+def _project_chunks(pooled_x, angle, ecc, chunk_size):
+    """project 4d pooled_x (batch, channel, ecc, angle) with chunk_size eccentricity windows at a time"""
+    angle_chunk_size = _angle_chunk_size(pooled_x, angle, chunk_size)
+    x = pooled_x.new_zeros((*pooled_x.shape[:2], ecc.shape[1]))
+    for e in range(0, ecc.shape[0], chunk_size):
+        projected = 0
+        for a in range(0, angle.shape[0], angle_chunk_size):
+            projected = projected + torch.matmul(
+                pooled_x[:, :, e:e+chunk_size, a:a+angle_chunk_size],
+                angle[a:a+angle_chunk_size].to(pooled_x.dtype))
+        x += (projected * ecc[e:e+chunk_size].to(pooled_x.dtype)).sum(2)
+    return x
+
+
+class _ChunkedPool(torch.autograd.Function):
+    r"""Pool in chunks, without storing any of the chunks for the backward pass
+
+    The gradient of pooling with respect to the input is the projection
+    of the gradient with respect to the pooled values, so we compute it
+    (in chunks, again) from the windows alone.
+
+    """
+
+    @staticmethod
+    def forward(ctx, x, angle, ecc, chunk_size):
+        ctx.save_for_backward(angle, ecc)
+        ctx.chunk_size = chunk_size
+        return _pool_chunks(x, angle, ecc, chunk_size)
+
+    @staticmethod
+    def backward(ctx, grad_pooled):
+        angle, ecc = ctx.saved_tensors
+        grad_x = None
+        if ctx.needs_input_grad[0]:
+            grad_x = _project_chunks(grad_pooled, angle, ecc, ctx.chunk_size)
+        return grad_x, None, None, None
+
+
+class ChunkedPoolingWindows(_WrappedPoolingWindows):
+    r"""Pool with the windows of a PoolingWindows object, a chunk at a time
+
+    Pooling a ``(batch, channel, height, width)`` input against all
+    ``n_eccentricities`` eccentricity windows at once creates a
+    ``(batch, channel, n_eccentricities, height, width)`` intermediate
+    tensor (which autograd then holds onto for the backward pass); for
+    small scaling values and large images, this dominates the model's
+    peak memory. Here, we instead go through the eccentricity windows in
+    chunks of ``chunk_size``, multiplying each chunk against the input
+    and then all the angle windows, so that we only ever hold one
+    chunk's intermediate tensor. Nothing is stored for the backward pass
+    other than the windows themselves: the gradient is computed chunk by
+    chunk as well (by projecting the gradient with respect to the pooled
+    values back into image space). This is slower than pooling all at
+    once, more so the smaller the chunks.
+
+    The chunk size can either be set directly or picked automatically
+    from ``memory_budget``, the number of GB each chunk's intermediate
+    tensor may take up (so it depends on the size of the input, which
+    we only know when pooling).
+
+    The windows are the same as in the wrapped ``PoolingWindows``
+    object, and all its other attributes and methods (e.g.,
+    ``plot_windows``) are available.
+
+    Parameters
+    ----------
+    windows : PoolingWindows
+        The initialized windows object to wrap
+    memory_budget : float or None, optional
+        Memory (in GB) to use for each chunk's intermediate tensor. We
+        use the largest chunk size that stays within this (always at
+        least one eccentricity window). Ignored if ``chunk_size`` is set.
+    chunk_size : int or None, optional
+        The number of eccentricity windows to pool at once. If set,
+        overrides ``memory_budget``.
+
+    """
+
+    def __init__(self, windows, memory_budget=1, chunk_size=None):
+        super().__init__(windows)
+        if memory_budget is None and chunk_size is None:
+            raise Exception("One of memory_budget or chunk_size must be set!")
+        self.memory_budget = memory_budget
+        self.chunk_size = chunk_size
+
+    def get_chunk_size(self, x, scale):
+        r"""Get the number of eccentricity windows to pool x with at once
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            The 4d tensor to pool (or 3d tensor to project; we only use
+            the number of elements per pixel, its first two dimensions)
+        scale : int
+            The scale of windows to use
+
+        Returns
+        -------
+        chunk_size : int
+            The number of eccentricity windows per chunk
+
+        """
+        if self.chunk_size is not None:
+            return self.chunk_size
+        ecc = self._dense.ecc_windows[scale]
+        chunk_bytes = (x.shape[0] * x.shape[1] * ecc[0].numel() * x.element_size())
+        return max(1, int(self.memory_budget * 1e9 // chunk_bytes))
+
+    def _pool(self, x, scale, weights=None):
+        """pool the 4d tensor x with the windows from scale"""
+        angle = self._dense.angle_windows[scale].flatten(1)
+        ecc = self._dense.ecc_windows[scale].flatten(1)
+        pooled = _ChunkedPool.apply(x.flatten(2), angle, ecc, self.get_chunk_size(x, scale))
+        if weights is not None:
+            pooled = pooled * weights[scale]
+        return pooled.flatten(2, 3)
+
+    def _project(self, pooled_x, scale):
+        """project the 3d tensor pooled_x back into image space, using windows from scale"""
+        angle = self._dense.angle_windows[scale]
+        ecc = self._dense.ecc_windows[scale]
+        pooled_x = pooled_x.reshape(*pooled_x.shape[:2], ecc.shape[0], angle.shape[0])
+        x = _project_chunks(pooled_x, angle.flatten(1), ecc.flatten(1),
+                            self.get_chunk_size(pooled_x, scale))
+        return x.reshape(*x.shape[:2], *angle.shape[-2:])
+
+    def _cast_windows(self, dtype):
+        """change the dtype of the dense windows"""
+        for windows in [self._dense.angle_windows, self._dense.ecc_windows]:
+            for k, v in windows.items():
+                windows[k] = v.to(dtype)
+
+    def to(self, *args, **kwargs):
+        r"""Move and/or cast the windows
+
+        See ``torch.nn.Module.to`` for arguments.
+
+        """
+        self._dense.to(*args, **kwargs)
+        if self.window_dtype is not None:
+            self._cast_windows(self.window_dtype)
+        nn.Module.to(self, *args, **kwargs)
+        return self
+
+
+def _subset_windows(angle, ecc, ecc_idx, angle_idx, dtype):
+    """the (n, pixels) product windows ecc[ecc_idx] * angle[angle_idx], in dtype"""
+    return ecc[ecc_idx].to(dtype) * angle[angle_idx].to(dtype)
+
+
+def _pool_subset_chunks(x, angle, ecc, ecc_idx, angle_idx, chunk_size):
+    """pool 3d x (batch, channel, pixels) with chunk_size of the selected windows at a time"""
+    pooled = x.new_empty((*x.shape[:2], ecc_idx.shape[0]))
+    for i in range(0, ecc_idx.shape[0], chunk_size):
+        windows = _subset_windows(angle, ecc, ecc_idx[i:i+chunk_size],
+                                  angle_idx[i:i+chunk_size], x.dtype)
+        pooled[:, :, i:i+chunk_size] = torch.matmul(x, windows.t())
+    return pooled
+
+
+def _project_subset_chunks(pooled_x, angle, ecc, ecc_idx, angle_idx, chunk_size):
+    """project 3d pooled_x (batch, channel, selected windows) with chunk_size windows at a time"""
+    x = pooled_x.new_zeros((*pooled_x.shape[:2], ecc.shape[1]))
+    for i in range(0, ecc_idx.shape[0], chunk_size):
+        windows = _subset_windows(angle, ecc, ecc_idx[i:i+chunk_size],
+                                  angle_idx[i:i+chunk_size], pooled_x.dtype)
+        x += torch.matmul(pooled_x[:, :, i:i+chunk_size], windows)
+    return x
+
+
+class _SubsetPool(torch.autograd.Function):
+    r"""Pool with a subset of the windows, without storing them for the backward pass
+
+    As with ``_ChunkedPool``, the gradient is the projection of the
+    gradient with respect to the pooled values, which we compute (in
+    chunks) from the separable windows and the indices alone.
+
+    """
+
+    @staticmethod
+    def forward(ctx, x, angle, ecc, ecc_idx, angle_idx, chunk_size):
+        ctx.save_for_backward(angle, ecc, ecc_idx, angle_idx)
+        ctx.chunk_size = chunk_size
+        return _pool_subset_chunks(x, angle, ecc, ecc_idx, angle_idx, chunk_size)
+
+    @staticmethod
+    def backward(ctx, grad_pooled):
+        angle, ecc, ecc_idx, angle_idx = ctx.saved_tensors
+        grad_x = None
+        if ctx.needs_input_grad[0]:
+            grad_x = _project_subset_chunks(grad_pooled, angle, ecc, ecc_idx, angle_idx,
+                                            ctx.chunk_size)
+        return grad_x, None, None, None, None, None
+
+
+class SubsetPoolingWindows(_WrappedPoolingWindows):
+    r"""Pool with only a subset of the windows of another windows object
+
+    Each pooling window is the product of one eccentricity and one angle
+    window, and ``PoolingWindows`` (and the other backends) pool against
+    all of them. Here, we only pool against the windows in
+    ``window_subset``, so the cost of pooling (and of its backward pass)
+    scales with the number of windows selected rather than the total.
+    For the dense windows, we compute the product windows we need (a
+    chunk at a time, so they take up at most ``memory_budget`` GB) and
+    pool against them; for the sparse windows, we select the rows we
+    need from the sparse matrix. The pooled values contain only the
+    selected windows, in the order given by ``window_subset``.
+
+    This is used for stochastic synthesis (see ``window_fraction`` in
+    ``Synthesis``), where we draw a new subset every iteration, so the
+    wrapper is cheap to create and doesn't copy any windows. See
+    ``PooledVentralStream.set_window_subset``.
+
+    Parameters
+    ----------
+    windows : PoolingWindows, SparsePoolingWindows, or ChunkedPoolingWindows
+        The windows object to select from
+    window_subset : torch.Tensor
+        1d tensor of ints, the indices of the windows to pool with, in
+        the (eccentricity-major) order of the windows in the pooled
+        output of ``windows``. The same windows are used at each scale.
+    memory_budget : float, optional
+        Memory (in GB) to use for each chunk of product windows (ignored
+        for the sparse windows).
+
+    """
+
+    def __init__(self, windows, window_subset, memory_budget=1):
+        super().__init__(windows)
+        self.register_buffer('window_subset', window_subset)
+        self.memory_budget = memory_budget
+        self.window_dtype = getattr(windows, 'window_dtype', None)
+
+    def _shape(self, scale):
+        """the number of eccentricity and angle windows at scale"""
+        return (self._dense.ecc_windows[scale].shape[0],
+                self._dense.angle_windows[scale].shape[0])
+
+    def _pool(self, x, scale, weights=None):
+        """pool the 4d tensor x with the selected windows from scale"""
+        n_ecc, n_angles = self._shape(scale)
+        flat = x.flatten(2)
+        if isinstance(self._dense, SparsePoolingWindows):
+            windows = self._dense.windows[scale].index_select(0, self.window_subset)
+            pooled = torch.sparse.mm(windows.to(x.dtype),
+                                     flat.reshape(-1, flat.shape[-1]).t()).t()
+            pooled = pooled.reshape(*flat.shape[:2], -1)
+        else:
+            chunk_size = max(1, int(self.memory_budget * 1e9 //
+                                    (flat.shape[-1] * flat.element_size())))
+            pooled = _SubsetPool.apply(flat, self._dense.angle_windows[scale].flatten(1),
+                                       self._dense.ecc_windows[scale].flatten(1),
+                                       torch.div(self.window_subset, n_angles,
+                                                 rounding_mode='floor'),
+                                       self.window_subset % n_angles, chunk_size)
+        if weights is not None:
+            weights = weights[scale] * pooled.new_ones((n_ecc, n_angles))
+            pooled = pooled * weights.flatten(-2)[..., self.window_subset]
+        return pooled
+
+    def _project(self, pooled_x, scale):
+        """project the 3d tensor pooled_x (selected windows only) back into image space"""
+        n_ecc, n_angles = self._shape(scale)
+        full = pooled_x.new_zeros((*pooled_x.shape[:2], n_ecc * n_angles))
+        full[..., self.window_subset] = pooled_x
+        return self._dense.project(full, scale)
+
+    def _cast_windows(self, dtype):
+        raise Exception("SubsetPoolingWindows doesn't store any windows, set the window_dtype "
+                        "of the wrapped windows instead!")
+
+    def to(self, *args, **kwargs):
+        r"""Move and/or cast the wrapped windows (and move the subset indices)
+
+        See ``torch.nn.Module.to`` for arguments.
+
+        """
+        self._dense.to(*args, **kwargs)
+        nn.Module.to(self, *args, **kwargs)
+        return self
+
+
+def setup_windows(windows, window_backend='dense', memory_budget=None, window_dtype=None):
+    r"""Get the windows object for the requested backend
+
+    Parameters
+    ----------
+    windows : PoolingWindows
+        The initialized (dense) windows object
+    window_backend : {'dense', 'sparse', 'chunked'}, optional
+        Which backend to use. If 'dense', we return ``windows``
+        unchanged. If 'sparse', we wrap it in a
+        ``SparsePoolingWindows`` object. If 'chunked', we wrap it in a
+        ``ChunkedPoolingWindows`` object.
+    memory_budget : float or None, optional
+        Only used if ``window_backend='chunked'``: the memory (in GB) to
+        use for each chunk. If None, we use the
+        ``ChunkedPoolingWindows`` default.
+    window_dtype : torch.dtype, str, or None, optional
+        If not None, the dtype to store the windows in (e.g.,
+        ``'float16'`` or ``'bfloat16'``), see
+        ``_WrappedPoolingWindows.set_window_dtype``. ``PoolingWindows``
+        can only pool inputs of the same dtype as its windows, so in this
+        case the 'dense' backend pools like the 'chunked' one.
+
+    Returns
+    -------
+    windows : PoolingWindows, SparsePoolingWindows, or ChunkedPoolingWindows
+        The windows object to use for pooling
+
+    """
+    window_dtype = _get_dtype(window_dtype)
+    if window_dtype == windows.angle_windows[0].dtype:
+        window_dtype = None
+    if window_backend == 'dense':
+        if window_dtype is None:
+            return windows
+        window_backend = 'chunked'
+    if window_backend == 'sparse':
+        wrapped = SparsePoolingWindows(windows)
+    elif window_backend == 'chunked':
+        if memory_budget is None:
+            wrapped = ChunkedPoolingWindows(windows)
+        else:
+            wrapped = ChunkedPoolingWindows(windows, memory_budget)
+    else:
+        raise Exception(f"Don't know how to handle window_backend {window_backend}! Must be "
+                        "one of: 'dense', 'sparse', 'chunked'")
+    wrapped.set_window_dtype(window_dtype)
+    return wrapped
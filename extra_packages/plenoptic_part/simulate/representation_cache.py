@@ -0,0 +1,299 @@
+"""on-disk cache of model representations, shared across processes and runs
+
+We compute the representation of the same reference image with the same
+model many times: once per metamer we synthesize (for each seed,
+initialization, etc.), and again whenever we compute distances or make
+summary plots. Here, we cache those representations on disk, keyed by a
+hash of the image, the model's ``state_dict_reduced`` (and any
+parameters), the subset of windows it's pooling with (if any), and the
+arguments passed to forward, so each of them only needs to be computed
+once.
+
+Caching is opt-in: models only use their cache inside a
+``use_representation_cache()`` block (which ``Synthesis`` enters while
+analyzing ``base_signal``). Otherwise, every image we analyze without
+gradients (e.g., each stored iteration of the image being synthesized)
+would be hashed and written to disk, pushing the reference images out.
+
+Each cached representation is a raw ``{key}.npy`` file, memory-mapped
+when loaded, plus a small ``{key}.pt`` file, which contains the layout of
+the model's ``representation`` dictionary (so we can restore it without
+calling forward). The ``.pt`` file is written last, so if it exists, the
+entry is complete. The cache is bounded in size: when it grows beyond
+``max_size``, we remove the least recently used entries (tracked using
+the files' modification times, which we update on every hit, so that
+several processes can share a cache without sharing an index).
+"""
+import os
+import glob
+import hashlib
+import inspect
+import functools
+import contextlib
+import threading
+import os.path as op
+import numpy as np
+import torch
+from .window_cache import _atomic_save, _np_save, _torch_save
+
+# entries of state_dict_reduced that change how a representation is
+# computed, but not its value
+_IGNORED_KEYS = ['cache_dir', 'window_memory_budget', 'gradient_checkpointing']
+
+# how many use_representation_cache() blocks we're inside, per thread
+_ENABLED = threading.local()
+
+
+@contextlib.contextmanager
+def use_representation_cache():
+    r"""Context manager that lets models use their representation cache
+
+    Outside of this block, forward ignores the model's
+    ``representation_cache`` (see ``cached_forward``). Blocks can be
+    nested.
+
+    """
+    _ENABLED.depth = getattr(_ENABLED, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _ENABLED.depth -= 1
+
+
+def representation_cache_enabled():
+    r"""Whether we're inside a ``use_representation_cache()`` block"""
+    return getattr(_ENABLED, 'depth', 0) > 0
+
+
+def _hash_update(h, obj):
+    """update hashlib object h with a canonical serialization of obj"""
+    if isinstance(obj, torch.Tensor):
+        obj = obj.detach().to('cpu').numpy()
+    if isinstance(obj, np.ndarray):
+        h.update(f'array{obj.dtype}{obj.shape}'.encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, dict):
+        h.update(b'dict')
+        for k in sorted(obj.keys(), key=repr):
+            _hash_update(h, k)
+            _hash_update(h, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f'{type(obj).__name__}{len(obj)}'.encode())
+        for v in obj:
+            _hash_update(h, v)
+    else:
+        h.update(repr(obj).encode())
+
+
+class RepresentationCache(object):
+    r"""Size-bounded, on-disk cache of model representations
+
+    Set a model's ``representation_cache`` attribute to an instance of
+    this class and every call to its forward inside a
+    ``use_representation_cache()`` block (on an image we don't need
+    gradients for) will first look in the cache. See
+    ``cached_forward``.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The directory to store the cached representations in. Can be
+        shared by several processes and models.
+    max_size : float, optional
+        The maximum size of the cache (in GB). Whenever we add an entry
+        that brings the cache above this size, we remove the least
+        recently used entries until it's below it again.
+
+    Attributes
+    ----------
+    hits : int
+        The number of times (in this process) we found the representation
+        in the cache
+    misses : int
+        The number of times (in this process) we had to compute the
+        representation
+
+    """
+
+    def __init__(self, cache_dir, max_size=10):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, image, model, forward_kwargs={}):
+        r"""Get the key for the representation of image with model
+
+        Parameters
+        ----------
+        image : torch.Tensor
+            The image passed to forward
+        model : torch.nn.Module
+            The model. Must have a ``state_dict_reduced`` attribute. If
+            it has a ``window_subset`` (see
+            ``PooledVentralStream.set_window_subset``), that's part of
+            the key as well.
+        forward_kwargs : dict, optional
+            Any other arguments passed to forward
+
+        Returns
+        -------
+        key : str
+            The hex digest identifying this representation
+
+        """
+        h = hashlib.sha1()
+        _hash_update(h, type(model).__name__)
+        _hash_update(h, {k: v for k, v in model.state_dict_reduced.items()
+                         if k not in _IGNORED_KEYS})
+        # e.g., the spatial frequency weighting of the ObserverModel
+        _hash_update(h, dict(model.named_parameters()))
+        # only hashed if set, so the keys of full representations don't
+        # depend on whether the model supports subsets
+        window_subset = getattr(model, 'window_subset', None)
+        if window_subset is not None:
+            _hash_update(h, {'window_subset': window_subset})
+        _hash_update(h, forward_kwargs)
+        _hash_update(h, image)
+        return h.hexdigest()
+
+    def _path(self, key, ext):
+        return op.join(self.cache_dir, f'{key}.{ext}')
+
+    def get(self, key):
+        r"""Load the cached representation with this key
+
+        Parameters
+        ----------
+        key : str
+            The key, from ``self.key``
+
+        Returns
+        -------
+        output : torch.Tensor or None
+            The cached output of forward (memory-mapped), or None if it
+            isn't in the cache
+        layout : list or None
+            List of ``(key, shape)`` tuples giving the layout of the
+            model's ``representation`` attribute (or None if the model
+            doesn't have one)
+
+        """
+        if not op.exists(self._path(key, 'pt')):
+            self.misses += 1
+            return None, None
+        try:
+            layout = torch.load(self._path(key, 'pt'))
+            output = torch.from_numpy(np.load(self._path(key, 'npy'), mmap_mode='c'))
+            # mark it as recently used
+            os.utime(self._path(key, 'npy'))
+        except (OSError, ValueError, EOFError):
+            # then another process evicted it while we were loading it
+            self.misses += 1
+            return None, None
+        self.hits += 1
+        return output, layout
+
+    def put(self, key, output, layout=None):
+        r"""Add a representation to the cache, evicting old entries if needed
+
+        Parameters
+        ----------
+        key : str
+            The key, from ``self.key``
+        output : torch.Tensor
+            The output of forward
+        layout : list or None, optional
+            List of ``(key, shape)`` tuples giving the layout of the
+            model's ``representation`` attribute
+
+        """
+        _atomic_save(_np_save, self._path(key, 'npy'), output.detach().to('cpu').numpy())
+        _atomic_save(_torch_save, self._path(key, 'pt'), layout)
+        self.evict()
+
+    def size(self):
+        r"""Get the current size of the cache, in GB"""
+        return sum([op.getsize(p) for p in glob.glob(op.join(self.cache_dir, '*.npy'))]) / 1e9
+
+    def evict(self):
+        r"""Remove least recently used entries until the cache fits in ``max_size``"""
+        entries = []
+        for p in glob.glob(op.join(self.cache_dir, '*.npy')):
+            try:
+                entries.append((op.getmtime(p), op.getsize(p), p))
+            except OSError:
+                continue
+        total = sum([e[1] for e in entries])
+        for _, nbytes, p in sorted(entries):
+            if total <= self.max_size * 1e9:
+                break
+            # remove the .pt first, so the entry is never half-there
+            for path in [p.replace('.npy', '.pt'), p]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= nbytes
+
+    def clear(self):
+        r"""Remove all entries from the cache"""
+        for p in glob.glob(op.join(self.cache_dir, '*.pt')) + glob.glob(op.join(self.cache_dir,
+                                                                                 '*.npy')):
+            os.remove(p)
+
+
+def cached_forward(forward):
+    r"""Decorator for a model's forward method, to use its representation cache
+
+    If the model's ``representation_cache`` attribute is a
+    ``RepresentationCache`` and we're inside a
+    ``use_representation_cache()`` block, we look for the representation
+    of the image in it before calling forward (and add it, if it's not
+    there). Even then, we only do this when the output doesn't need to
+    be differentiable (i.e., when gradients are disabled, or neither the
+    image nor any of the model's parameters require them).
+
+    On a hit, we also restore the model's ``representation`` attribute
+    and (if the model has them) set its intermediates to be recomputed
+    from the image the first time they're accessed, so the model looks
+    as though forward had been called.
+
+    """
+    signature = inspect.signature(forward)
+
+    @functools.wraps(forward)
+    def wrapper(self, image, *args, **kwargs):
+        cache = getattr(self, 'representation_cache', None)
+        if (cache is None or not representation_cache_enabled() or
+                (torch.is_grad_enabled() and
+                 (image.requires_grad or any([p.requires_grad for p in self.parameters()])))):
+            return forward(self, image, *args, **kwargs)
+        bound = signature.bind(self, image, *args, **kwargs)
+        bound.apply_defaults()
+        forward_kwargs = dict(list(bound.arguments.items())[2:])
+        while image.ndimension() < 4:
+            image = image.unsqueeze(0)
+        key = cache.key(image, self, forward_kwargs)
+        output, layout = cache.get(key)
+        if output is None:
+            output = forward(self, image, **forward_kwargs)
+            representation = getattr(self, 'representation', None)
+            if isinstance(representation, dict):
+                layout = [(k, v.shape) for k, v in representation.items()]
+            cache.put(key, output, layout)
+            return output
+        output = output.to(image.device)
+        if layout is not None:
+            representation = {}
+            idx = 0
+            for k, shape in layout:
+                representation[k] = output[:, :, idx:idx+shape[-1]].reshape(shape)
+                idx += shape[-1]
+            self.representation = representation
+        if hasattr(self, '_clear_intermediates'):
+            self._clear_intermediates(image, **forward_kwargs)
+        return output
+
+    return wrapper
@@ -0,0 +1,158 @@
+"""models for analyzing images at several scaling values at once
+
+Everything in the ``PooledV1`` model up to pooling (the steerable
+pyramid, the complex cell responses, and their normalization) is
+independent of the scaling value, which only changes the pooling
+windows. When we want the representation of the same image at several
+scaling values (e.g., to synthesize or compute distances for all
+scaling values of one reference image), we can therefore compute those
+once and pool them with each set of windows.
+"""
+import torch
+from torch import nn
+from ..tools.optim import zscore_stats
+from .ventral_stream import PooledV1
+
+
+class PooledV1Sweep(nn.Module):
+    r"""PooledV1 models at several scaling values, sharing their steerable pyramid
+
+    We initialize one ``PooledV1`` model per scaling value (so each has
+    its own windows), with a single steerable pyramid between them. On
+    forward, we compute the pyramid coefficients, complex cell responses,
+    and their normalization once, and then pool them with each model's
+    windows.
+
+    The representation of each model is identical to what it would be on
+    its own, but the individual models don't store their intermediate
+    results (``pyr_coeffs``, etc.); each model's ``representation``
+    attribute is set, so the models' plotting methods can be used as
+    normal.
+
+    Parameters
+    ----------
+    scaling : list
+        The scaling values to use.
+    kwargs :
+        All other arguments (``img_res``, ``num_scales``, ``order``,
+        etc.) are the same as for ``PooledV1`` and are shared by all
+        the models.
+
+    Attributes
+    ----------
+    scaling : list
+        The scaling values, in the same order as ``models``
+    models : torch.nn.ModuleList
+        The ``PooledV1`` models, one per scaling value
+    complex_steerable_pyramid : plenoptic.simul.Steerable_Pyramid_Freq
+        The steerable pyramid shared by all models
+    scales : list
+        List of the scales in the models, from fine to coarse.
+
+    """
+
+    def __init__(self, scaling, img_res, num_scales=4, order=3, min_eccentricity=.5,
+                 max_eccentricity=15, transition_region_width=.5, normalize_dict={},
+                 cache_dir=None, window_type='cosine', std_dev=None, moments=[],
+                 window_backend='dense', window_memory_budget=None):
+        super().__init__()
+        self.scaling = list(scaling)
+        models = []
+        for sc in self.scaling:
+            model = PooledV1(sc, img_res, num_scales, order, min_eccentricity, max_eccentricity,
+                             transition_region_width, normalize_dict, cache_dir, window_type,
+                             std_dev, moments, window_backend, window_memory_budget)
+            if models:
+                # the pyramids are all identical, so just share the first one
+                model.complex_steerable_pyramid = models[0].complex_steerable_pyramid
+            model.store_intermediates = False
+            models.append(model)
+        self.models = nn.ModuleList(models)
+        self.complex_steerable_pyramid = models[0].complex_steerable_pyramid
+        self.scales = models[0].scales
+        self.num_scales = num_scales
+
+    def to(self, *args, **kwargs):
+        r"""Moves and/or casts the parameters, buffers, and windows of all models
+
+        See ``PooledV1.to`` for details.
+
+        """
+        for model in self.models:
+            model.to(*args, **kwargs)
+        return self
+
+    def _pool(self, model, complex_cell_responses, cone_responses, image, scales):
+        """pool the responses with one model's windows, returning its output"""
+        representation = {}
+        if complex_cell_responses:
+            representation.update(model.PoolingWindows(complex_cell_responses))
+        if 'mean_luminance' in scales:
+            moments = model._calculate_moments(image, 2 in model._moments, 3 in model._moments,
+                                               4 in model._moments, mean_image=cone_responses)
+            representation['mean_luminance'] = moments.pop('mean')
+            representation.update({f'image_moment_{k}': v for k, v in moments.items()})
+        model.representation = representation
+        return model.representation_to_output()
+
+    def forward(self, image, scales=[], split_batch=False):
+        r"""Generate the V1 representation of an image at each scaling value
+
+        Parameters
+        ----------
+        image : torch.Tensor
+            A 4d tensor (batch, channel, height, width) containing the
+            image(s) to analyze.
+        scales : list, optional
+            Which scales to include in the returned representation, see
+            ``PooledV1.forward``.
+        split_batch : bool, optional
+            If False, we compute the representation of every image in
+            the batch at every scaling value. If True, the batch must
+            contain one image per scaling value, and we compute the
+            representation of each image at its corresponding scaling
+            value only (this is what you want when synthesizing metamers
+            for all scaling values at once).
+
+        Returns
+        -------
+        representation : dict
+            Dictionary with one key per scaling value, each containing
+            the 3d output of that scaling's ``PooledV1`` model (with a
+            batch of 1 if ``split_batch=True``).
+
+        """
+        while image.ndimension() < 4:
+            image = image.unsqueeze(0)
+        if split_batch and image.shape[0] != len(self.scaling):
+            raise Exception(f"With split_batch=True, image must contain one image per scaling "
+                            f"value ({len(self.scaling)}), but got {image.shape[0]}!")
+        if not scales:
+            scales = self.scales
+        normalize_dict = self.models[0].normalize_dict
+        complex_cell_responses = {}
+        if any([i in self.complex_steerable_pyramid.scales for i in scales]):
+            pyr_coeffs = self.complex_steerable_pyramid(image, scales)
+            complex_cell_responses = dict((k, torch.pow(v, 2).abs())
+                                          for k, v in pyr_coeffs.items()
+                                          if not isinstance(k, str))
+        cone_responses = image
+        if normalize_dict:
+            to_normalize = {'cone_responses': cone_responses,
+                            'complex_cell_responses': complex_cell_responses}
+            normalized = zscore_stats(normalize_dict,
+                                      **dict((k, v) for k, v in to_normalize.items()
+                                             if k in normalize_dict))
+            cone_responses = normalized.get('cone_responses', cone_responses)
+            complex_cell_responses = normalized.get('complex_cell_responses',
+                                                    complex_cell_responses)
+        representation = {}
+        for i, (sc, model) in enumerate(zip(self.scaling, self.models)):
+            if split_batch:
+                representation[sc] = self._pool(
+                    model, dict((k, v[i:i+1]) for k, v in complex_cell_responses.items()),
+                    cone_responses[i:i+1], image[i:i+1], scales)
+            else:
+                representation[sc] = self._pool(model, complex_cell_responses, cone_responses,
+                                                image, scales)
+        return representation
@@ -1,6 +1,7 @@
 """functions for ventral stream perceptual models, as seen in Freeman and Simoncelli, 2011
 
 """
+import copy
 import torch
 import warnings
 import pyrtools as pt
@@ -8,14 +9,42 @@ import matplotlib as mpl
 import matplotlib.pyplot as plt
 from torch import nn
 import plenoptic as po
+from torch.utils.checkpoint import checkpoint
 from ..tools.display import clean_up_axes, update_stem, clean_stem_plot
-from ..tools.optim import zscore_stats
+from ..tools.optim import zscore_stats, reduce_norm_stats
+from ..tools.profiling import profile_phase
+from .pooling_backends import setup_windows, SubsetPoolingWindows
+from .window_cache import get_windows, get_window_coverage, window_cache_path
+from .representation_cache import cached_forward
+from .model_registry import model_registry
+from .window_metadata import (window_metadata, summarize_window_sizes, plot_window_widths,
+                              plot_window_areas)
 import sys
 import os.path as op
 sys.path.append(op.join(op.dirname(op.realpath(__file__)), '..', '..', 'pooling-windows'))
 from pooling import PoolingWindows
 
 
+def _intermediate(name):
+    """property for an intermediate result of forward, see ``store_intermediates``
+
+    When the model's ``store_intermediates`` is False, forward doesn't
+    keep the intermediate with this name around, so we recompute it (from
+    the last image passed to forward) the first time it's asked for.
+    """
+    private = '_' + name
+
+    def getter(self):
+        if getattr(self, private, None) is None and getattr(self, '_image_ref', None) is not None:
+            self._compute_intermediates()
+        return getattr(self, private, None)
+
+    def setter(self, value):
+        setattr(self, private, value)
+
+    return property(getter, setter)
+
+
 class PooledVentralStream(nn.Module):
     r"""Generic class that sets up scaling windows
 
@@ -51,6 +80,12 @@ class PooledVentralStream(nn.Module):
     each scale separately, changing the img_res (and potentially
     min_eccentricity) values in that save path appropriately.
 
+    We also write a memory-mapped copy of the windows to
+    ``{cache_dir}/mmap/`` (see ``window_cache.py``), and, if it exists,
+    attach to that instead of loading the windows with ``torch.load``,
+    so that all processes on a machine using the same windows share a
+    single copy of them in memory.
+
     NOTE: that we're assuming the input to this model contains values
     proportional to photon counts; thus, it should be a raw image or
     other linearized / "de-gamma-ed" image (all images meant to be
@@ -89,6 +124,25 @@ class PooledVentralStream(nn.Module):
     moments : list, optional
         Subset of 2, 3, 4. Which moments (other than the mean) to include in
         this model's representation.
+    window_backend : {'dense', 'sparse', 'chunked'}, optional
+        How to store and apply the pooling windows. If 'dense', we use
+        the ``PoolingWindows`` object directly. If 'sparse', we store
+        each window sparsely (see ``SparsePoolingWindows``), which uses
+        much less memory for small scaling values; the representation is
+        the same, up to a very small tolerance. If 'chunked', we pool
+        with a chunk of windows at a time (see
+        ``ChunkedPoolingWindows``), which bounds the peak memory of
+        pooling at some cost in speed.
+    window_memory_budget : float or None, optional
+        If ``window_backend='chunked'``, the memory (in GB) to use for
+        each chunk of windows. If None, we use the default (1 GB).
+    window_dtype : {None, 'float32', 'float16', 'bfloat16'}, optional
+        If not None, the dtype to store the pooling windows in,
+        regardless of the dtype the model is cast to. 'float16' and
+        'bfloat16' halve the windows' memory; pooling is still computed
+        (a chunk of windows at a time, as for the 'chunked' backend) in
+        the dtype of the input. See ``benchmark.compare_window_dtypes``
+        for how much this changes the representation.
 
     Attributes
     ----------
@@ -183,21 +237,49 @@ class PooledVentralStream(nn.Module):
         List of strings, one per scale, taht we either saved or loaded
         the cached windows tensors from
     normalize_dict : dict
-        Dict containing the statistics to normalize, as generated by
-        ``po.simul.non_linearities.generate_norm_stats``. If this is an
-        empty dict, we don't normalize the model.
+        Dict containing the (mean, std) pairs of the statistics to
+        normalize, as reduced by ``reduce_norm_stats`` from the output
+        of ``generate_norm_stats``. If this is an empty dict, we don't
+        normalize the model.
     to_normalize : list
         List of attributes that we want to normalize by whitening
+    store_intermediates : bool
+        Whether forward should store copies of its intermediate results
+        (``image``, ``cone_responses``, and for ``PooledV1``,
+        ``pyr_coeffs``, ``complex_cell_responses``, and
+        ``mean_complex_cell_responses``) as attributes, for later
+        examination. These are several full-resolution copies of the
+        image, which are unnecessary during synthesis (so
+        ``Metamer.synthesize`` sets this to False while it runs). If
+        False, we only keep a reference to the last input and recompute
+        these the first time one of them is accessed. Note that this is
+        a reference, not a copy, so if the input is modified in place
+        afterwards (as happens during synthesis), the recomputed values
+        will reflect that.
+    representation_cache : RepresentationCache or None
+        If set, forward (inside a ``use_representation_cache()`` block)
+        looks for the representation of images it doesn't need
+        gradients for in this on-disk cache (and adds them, if they're
+        not there), so e.g., the representation of a reference image is
+        only computed once across all runs. None by default (see
+        ``plenoptic_part.simulate.representation_cache`` for details).
 
     """
+    image = _intermediate('image')
+    cone_responses = _intermediate('cone_responses')
+    pyr_coeffs = _intermediate('pyr_coeffs')
+    complex_cell_responses = _intermediate('complex_cell_responses')
+    mean_complex_cell_responses = _intermediate('mean_complex_cell_responses')
+
     def __init__(self, scaling, img_res, min_eccentricity=.5,
                  max_eccentricity=15, num_scales=1, transition_region_width=.5,
                  cache_dir=None, window_type='cosine', std_dev=None,
-                 normalize_dict={}, moments=[]):
+                 normalize_dict={}, moments=[], window_backend='dense',
+                 window_memory_budget=None, window_dtype=None):
         super().__init__()
-        self.PoolingWindows = PoolingWindows(scaling, img_res, min_eccentricity, max_eccentricity,
-                                             num_scales, cache_dir, window_type,
-                                             transition_region_width, std_dev)
+        self.PoolingWindows = get_windows(PoolingWindows, scaling, img_res, min_eccentricity,
+                                          max_eccentricity, num_scales, cache_dir, window_type,
+                                          transition_region_width, std_dev)
         for attr in ['n_polar_windows', 'n_eccentricity_bands', 'scaling', 'state_dict_reduced',
                      'transition_region_width', 'window_width_pixels', 'window_width_degrees',
                      'min_eccentricity', 'max_eccentricity', 'cache_dir', 'deg_to_pix',
@@ -206,10 +288,21 @@ class PooledVentralStream(nn.Module):
                      'central_eccentricity_pixels', 'central_eccentricity_degrees', 'img_res',
                      'window_type', 'std_dev']:
             setattr(self, attr, getattr(self.PoolingWindows, attr))
-        self.normalize_dict = normalize_dict
+        # we only need the mean and standard deviation of each statistic, so
+        # reduce them once here instead of on every forward call (this also
+        # makes the saved models much smaller)
+        self.normalize_dict = reduce_norm_stats(normalize_dict)
         self.to_normalize = []
-        self.state_dict_reduced['normalize_dict'] = normalize_dict
+        self.state_dict_reduced['normalize_dict'] = self.normalize_dict
         self.state_dict_reduced['moments'] = moments
+        self.state_dict_reduced['window_backend'] = window_backend
+        self.state_dict_reduced['window_memory_budget'] = window_memory_budget
+        self.state_dict_reduced['window_dtype'] = window_dtype
+        # we do this after grabbing the attributes above, because the
+        # backend may drop the dense windows
+        self.PoolingWindows = setup_windows(self.PoolingWindows, window_backend,
+                                            window_memory_budget, window_dtype)
+        self.window_backend = window_backend
         self.num_scales = 1
         self._spatial_masks = {}
         test_moments = [i for i in moments]
@@ -220,6 +313,223 @@ class PooledVentralStream(nn.Module):
         if len(test_moments) > 0:
             raise Exception(f"Only acceptable values for moments are [2, 3, 4], but got other values {test_moments}!``")
         self._moments = moments
+        # set by the synthesis object, if profiling, see
+        # plenoptic_part.tools.profiling
+        self._profiler = None
+        self.store_intermediates = True
+        self._image_ref = None
+        self._forward_kwargs = {}
+        self.representation_cache = None
+        if cache_dir is not None:
+            self._window_cache_path = window_cache_path(cache_dir, scaling, img_res,
+                                                        min_eccentricity, max_eccentricity,
+                                                        num_scales, window_type,
+                                                        transition_region_width, std_dev)
+        else:
+            self._window_cache_path = None
+        self._window_coverage = None
+        self._window_metadata = None
+        self._summary_group_cache = {}
+
+    @property
+    def window_metadata(self):
+        r"""Table describing the location and size of each window
+
+        pandas DataFrame with one row per window per scale, in the same
+        order as the representation, giving its central eccentricity and
+        polar angle, its widths, and its approximate areas (see
+        ``plenoptic_part.simulate.window_metadata.window_metadata`` for
+        details). This is computed analytically from the window
+        parameters, so we never need the windows themselves.
+
+        """
+        if self._window_metadata is None:
+            self._window_metadata = window_metadata(self)
+        return self._window_metadata
+
+    @property
+    def window_coverage(self):
+        r"""The coverage of the pooling windows
+
+        2d tensor, the same size as the image, giving the sum of all
+        windows (at the first scale) at each pixel. This is
+        approximately 1 wherever the windows reach and 0 in the
+        fovea. We compute this the first time it's accessed (or load it
+        from the window cache, if ``cache_dir`` was set), and hold onto
+        it afterwards.
+
+        """
+        if self._window_coverage is None:
+            self._window_coverage = get_window_coverage(self.PoolingWindows,
+                                                        self._window_cache_path)
+        return self._window_coverage
+
+    @property
+    def n_windows(self):
+        r"""The number of pooling windows at each scale"""
+        return self.n_polar_windows * self.n_eccentricity_bands
+
+    @property
+    def window_subset(self):
+        r"""The windows forward currently pools with (None means all of them)
+
+        See ``set_window_subset``.
+        """
+        if isinstance(self.PoolingWindows, SubsetPoolingWindows):
+            return self.PoolingWindows.window_subset
+        return None
+
+    def set_window_subset(self, window_subset=None):
+        r"""Only pool with a subset of the windows
+
+        After calling this, forward only pools with the windows in
+        ``window_subset`` (see
+        ``plenoptic_part.simulate.pooling_backends.SubsetPoolingWindows``),
+        so it's cheaper, and every statistic in the representation only
+        contains those windows (use ``select_windows`` to get the same
+        windows from a full representation). Call it again with None to
+        go back to using all of them.
+
+        This is meant for stochastic synthesis (see ``window_fraction``
+        in ``Synthesis``). The subset is part of the key used by
+        ``representation_cache``, so representations computed with it
+        are cached separately from the full ones.
+
+        Parameters
+        ----------
+        window_subset : torch.Tensor or None, optional
+            1d tensor of ints, the indices (between 0 and
+            ``n_windows``, eccentricity-major, as in ``window_metadata``)
+            of the windows to use. If None, we use all windows.
+
+        """
+        if isinstance(self.PoolingWindows, SubsetPoolingWindows):
+            self.PoolingWindows = self.PoolingWindows._dense
+        if window_subset is not None:
+            memory_budget = getattr(self.PoolingWindows, 'memory_budget', None)
+            if memory_budget is None:
+                memory_budget = 1
+            self.PoolingWindows = SubsetPoolingWindows(self.PoolingWindows, window_subset,
+                                                       memory_budget)
+
+    def select_windows(self, output, window_subset):
+        r"""Select the windows in window_subset from the output of forward
+
+        Every statistic in the representation contains the same windows
+        (``n_windows`` of them), so we can select the same windows from
+        all of them at once.
+
+        Parameters
+        ----------
+        output : torch.Tensor
+            3d tensor, the output of this model's forward call, computed
+            using all windows.
+        window_subset : torch.Tensor
+            1d tensor of ints, the indices of the windows to select (see
+            ``set_window_subset``)
+
+        Returns
+        -------
+        output : torch.Tensor
+            3d tensor, what forward would have returned with
+            ``set_window_subset(window_subset)``
+
+        """
+        output = output.reshape(*output.shape[:2], -1, self.n_windows)
+        return output[..., window_subset].flatten(2)
+
+    def gradient_preconditioner(self, power=1, max_value=10):
+        r"""Per-pixel rescaling of the gradient, to even out the effect of window size
+
+        Windows grow with eccentricity, so each pixel in the periphery
+        contributes much less to the representation than one near
+        ``min_eccentricity``, and the gradient of the loss with respect
+        to it is correspondingly smaller. To counteract this, at each
+        pixel we take the average approximate area (at half-max, in
+        pixels, see ``window_metadata``) of the windows it belongs to,
+        weighted by the windows' values at that pixel, and divide it by
+        the area of the smallest window. This ratio is 1 near
+        ``min_eccentricity`` (and outside the windows, where
+        ``window_coverage`` is 0, e.g., the fovea) and grows with
+        eccentricity, reaching the hundreds in the far periphery for
+        small scaling values.
+
+        We raise that ratio to ``power``, divide it by its mean (so the
+        overall size of the gradient, and thus the appropriate learning
+        rate, stays about the same) and then clip it at ``max_value``, so
+        no pixel's gradient is scaled up by more than that.
+
+        Parameters
+        ----------
+        power : float, optional
+            We raise the preconditioner to this power, to make it
+            stronger (>1) or weaker (<1).
+        max_value : float, optional
+            The largest value the preconditioner can take. Must be at
+            least 1. Values above it (after normalizing the mean to 1)
+            are clipped, so its mean will be a bit below 1 if any are.
+
+        Returns
+        -------
+        preconditioner : torch.Tensor
+            2d tensor, the same size as the image
+
+        """
+        if max_value < 1:
+            raise Exception(f"max_value must be at least 1, but got {max_value}!")
+        metadata = self.window_metadata
+        areas = metadata[metadata.scale == 0].half_area_pixels.values
+        coverage = self.window_coverage
+        areas = torch.tensor(areas, dtype=coverage.dtype, device=coverage.device)
+        with torch.no_grad():
+            weighted_areas = self.PoolingWindows.project(areas.reshape(1, 1, -1)).squeeze()
+        preconditioner = torch.ones_like(coverage)
+        covered = coverage > 1e-6
+        preconditioner[covered] = weighted_areas[covered] / coverage[covered] / areas.min()
+        preconditioner = preconditioner.pow(power)
+        return (preconditioner / preconditioner.mean()).clamp(max=max_value)
+
+    def _clear_intermediates(self, image, **kwargs):
+        r"""Drop stored intermediates, remembering how to recompute them
+
+        Called by forward when ``store_intermediates`` is False.
+
+        Parameters
+        ----------
+        image : torch.Tensor
+            The image passed to forward
+        kwargs :
+            Any other arguments passed to forward
+
+        """
+        for name in ['image', 'cone_responses', 'pyr_coeffs', 'complex_cell_responses',
+                     'mean_complex_cell_responses']:
+            setattr(self, '_' + name, None)
+        self._image_ref = image.detach()
+        self._forward_kwargs = kwargs
+
+    def _compute_intermediates(self):
+        r"""Recompute the intermediates dropped by a lean forward call
+
+        We call forward again on the last image (with
+        ``store_intermediates=True``, without gradients), leaving
+        ``self.representation`` as it was.
+
+        """
+        image, self._image_ref = self._image_ref, None
+        representation = self.representation
+        store_intermediates = self.store_intermediates
+        self.store_intermediates = True
+        # the cache would just give us the representation back, without
+        # the intermediates
+        representation_cache, self.representation_cache = self.representation_cache, None
+        try:
+            with torch.no_grad():
+                self.forward(image, **self._forward_kwargs)
+        finally:
+            self.store_intermediates = store_intermediates
+            self.representation_cache = representation_cache
+            self.representation = representation
 
     def _gen_spatial_masks(self, n_angles=4):
         r"""Generate spatial masks
@@ -244,19 +554,20 @@ class PooledVentralStream(nn.Module):
             correspond to that angular region
 
         """
+        if n_angles == 4:
+            metadata = self.window_metadata
+        else:
+            metadata = window_metadata(self, n_angles)
+        device = self.PoolingWindows.angle_windows[0].device
         masks = {}
         for i in range(self.num_scales):
-            ecc = torch.ones_like(self.PoolingWindows.ecc_windows[i], dtype=int)
-            angles = torch.zeros_like(self.PoolingWindows.angle_windows[i], dtype=int)
+            regions = torch.from_numpy(metadata[metadata.scale == i].region.values).to(device)
             for j in range(n_angles):
-                angles[j*angles.shape[0]//4:(j+1)*angles.shape[0]//4] = j
-            windows = torch.einsum('ahw,ehw->ea', angles, ecc)
-            for j, val in enumerate(sorted(windows.unique())):
-                masks[(i, f'region_{j}')] = (windows == val).flatten()
+                masks[(i, f'region_{j}')] = regions == j
         return masks
 
     def _calculate_moments(self, image, second=True, third=True,
-                           fourth=True, pooled_mean=None):
+                           fourth=True, pooled_mean=None, mean_image=None):
         """Calculate weighted moments of image.
 
         Note that we're computing nth root of the first 4 moments, not the
@@ -269,6 +580,12 @@ class PooledVentralStream(nn.Module):
         We take the root so these values scale appropriately with the values of
         image.
 
+        All the powers of image (and the image whose mean we want, if we
+        need it) are stacked along the channel dimension and pooled in a
+        single call to ``self.PoolingWindows``, so we only sweep over the
+        windows once (on both the forward and backward pass), and we then
+        apply the roots to each moment separately.
+
         Note that, when matching the moments (e.g., in metamer synthesis),
         matching all of these plain-old moments is equivalent to matching the
         standardized versions (though this isn't the case if you wanted to use
@@ -283,27 +600,52 @@ class PooledVentralStream(nn.Module):
         second, third, fourth : bool, optional
             Whether to compute the second, third, and fourth moments.
         pooled_mean : None or torch.Tensor, optional
-            If a tensor, the weighted average of image (so we can avoid
-            re-calculating it, and speed this up). If None, we compute it
-            ourselves.
+            If a tensor, the weighted average of ``mean_image`` (so we can
+            avoid re-calculating it, and speed this up). If None, we
+            compute it ourselves, in the same pass as the other moments.
+        mean_image : None or torch.Tensor, optional
+            The 4d tensor whose weighted average we want, if it's not
+            image (e.g., ``PooledV1`` takes the mean of the normalized
+            cone responses but the moments of the un-normalized
+            image). Must have the same shape as image. If None, we use
+            image.
 
         Returns
         -------
         moments : dict
-            Dict of tensors, containing the calculated moments.
+            Dict of tensors, containing the calculated moments. The
+            weighted average is included under the key ``'mean'`` (this
+            is just ``pooled_mean``, if that was passed).
 
         """
+        if mean_image is None:
+            mean_image = image
+        names = []
+        to_pool = []
+        if pooled_mean is None:
+            names.append('mean')
+            to_pool.append(mean_image)
+        for name, n, calc in [('second', 2, second), ('third', 3, third),
+                              ('fourth', 4, fourth)]:
+            if calc:
+                names.append(name)
+                to_pool.append(image.pow(n))
         moments = {}
+        if to_pool:
+            pooled = self.PoolingWindows(torch.cat(to_pool, dim=1))
+            pooled = pooled.split(image.shape[1], dim=1)
+            moments = dict(zip(names, pooled))
+        if pooled_mean is not None:
+            moments['mean'] = pooled_mean
         # clamp with min=0 to avoid NaNs. see
         # https://discuss.pytorch.org/t/incorrect-pow-function/62735/3 for why
         # this applies even to the third-root
-        if second:
-            moments['second'] = self.PoolingWindows(image.pow(2)).clamp(min=0).pow(1/2)
-        if third:
-            moments['third'] = self.PoolingWindows(image.pow(3)).clamp(min=0).pow(1/3)
-        if fourth:
-            moments['fourth'] = self.PoolingWindows(image.pow(4)).clamp(min=0).pow(1/4)
-        return moments
+        for name, n in [('second', 2), ('third', 3), ('fourth', 4)]:
+            if name in moments:
+                moments[name] = moments[name].clamp(min=0).pow(1/n)
+        # make sure we return the moments in the standard order
+        return dict((k, moments[k]) for k in ['mean', 'second', 'third', 'fourth']
+                    if k in moments)
 
     def to(self, *args, do_windows=True, **kwargs):
         r"""Moves and/or casts the parameters and buffers.
@@ -345,12 +687,17 @@ class PooledVentralStream(nn.Module):
             self.PoolingWindows.to(*args, **kwargs)
         for k, v in self._spatial_masks.items():
             self._spatial_masks[k] = v.to(*args, **kwargs)
+        if self._window_coverage is not None:
+            self._window_coverage = self._window_coverage.to(*args, **kwargs)
+        # in case normalize_dict was set directly, make sure it's reduced
+        self.normalize_dict = reduce_norm_stats(self.normalize_dict)
         for k, v in self.normalize_dict.items():
             if isinstance(v, dict):
                 for l, w in v.items():
-                    self.normalize_dict[k][l] = w.to(*args, **kwargs)
+                    self.normalize_dict[k][l] = tuple(x.to(*args, **kwargs) for x in w)
             else:
-                self.normalize_dict[k] = v.to(*args, **kwargs)
+                self.normalize_dict[k] = tuple(x.to(*args, **kwargs) for x in v)
+        self.state_dict_reduced['normalize_dict'] = self.normalize_dict
         nn.Module.to(self, *args, **kwargs)
         return self
 
@@ -414,10 +761,13 @@ class PooledVentralStream(nn.Module):
         -------
         sizes : dict
             dictionary with the keys described above, summarizing window
-            sizes. all values are scalar floats
+            sizes (``{min,max}_window_{center,fwhm,area}_degrees`` and
+            ``{min,max}_window_{center,fwhm,area}_pixels_scale_{i}``).
+            all values are scalar floats
 
         """
-        return self.PoolingWindows.summarize_window_sizes()
+        return summarize_window_sizes(self.window_metadata, self.min_eccentricity,
+                                      self.max_eccentricity)
 
     def plot_window_widths(self, units='degrees', scale_num=0, figsize=(5, 5), jitter=.25):
         r"""plot the widths of the windows, in degrees or pixels
@@ -459,7 +809,7 @@ class PooledVentralStream(nn.Module):
             The figure containing the plot
 
         """
-        return self.PoolingWindows.plot_window_widths(units, scale_num, figsize, jitter)
+        return plot_window_widths(self.window_metadata, units, scale_num, figsize, jitter)
 
     def plot_window_areas(self, units='degrees', scale_num=0, figsize=(5, 5)):
         r"""plot the approximate areas of the windows, in degrees or pixels
@@ -502,7 +852,7 @@ class PooledVentralStream(nn.Module):
             The figure containing the plot
 
         """
-        return self.PoolingWindows.plot_window_areas(units, scale_num, figsize)
+        return plot_window_areas(self.window_metadata, units, scale_num, figsize)
 
     def save_reduced(self, file_path):
         r"""save the relevant parameters to make saving/loading more efficient
@@ -521,26 +871,48 @@ class PooledVentralStream(nn.Module):
         torch.save(self.state_dict_reduced, file_path)
 
     @classmethod
-    def load_reduced(cls, file_path):
+    def load_reduced(cls, file_path, shared=True):
         r"""load from the dictionary saved by ``save_reduced``
 
         Parameters
         ----------
         file_path : str
             The path to load the model object from
+        shared : bool, optional
+            Whether to return the shared instance of the model, see
+            ``from_state_dict_reduced``.
         """
         state_dict_reduced = torch.load(file_path)
-        return cls.from_state_dict_reduced(state_dict_reduced)
+        return cls.from_state_dict_reduced(state_dict_reduced, shared)
 
     @classmethod
-    def from_state_dict_reduced(cls, state_dict_reduced):
+    def from_state_dict_reduced(cls, state_dict_reduced, shared=True):
         r"""initialize model from ``state_dict_reduced``
 
+        We only initialize each model once per process: models are
+        held in ``plenoptic_part.simulate.model_registry.model_registry``
+        (keyed by ``state_dict_reduced``), so loading many metamers
+        synthesized with the same model only creates its windows once.
+
         Parameters
         ----------
         state_dict_reduced : dict
             The reduced state dict to load
+        shared : bool, optional
+            If True, we return the instance of the model shared with
+            everything else that loaded this ``state_dict_reduced``, so
+            anything done to it (e.g., calling ``to()``) affects them as
+            well. If False, we return a deep copy of it, which can be
+            safely modified.
         """
+        model = model_registry.get(state_dict_reduced, cls._init_from_state_dict_reduced)
+        if not shared:
+            model = copy.deepcopy(model)
+        return model
+
+    @classmethod
+    def _init_from_state_dict_reduced(cls, state_dict_reduced):
+        """initialize a new model from state_dict_reduced, see from_state_dict_reduced"""
         state_dict_reduced = state_dict_reduced.copy()
         model_name = state_dict_reduced.pop('model_name')
         # want to remove class if it's here
@@ -582,11 +954,9 @@ class PooledVentralStream(nn.Module):
             False, will just have a single value per key in
             representation. If True, keys will be (k, 'region_{i}'),
             where goes from 0 to 3 and represents quadrants, starting
-            from bottom right. Note that, if this is the first time
-            doing this, we'll need to create spatial masks to do this,
-            which will massively increase the amount of memory used
-            (because we create copies of the PoolingWindows at the
-            coarsest scale to do so).
+            from bottom right. The regions come from
+            ``self.window_metadata``, so this doesn't need the windows
+            themselves.
 
         Returns
         -------
@@ -596,6 +966,10 @@ class PooledVentralStream(nn.Module):
             corresponding summarized representation
 
         """
+        if summary_func in ['mse', 'l2']:
+            summarized, keys = self.summarize_representation_batch(data, summary_func, by_angle,
+                                                                   batch_dims=0)
+            return dict(zip(keys, summarized.tolist()))
         if not self._spatial_masks and by_angle:
             self._spatial_masks = self._gen_spatial_masks()
         if data is not None:
@@ -625,6 +999,128 @@ class PooledVentralStream(nn.Module):
                 summarized[k] = summary_func(v).item()
         return summarized
 
+    def _summary_groups(self, by_angle=False, representation=None):
+        r"""Get the summary group of each statistic in the output
+
+        For ``summarize_representation_batch``. We compute these once
+        for each layout of the representation (its keys and the number
+        of statistics in each, which change if forward is called with a
+        different ``scales`` or with a window subset) and hold onto
+        them.
+
+        Parameters
+        ----------
+        by_angle : bool, optional
+            whether to further breakdown representation by angle, as in
+            ``summarize_representation``.
+        representation : dict or None, optional
+            The representation whose layout we should use. If None, we
+            use ``self.representation``.
+
+        Returns
+        -------
+        groups : torch.Tensor
+            1d long tensor, the same length as the output, giving the
+            index (into ``keys``) of the group each statistic belongs to
+        keys : list
+            The keys of the groups, as returned by
+            ``summarize_representation``
+
+        """
+        if representation is None:
+            representation = getattr(self, 'representation', None)
+            if representation is None:
+                raise Exception("No representation to summarize!")
+        layout = tuple((k, v.shape[-1]) for k, v in representation.items())
+        if (layout, by_angle) not in self._summary_group_cache:
+            metadata = self.window_metadata
+            groups, keys = [], []
+            for k, n in layout:
+                if by_angle:
+                    scale = 0 if isinstance(k, str) else k[0]
+                    regions = metadata[metadata.scale == scale].region.values
+                    if len(regions) != n:
+                        raise Exception(f"{k} has {n} statistics, but there are {len(regions)} "
+                                        f"windows at scale {scale}, so can't break it down by "
+                                        "angle (was it computed with a window subset?)")
+                    groups.append(torch.from_numpy(regions) + len(keys))
+                    keys.extend([(k, f'region_{i}') for i in range(4)])
+                else:
+                    groups.append(torch.full((n,), len(keys), dtype=torch.long))
+                    keys.append(k)
+            self._summary_group_cache[(layout, by_angle)] = (torch.cat(groups), keys)
+        return self._summary_group_cache[(layout, by_angle)]
+
+    def summarize_representation_batch(self, data=None, summary_func='mse', by_angle=False,
+                                       batch_dims=1):
+        r"""summarize a batch of representations by key and (optionally) quadrant
+
+        This computes the same values as ``summarize_representation``,
+        but for a whole stack of representations at once (e.g., the
+        representation error at every saved iteration of synthesis),
+        without looping over keys and regions: we assign each statistic
+        to its group (key or key and region) once, and then sum within
+        all groups in a single ``index_add``.
+
+        Parameters
+        ----------
+        data : torch.Tensor, dict or None, optional
+            The data to summarize. If None, we use
+            ``self.representation``. Else, should look like
+            ``self.representation`` or the output, with any number of
+            extra leading dimensions (e.g., a stack of outputs with
+            shape (iterations, batch, channel, statistics)). If a dict,
+            we group its statistics using its own keys; if a tensor, it
+            must have the same layout as ``self.representation``.
+        summary_func : {'mse', 'l2'}, optional
+            If 'mse', we'll square and average within each group; if
+            'l2', we'll use the L2-norm.
+        by_angle : bool, optional
+            whether to further breakdown representation by angle, as in
+            ``summarize_representation``.
+        batch_dims : int, optional
+            The number of leading dimensions of ``data`` to summarize
+            separately. All other dimensions (besides the last) are
+            summarized together, as in ``summarize_representation``
+            (which uses ``batch_dims=0``).
+
+        Returns
+        -------
+        summarized : torch.Tensor
+            Tensor of shape ``data.shape[:batch_dims] + (len(keys),)``
+            containing the summarized values
+        keys : list
+            The key of each summarized value, as in
+            ``summarize_representation``
+
+        """
+        if data is None:
+            data = self.representation
+            if data is None:
+                raise Exception("No representation to summarize!")
+        if isinstance(data, dict):
+            groups, keys = self._summary_groups(by_angle, data)
+            data = torch.cat([torch.as_tensor(v) for v in data.values()], dim=-1)
+        else:
+            data = torch.as_tensor(data)
+            groups, keys = self._summary_groups(by_angle)
+        groups = groups.to(data.device)
+        data = data.detach()
+        squared = data.reshape(*data.shape[:batch_dims], -1, data.shape[-1]).pow(2).sum(-2)
+        summarized = torch.zeros(*squared.shape[:-1], len(keys), dtype=data.dtype,
+                                 device=data.device)
+        summarized = summarized.index_add_(summarized.ndim-1, groups, squared)
+        if summary_func == 'mse':
+            # the number of values we summed over per statistic, for each group
+            n_summed = data[..., 0].numel() // squared[..., 0].numel()
+            summarized = summarized / (torch.bincount(groups, minlength=len(keys)) * n_summed)
+        elif summary_func == 'l2':
+            summarized = summarized.sqrt()
+        else:
+            raise Exception(f"Don't know how to handle summary_func {summary_func}, must be one "
+                            "of {'mse', 'l2'}!")
+        return summarized, keys
+
     def _representation_for_plotting(self, batch_idx=0, data=None):
         r"""Get the representation in the form required for plotting
 
@@ -919,6 +1415,25 @@ class PooledRGC(PooledVentralStream):
         windows tile correctly, intersect at the proper point, follow
         scaling, and have proper aspect ratio; not sure we can make that
         happen for other values).
+    window_backend : {'dense', 'sparse', 'chunked'}, optional
+        How to store and apply the pooling windows. If 'dense', we use
+        the ``PoolingWindows`` object directly. If 'sparse', we store
+        each window sparsely (see ``SparsePoolingWindows``), which uses
+        much less memory for small scaling values; the representation is
+        the same, up to a very small tolerance. If 'chunked', we pool
+        with a chunk of windows at a time (see
+        ``ChunkedPoolingWindows``), which bounds the peak memory of
+        pooling at some cost in speed.
+    window_memory_budget : float or None, optional
+        If ``window_backend='chunked'``, the memory (in GB) to use for
+        each chunk of windows. If None, we use the default (1 GB).
+    window_dtype : {None, 'float32', 'float16', 'bfloat16'}, optional
+        If not None, the dtype to store the pooling windows in,
+        regardless of the dtype the model is cast to. 'float16' and
+        'bfloat16' halve the windows' memory; pooling is still computed
+        (a chunk of windows at a time, as for the 'chunked' backend) in
+        the dtype of the input. See ``benchmark.compare_window_dtypes``
+        for how much this changes the representation.
 
     Attributes
     ----------
@@ -1024,9 +1539,9 @@ class PooledRGC(PooledVentralStream):
         List of strings, one per scale, that we either saved or loaded
         the cached windows tensors from
     normalize_dict : dict
-        Dict containing the statistics to normalize, as generated by
-        ``po.simul.non_linearities.generate_norm_stats``. If this is an
-        empty dict, we don't normalize the model.
+        Dict containing the (mean, std) pairs of the statistics to
+        normalize, as reduced by ``po.optim.reduce_norm_stats``. If this
+        is an empty dict, we don't normalize the model.
     to_normalize : list
         List of attributes that we want to normalize by whitening
 
@@ -1035,16 +1550,21 @@ class PooledRGC(PooledVentralStream):
     def __init__(self, scaling, img_res, min_eccentricity=.5,
                  max_eccentricity=15, transition_region_width=.5,
                  normalize_dict={}, cache_dir=None, window_type='cosine',
-                 std_dev=None):
+                 std_dev=None, window_backend='dense', window_memory_budget=None,
+                 window_dtype=None):
         super().__init__(scaling, img_res, min_eccentricity, max_eccentricity,
                          transition_region_width=transition_region_width,
                          cache_dir=cache_dir, window_type=window_type,
-                         std_dev=std_dev, normalize_dict=normalize_dict)
+                         std_dev=std_dev, normalize_dict=normalize_dict,
+                         window_backend=window_backend,
+                         window_memory_budget=window_memory_budget,
+                         window_dtype=window_dtype)
         self.state_dict_reduced.update({'model_name': 'RGC'})
         self.image = None
         self.representation = None
         self.to_normalize += ['cone_responses']
 
+    @cached_forward
     def forward(self, image):
         r"""Generate the RGC representation of an image
 
@@ -1065,11 +1585,24 @@ class PooledRGC(PooledVentralStream):
         """
         while image.ndimension() < 4:
             image = image.unsqueeze(0)
-        self.image = image.detach().clone()
-        self.cone_responses = image.clone()
-        if self.normalize_dict:
-            self = zscore_stats(self.normalize_dict, self)
-        self.representation = {'mean_luminance': self.PoolingWindows(self.cone_responses)}
+        profiler = getattr(self, '_profiler', None)
+        if self.store_intermediates:
+            self._image_ref = None
+            self.image = image.detach().clone()
+            self.cone_responses = image.clone()
+            if self.normalize_dict:
+                with profile_phase(profiler, 'normalize'):
+                    self = zscore_stats(self.normalize_dict, self)
+            cone_responses = self.cone_responses
+        else:
+            self._clear_intermediates(image)
+            cone_responses = image
+            if self.normalize_dict:
+                with profile_phase(profiler, 'normalize'):
+                    cone_responses = zscore_stats(self.normalize_dict,
+                                                  cone_responses=image)['cone_responses']
+        with profile_phase(profiler, 'pooling'):
+            self.representation = {'mean_luminance': self.PoolingWindows(cone_responses)}
         return self.representation_to_output()
 
     def _plot_helper(self, n_cols=1, figsize=(10, 5), ax=None, title=None, batch_idx=0, data=None):
@@ -1323,6 +1856,33 @@ class PooledV1(PooledVentralStream):
     moments : list, optional
         Subset of 2, 3, 4. Which moments (other than the mean) to include in
         this model's representation.
+    window_backend : {'dense', 'sparse', 'chunked'}, optional
+        How to store and apply the pooling windows. If 'dense', we use
+        the ``PoolingWindows`` object directly. If 'sparse', we store
+        each window sparsely (see ``SparsePoolingWindows``), which uses
+        much less memory for small scaling values; the representation is
+        the same, up to a very small tolerance. If 'chunked', we pool
+        with a chunk of windows at a time (see
+        ``ChunkedPoolingWindows``), which bounds the peak memory of
+        pooling at some cost in speed.
+    window_memory_budget : float or None, optional
+        If ``window_backend='chunked'``, the memory (in GB) to use for
+        each chunk of windows. If None, we use the default (1 GB).
+    window_dtype : {None, 'float32', 'float16', 'bfloat16'}, optional
+        If not None, the dtype to store the pooling windows in,
+        regardless of the dtype the model is cast to. 'float16' and
+        'bfloat16' halve the windows' memory; pooling is still computed
+        (a chunk of windows at a time, as for the 'chunked' backend) in
+        the dtype of the input. See ``benchmark.compare_window_dtypes``
+        for how much this changes the representation.
+    gradient_checkpointing : bool, optional
+        If True, forward doesn't keep the steerable pyramid coefficients
+        (or the complex cell responses computed from them) around for
+        the backward pass, but recomputes them, one scale at a time,
+        during it. This greatly reduces the memory needed for synthesis,
+        at the cost of running the pyramid twice per iteration. Only
+        used when ``store_intermediates`` is False (as it is during
+        synthesis) and we're computing gradients.
 
     Attributes
     ----------
@@ -1456,30 +2016,40 @@ class PooledV1(PooledVentralStream):
         List of strings, one per scale, that we either saved or loaded
         the cached windows tensors from
     normalize_dict : dict
-        Dict containing the statistics to normalize, as generated by
-        ``po.optim.generate_norm_stats``. If this is an empty dict, we
-        don't normalize the model. If it's non-empty, we expect it to
-        have only two keys: "complex_cell_responses" and
-        "cone_responses"
+        Dict containing the (mean, std) pairs of the statistics to
+        normalize, as reduced by ``po.optim.reduce_norm_stats``. If this
+        is an empty dict, we don't normalize the model. If it's
+        non-empty, we expect it to have only two keys:
+        "complex_cell_responses" and "cone_responses"
     to_normalize : list
         List of attributes that we want to normalize by whitening (for
         PooledV1, that's just "complex_cell_responses")
     scales : list
         List of the scales in the model, from fine to coarse. Used for
         synthesizing in coarse-to-fine order
+    gradient_checkpointing : bool
+        Whether to recompute the pyramid during the backward pass
+        instead of storing it, see Parameters section above.
 
     """
     def __init__(self, scaling, img_res, num_scales=4, order=3, min_eccentricity=.5,
                  max_eccentricity=15, transition_region_width=.5, normalize_dict={},
-                 cache_dir=None, window_type='cosine', std_dev=None, moments=[]):
+                 cache_dir=None, window_type='cosine', std_dev=None, moments=[],
+                 window_backend='dense', window_memory_budget=None,
+                 gradient_checkpointing=False, window_dtype=None):
         super().__init__(scaling, img_res, min_eccentricity, max_eccentricity, num_scales,
                          transition_region_width=transition_region_width,
                          cache_dir=cache_dir, window_type=window_type, std_dev=std_dev,
-                         normalize_dict=normalize_dict, moments=moments)
+                         normalize_dict=normalize_dict, moments=moments,
+                         window_backend=window_backend,
+                         window_memory_budget=window_memory_budget,
+                         window_dtype=window_dtype)
         self.state_dict_reduced.update({'order': order, 'model_name': 'V1',
-                                        'num_scales': num_scales})
+                                        'num_scales': num_scales,
+                                        'gradient_checkpointing': gradient_checkpointing})
         self.num_scales = num_scales
         self.order = order
+        self.gradient_checkpointing = gradient_checkpointing
         # before the change in how complex tensors were handled, the default
         # was tight_frame=True. set that so it's comparable.
         self.complex_steerable_pyramid = po.simul.Steerable_Pyramid_Freq(img_res, self.num_scales,
@@ -1534,6 +2104,39 @@ class PooledV1(PooledVentralStream):
         super(self.__class__, self).to(do_windows=do_windows, *args, **kwargs)
         return self
 
+    def _pooled_scale(self, image, scale):
+        r"""Compute the pooled complex cell responses at a single scale
+
+        This is what forward does for each scale, from the image to the
+        pooled (and normalized, if ``normalize_dict`` is set) responses,
+        in a single function so it can be checkpointed, see
+        ``gradient_checkpointing``.
+
+        Parameters
+        ----------
+        image : torch.Tensor
+            The 4d image to analyze
+        scale : int
+            The scale of the pyramid to compute
+
+        Returns
+        -------
+        pooled : tuple
+            Tuple of 3d tensors, the pooled responses for each
+            orientation at this scale
+
+        """
+        pyr_coeffs = self.complex_steerable_pyramid(image, [scale])
+        complex_cell_responses = dict((k, torch.pow(v, 2).abs()) for k, v in pyr_coeffs.items()
+                                      if not isinstance(k, str))
+        if 'complex_cell_responses' in self.normalize_dict:
+            complex_cell_responses = zscore_stats(
+                self.normalize_dict, complex_cell_responses=complex_cell_responses
+            )['complex_cell_responses']
+        pooled = self.PoolingWindows(complex_cell_responses)
+        return tuple(pooled[(scale, i)] for i in range(self.order+1))
+
+    @cached_forward
     def forward(self, image, scales=[]):
         r"""Generate the V1 representation of an image
 
@@ -1565,46 +2168,90 @@ class PooledV1(PooledVentralStream):
         if not scales:
             scales = self.scales
         self.representation = {}
-        self.complex_cell_responses = {}
-        self.mean_complex_cell_responses = {}
-        # this is a little weird here: the image that we detach and
-        # clone here is just a copy that we keep around for later
-        # examination.
-        self.image = image.detach().clone()
-        # we save this here so that it can be normalized. At this point,
-        # it's not normalized, but it will be during the
-        # zscore_stats(self.normalize_dict, self) call below. We also
-        # zscore cone_responses there because we want the values that go
-        # into the mean pixel intensity to be normalized but not the
-        # values that go into the steerable pyramid.
-        self.cone_responses = image.clone()
-        self.pyr_coeffs = {}
-        if any([i in self.complex_steerable_pyramid.scales for i in scales]):
-            self.pyr_coeffs.update(self.complex_steerable_pyramid(self.cone_responses,
-                                                                  scales))
-        if self.pyr_coeffs:
+        profiler = getattr(self, '_profiler', None)
+        if self.store_intermediates:
+            self._image_ref = None
+            # this is a little weird here: the image that we detach and
+            # clone here is just a copy that we keep around for later
+            # examination.
+            self.image = image.detach().clone()
+            # we save this here so that it can be normalized. At this point,
+            # it's not normalized, but it will be during the
+            # zscore_stats(self.normalize_dict, self) call below. We also
+            # zscore cone_responses there because we want the values that go
+            # into the mean pixel intensity to be normalized but not the
+            # values that go into the steerable pyramid.
+            self.cone_responses = image.clone()
+        else:
+            # then we don't keep any copies around, see store_intermediates
+            self._clear_intermediates(image, scales=scales)
+        cone_responses = self.cone_responses if self.store_intermediates else image
+        pyr_coeffs = {}
+        complex_cell_responses = {}
+        mean_complex_cell_responses = {}
+        if (self.gradient_checkpointing and not self.store_intermediates and
+                torch.is_grad_enabled() and image.requires_grad):
+            # then the pyramid, complex cell responses, and their
+            # normalization are all recomputed, one scale at a time,
+            # during the backward pass, so we only hold onto the pooled
+            # values
+            with profile_phase(profiler, 'pyramid'):
+                # go through them in the same order as the pyramid does
+                for scale in [i for i in range(self.num_scales) if i in scales]:
+                    pooled = checkpoint(self._pooled_scale, image, scale)
+                    mean_complex_cell_responses.update(dict(((scale, i), p) for i, p in
+                                                            enumerate(pooled)))
+        elif any([i in self.complex_steerable_pyramid.scales for i in scales]):
+            # the pyramid gets the un-normalized image (cone_responses is
+            # identical until it's normalized below)
+            with profile_phase(profiler, 'pyramid'):
+                pyr_coeffs.update(self.complex_steerable_pyramid(image, scales))
+        if pyr_coeffs:
             # to get the energy, we just square and take the absolute value
             # (since this is a complex tensor, this is equivalent to summing
             # across the real and imaginary components). the if statement
             # avoids the residuals
-            self.complex_cell_responses = dict((k, torch.pow(v, 2).abs())
-                                               for k, v in self.pyr_coeffs.items()
-                                               if not isinstance(k, str))
+            complex_cell_responses = dict((k, torch.pow(v, 2).abs())
+                                          for k, v in pyr_coeffs.items()
+                                          if not isinstance(k, str))
+        if self.store_intermediates:
+            self.pyr_coeffs = pyr_coeffs
+            self.complex_cell_responses = complex_cell_responses
         if self.normalize_dict:
-            self = zscore_stats(self.normalize_dict, self)
-        if self.complex_cell_responses:
-            self.mean_complex_cell_responses = self.PoolingWindows(self.complex_cell_responses)
-        self.representation.update(self.mean_complex_cell_responses)
+            with profile_phase(profiler, 'normalize'):
+                if self.store_intermediates:
+                    # this normalizes the cone_responses and
+                    # complex_cell_responses dict in place
+                    self = zscore_stats(self.normalize_dict, self)
+                else:
+                    to_normalize = {'cone_responses': cone_responses,
+                                    'complex_cell_responses': complex_cell_responses}
+                    normalized = zscore_stats(self.normalize_dict,
+                                              **dict((k, v) for k, v in to_normalize.items()
+                                                     if k in self.normalize_dict))
+                    cone_responses = normalized.get('cone_responses', cone_responses)
+                    complex_cell_responses = normalized.get('complex_cell_responses',
+                                                            complex_cell_responses)
+        if complex_cell_responses:
+            with profile_phase(profiler, 'pooling'):
+                mean_complex_cell_responses = self.PoolingWindows(complex_cell_responses)
+        if self.store_intermediates:
+            self.mean_complex_cell_responses = mean_complex_cell_responses
+        self.representation.update(mean_complex_cell_responses)
         if 'mean_luminance' in scales:
-            self.mean_luminance = self.PoolingWindows(self.cone_responses)
-            self.representation['mean_luminance'] = self.mean_luminance
             # use the original image, not cone_responses, because that might be
             # normalized and we want the moments to be computed on the
-            # un-normalized image (to avoid possible negative values)
-            moments = self._calculate_moments(image,
-                                              2 in self._moments,
-                                              3 in self._moments,
-                                              4 in self._moments)
+            # un-normalized image (to avoid possible negative values). the
+            # mean luminance, however, comes from cone_responses, and is
+            # pooled in the same pass
+            with profile_phase(profiler, 'moments'):
+                moments = self._calculate_moments(image,
+                                                  2 in self._moments,
+                                                  3 in self._moments,
+                                                  4 in self._moments,
+                                                  mean_image=cone_responses)
+            self.mean_luminance = moments.pop('mean')
+            self.representation['mean_luminance'] = self.mean_luminance
             self.representation.update({f'image_moment_{k}': v for
                                         k, v in moments.items()})
         return self.representation_to_output()
@@ -1999,6 +2646,25 @@ class PooledMoments(PooledVentralStream):
     moments : list, optional
         Subset of 2, 3, 4. Which moments (other than the mean) to include in
         this model's representation.
+    window_backend : {'dense', 'sparse', 'chunked'}, optional
+        How to store and apply the pooling windows. If 'dense', we use
+        the ``PoolingWindows`` object directly. If 'sparse', we store
+        each window sparsely (see ``SparsePoolingWindows``), which uses
+        much less memory for small scaling values; the representation is
+        the same, up to a very small tolerance. If 'chunked', we pool
+        with a chunk of windows at a time (see
+        ``ChunkedPoolingWindows``), which bounds the peak memory of
+        pooling at some cost in speed.
+    window_memory_budget : float or None, optional
+        If ``window_backend='chunked'``, the memory (in GB) to use for
+        each chunk of windows. If None, we use the default (1 GB).
+    window_dtype : {None, 'float32', 'float16', 'bfloat16'}, optional
+        If not None, the dtype to store the pooling windows in,
+        regardless of the dtype the model is cast to. 'float16' and
+        'bfloat16' halve the windows' memory; pooling is still computed
+        (a chunk of windows at a time, as for the 'chunked' backend) in
+        the dtype of the input. See ``benchmark.compare_window_dtypes``
+        for how much this changes the representation.
 
     Attributes
     ----------
@@ -2104,9 +2770,9 @@ class PooledMoments(PooledVentralStream):
         List of strings, one per scale, that we either saved or loaded
         the cached windows tensors from
     normalize_dict : dict
-        Dict containing the statistics to normalize, as generated by
-        ``po.simul.non_linearities.generate_norm_stats``. If this is an
-        empty dict, we don't normalize the model.
+        Dict containing the (mean, std) pairs of the statistics to
+        normalize, as reduced by ``po.optim.reduce_norm_stats``. If this
+        is an empty dict, we don't normalize the model.
     to_normalize : list
         List of attributes that we want to normalize by whitening
 
@@ -2115,17 +2781,21 @@ class PooledMoments(PooledVentralStream):
     def __init__(self, scaling, img_res, min_eccentricity=.5,
                  max_eccentricity=15, transition_region_width=.5,
                  normalize_dict={}, cache_dir=None, window_type='cosine',
-                 std_dev=None, moments=[2, 3, 4]):
+                 std_dev=None, moments=[2, 3, 4], window_backend='dense',
+                 window_memory_budget=None, window_dtype=None):
         super().__init__(scaling, img_res, min_eccentricity, max_eccentricity,
                          transition_region_width=transition_region_width,
                          cache_dir=cache_dir, window_type=window_type,
                          std_dev=std_dev, normalize_dict=normalize_dict,
-                         moments=moments)
+                         moments=moments, window_backend=window_backend,
+                         window_memory_budget=window_memory_budget,
+                         window_dtype=window_dtype)
         self.state_dict_reduced.update({'model_name': 'Moments'})
         self.image = None
         self.representation = None
         self.to_normalize += ['cone_responses']
 
+    @cached_forward
     def forward(self, image):
         r"""Generate the PooledMoments representation of an image.
 
@@ -2147,14 +2817,27 @@ class PooledMoments(PooledVentralStream):
         """
         while image.ndimension() < 4:
             image = image.unsqueeze(0)
-        self.image = image.detach().clone()
-        self.cone_responses = image.clone()
-        if self.normalize_dict:
-            self = zscore_stats(self.normalize_dict, self)
-        self.representation = {'mean_luminance': self.PoolingWindows(self.cone_responses)}
-        moments = self._calculate_moments(self.cone_responses, 2 in self._moments,
-                                          3 in self._moments, 4 in self._moments,
-                                          self.representation['mean_luminance'])
+        profiler = getattr(self, '_profiler', None)
+        if self.store_intermediates:
+            self._image_ref = None
+            self.image = image.detach().clone()
+            self.cone_responses = image.clone()
+            if self.normalize_dict:
+                with profile_phase(profiler, 'normalize'):
+                    self = zscore_stats(self.normalize_dict, self)
+            cone_responses = self.cone_responses
+        else:
+            self._clear_intermediates(image)
+            cone_responses = image
+            if self.normalize_dict:
+                with profile_phase(profiler, 'normalize'):
+                    cone_responses = zscore_stats(self.normalize_dict,
+                                                  cone_responses=image)['cone_responses']
+        # the mean luminance is pooled in the same pass as the moments
+        with profile_phase(profiler, 'moments'):
+            moments = self._calculate_moments(cone_responses, 2 in self._moments,
+                                              3 in self._moments, 4 in self._moments)
+        self.representation = {'mean_luminance': moments.pop('mean')}
         self.representation.update({f'image_moment_{k}': v for k, v in moments.items()})
         return self.representation_to_output()
 
@@ -0,0 +1,215 @@
+"""memory-mapped cache of pooling windows, shared across processes
+
+``PoolingWindows`` caches its windows with ``torch.save``, so every
+process that loads them gets its own private copy in memory. When
+several jobs using the same windows run on one machine, that means
+several copies of the same (possibly multi-GB) tensors. Here, we cache
+the windows as raw ``.npy`` files instead, and memory-map them when
+loading: the operating system then shares the pages between all
+processes that use them, and nothing is read until it's needed.
+
+The cache for one set of windows is a directory (see
+``window_cache_path``), containing one ``angle_{scale}.npy`` and one
+``ecc_{scale}.npy`` file per scale and a small ``metadata.pt`` file,
+which contains the ``PoolingWindows`` object itself, with its windows
+removed. ``metadata.pt`` is written last, so if it exists, the cache is
+complete. The directory may also contain ``coverage_{dtype}.npy`` (one
+per dtype the windows have been stored in), see ``get_window_coverage``.
+"""
+import os
+import os.path as op
+import copy
+import warnings
+import numpy as np
+import torch
+
+
+def window_cache_path(cache_dir, scaling, img_res, min_eccentricity=.5, max_eccentricity=15,
+                      num_scales=1, window_type='cosine', transition_region_width=.5,
+                      std_dev=None):
+    r"""Get the path of the memory-mapped cache for these windows
+
+    Arguments are the same as those used to initialize
+    ``PoolingWindows``.
+
+    Returns
+    -------
+    path : str
+        The path to the directory containing the cache
+
+    """
+    if window_type == 'gaussian':
+        width = std_dev
+    else:
+        width = transition_region_width
+    img_res = ','.join([str(int(i)) for i in img_res])
+    return op.join(cache_dir, 'mmap', f'scaling-{scaling}_size-{img_res}_e0-{min_eccentricity:.03f}'
+                   f'_em-{max_eccentricity:.01f}_s-{num_scales}_w-{width}_{window_type}')
+
+
+def _atomic_save(save_func, path, *args):
+    """call save_func(tmp_path, *args), then move tmp_path to path"""
+    # several processes may try to write the same cache at once, so
+    # they each need their own temporary file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    save_func(tmp_path, *args)
+    os.replace(tmp_path, path)
+
+
+def _np_save(path, arr):
+    """np.save to exactly path (np.save would otherwise append .npy)"""
+    with open(path, 'wb') as f:
+        np.save(f, arr)
+
+
+def _torch_save(path, obj):
+    """torch.save, with the path first (as _atomic_save expects)"""
+    torch.save(obj, path)
+
+
+def save_windows(windows, path):
+    r"""Save windows to the memory-mapped cache at path
+
+    Parameters
+    ----------
+    windows : PoolingWindows
+        The initialized windows object to cache
+    path : str
+        The directory to cache them in, from ``window_cache_path``
+
+    """
+    os.makedirs(path, exist_ok=True)
+    for scale in windows.angle_windows.keys():
+        for name in ['angle', 'ecc']:
+            w = getattr(windows, f'{name}_windows')[scale]
+            _atomic_save(_np_save, op.join(path, f'{name}_{scale}.npy'),
+                         w.detach().to('cpu').numpy())
+    metadata = copy.copy(windows)
+    metadata.angle_windows = {}
+    metadata.ecc_windows = {}
+    _atomic_save(_torch_save, op.join(path, 'metadata.pt'),
+                 {'windows': metadata, 'scales': list(windows.angle_windows.keys())})
+
+
+def load_windows(path):
+    r"""Attach to the memory-mapped cache at path
+
+    The windows are memory-mapped copy-on-write: they're shared with
+    every other process using the same cache, unless they're modified
+    in place (in which case the modified pages become private). Moving
+    the windows to the GPU or changing their dtype makes a regular copy.
+
+    Parameters
+    ----------
+    path : str
+        The directory containing the cache, from ``window_cache_path``
+
+    Returns
+    -------
+    windows : PoolingWindows or None
+        The windows object, or None if the cache doesn't exist (or isn't
+        complete)
+
+    """
+    if not op.exists(op.join(path, 'metadata.pt')):
+        return None
+    metadata = torch.load(op.join(path, 'metadata.pt'))
+    windows = metadata['windows']
+    angle_windows, ecc_windows = {}, {}
+    for scale in metadata['scales']:
+        angle_windows[scale] = torch.from_numpy(np.load(op.join(path, f'angle_{scale}.npy'),
+                                                        mmap_mode='c'))
+        ecc_windows[scale] = torch.from_numpy(np.load(op.join(path, f'ecc_{scale}.npy'),
+                                                      mmap_mode='c'))
+    windows.angle_windows = angle_windows
+    windows.ecc_windows = ecc_windows
+    return windows
+
+
+def get_windows(windows_cls, scaling, img_res, min_eccentricity=.5, max_eccentricity=15,
+                num_scales=1, cache_dir=None, window_type='cosine',
+                transition_region_width=.5, std_dev=None):
+    r"""Get the pooling windows, using the memory-mapped cache if possible
+
+    If ``cache_dir`` is None, we just initialize ``windows_cls``. Else,
+    if the memory-mapped cache for these windows exists, we attach to it
+    (without initializing ``windows_cls`` at all). If it doesn't, we
+    initialize ``windows_cls`` (which will use and populate its own cache
+    in ``cache_dir``), write the memory-mapped cache, and then attach to
+    it, so that even the first process shares its windows.
+
+    Arguments are the same as those of ``PoolingWindows``, except:
+
+    Parameters
+    ----------
+    windows_cls : type
+        The ``PoolingWindows`` class
+
+    Returns
+    -------
+    windows : PoolingWindows
+        The initialized windows object
+
+    """
+    args = (scaling, img_res, min_eccentricity, max_eccentricity, num_scales, cache_dir,
+            window_type, transition_region_width, std_dev)
+    if cache_dir is None:
+        return windows_cls(*args)
+    path = window_cache_path(cache_dir, scaling, img_res, min_eccentricity, max_eccentricity,
+                             num_scales, window_type, transition_region_width, std_dev)
+    try:
+        windows = load_windows(path)
+    except Exception as e:
+        warnings.warn(f"Unable to load memory-mapped windows from {path}, will re-create them: "
+                      f"{e}")
+        windows = None
+    if windows is None:
+        windows = windows_cls(*args)
+        save_windows(windows, path)
+        windows = load_windows(path)
+    return windows
+
+
+def get_window_coverage(windows, path=None):
+    r"""Get the coverage of the windows, using the cache at path if possible
+
+    The coverage is what we get when we project a value of 1 in every
+    window (at the first scale) back onto the image: it's approximately
+    1 everywhere the windows cover and 0 in the fovea (and beyond the
+    maximum eccentricity). It only depends on the windows, so we save it
+    as ``coverage_{dtype}.npy`` alongside the windows, if we can, where
+    ``dtype`` is the dtype the windows are stored in (see
+    ``window_dtype``), since windows stored in reduced precision give a
+    slightly different coverage.
+
+    Parameters
+    ----------
+    windows : PoolingWindows
+        The initialized windows object
+    path : str or None, optional
+        The directory containing the cache for these windows, from
+        ``window_cache_path``. If None, we don't cache the coverage.
+
+    Returns
+    -------
+    coverage : torch.Tensor
+        2d tensor, the same size as the image, containing the coverage
+
+    """
+    angle, ecc = windows.angle_windows[0], windows.ecc_windows[0]
+    # the sparse backend casts its own copy of the windows, not angle_windows
+    window_dtype = getattr(windows, 'window_dtype', None) or angle.dtype
+    if path is not None:
+        path = op.join(path, f"coverage_{str(window_dtype).replace('torch.', '')}.npy")
+    if path is not None and op.exists(path):
+        coverage = torch.from_numpy(np.load(path))
+        return coverage.to(angle.device)
+    # the windows may be stored in reduced precision, see window_dtype
+    ones = torch.ones((1, 1, angle.shape[0] * ecc.shape[0]),
+                      dtype=torch.promote_types(angle.dtype, torch.float32), device=angle.device)
+    with torch.no_grad():
+        coverage = windows.project(ones).squeeze()
+    if path is not None:
+        os.makedirs(op.dirname(path), exist_ok=True)
+        _atomic_save(_np_save, path, coverage.to('cpu').numpy())
+    return coverage
@@ -0,0 +1,231 @@
+"""table describing the layout of the pooling windows, computed analytically
+
+Everything we need to know about where the windows are and how big they
+are (their central eccentricity and polar angle, their widths and their
+approximate areas) is determined by the parameters used to create them,
+and ``PoolingWindows`` already computes it per eccentricity band. Here,
+we gather it into a single table, with one row per window and scale, in
+the same order as the windows in the model's representation, so we
+never need to look at the windows themselves (which are large and may
+not be stored densely, see ``window_backend``) to answer these
+questions.
+"""
+import torch
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+
+def _angle_regions(n_angles, n_regions=4):
+    """assign each polar angle window to one of n_regions contiguous regions"""
+    regions = np.zeros(n_angles, dtype=int)
+    for j in range(n_regions):
+        regions[j*n_angles//n_regions:(j+1)*n_angles//n_regions] = j
+    return regions
+
+
+def _at_scale(values, scale):
+    """get the value at scale, for attributes that are either per-scale lists or shared"""
+    if isinstance(values, (list, tuple)):
+        return values[scale]
+    return values
+
+
+def window_metadata(windows, n_regions=4):
+    r"""Build the table of window metadata
+
+    Parameters
+    ----------
+    windows : PoolingWindows or PooledVentralStream
+        Any object with the window attributes of ``PoolingWindows``
+        (``n_polar_windows``, ``central_eccentricity_degrees``,
+        ``window_width_degrees``, etc.), which the models copy.
+    n_regions : int, optional
+        The number of contiguous angular regions to split the windows
+        into (by default, quadrants, starting from bottom right).
+
+    Returns
+    -------
+    metadata : pd.DataFrame
+        DataFrame with one row per window per scale, with the following
+        columns: ``scale``; ``window``, the index of this window in the
+        representation at that scale; ``eccentricity_band`` and
+        ``angle_window``, the indices of its eccentricity and polar
+        angle window; ``region``, which of the ``n_regions`` angular
+        regions it belongs to; ``center_angle``, the polar angle of its
+        center (in radians, assuming the windows are evenly spaced
+        starting at 0); ``center_eccentricity_{degrees,pixels}``, the
+        eccentricity of its center; ``{radial,angular}_{top,half,full}_width_{degrees,pixels}``,
+        its widths (see ``window_width_degrees``); and
+        ``{top,half,full}_area_{degrees,pixels}``, its approximate
+        areas (see ``window_approx_area_degrees``). Whichever width and
+        area keys ``windows`` has are included.
+
+    """
+    n_angles = windows.n_polar_windows
+    n_ecc = windows.n_eccentricity_bands
+    # eccentricity-major, to match the flattened representation
+    ecc_band = np.repeat(np.arange(n_ecc), n_angles)
+    angle_window = np.tile(np.arange(n_angles), n_ecc)
+    band_degrees = {'center_eccentricity_degrees': windows.central_eccentricity_degrees}
+    band_degrees.update({f'{k}_width_degrees': v for k, v in
+                         windows.window_width_degrees.items()})
+    band_degrees.update({f'{k}_area_degrees': v for k, v in
+                         windows.window_approx_area_degrees.items()})
+    metadata = []
+    for scale in range(len(windows.deg_to_pix)):
+        df = {'scale': scale, 'window': np.arange(n_ecc * n_angles),
+              'eccentricity_band': ecc_band, 'angle_window': angle_window,
+              'region': _angle_regions(n_angles, n_regions)[angle_window],
+              'center_angle': 2 * np.pi * angle_window / n_angles}
+        band_values = band_degrees.copy()
+        band_values['center_eccentricity_pixels'] = _at_scale(
+            windows.central_eccentricity_pixels, scale)
+        band_values.update({f'{k}_width_pixels': v for k, v in
+                            _at_scale(windows.window_width_pixels, scale).items()})
+        band_values.update({f'{k}_area_pixels': v for k, v in
+                            _at_scale(windows.window_approx_area_pixels, scale).items()})
+        for k, v in band_values.items():
+            # ObserverModel's central_eccentricity_degrees is a tensor
+            if isinstance(v, torch.Tensor):
+                v = v.detach().to('cpu').numpy()
+            df[k] = np.asarray(v, dtype=float).flatten()[ecc_band]
+        metadata.append(pd.DataFrame(df))
+    return pd.concat(metadata, ignore_index=True)
+
+
+def summarize_window_sizes(metadata, min_eccentricity, max_eccentricity):
+    r"""Summarize window sizes at the minimum and maximum eccentricity
+
+    Let ``min_window`` be the window whose center is closest to
+    ``min_eccentricity`` and ``max_window`` the one whose center is
+    closest to ``max_eccentricity``. We find its center, FWHM (in the
+    radial direction), and approximate area (at half-max) in degrees,
+    and do the same in pixels, for each scale.
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        The window metadata, from ``window_metadata``
+    min_eccentricity, max_eccentricity : float
+        The minimum and maximum eccentricity of the windows (in degrees)
+
+    Returns
+    -------
+    sizes : dict
+        Dictionary with keys ``{min,max}_window_{center,fwhm,area}_degrees``
+        and ``{min,max}_window_{center,fwhm,area}_pixels_scale_{i}``. All
+        values are scalar floats.
+
+    """
+    sizes = {}
+    for name, ecc in zip(['min', 'max'], [min_eccentricity, max_eccentricity]):
+        for scale, df in metadata.groupby('scale'):
+            row = df.loc[(df.center_eccentricity_degrees - ecc).abs().idxmin()]
+            units = [('pixels', f'_scale_{scale}')]
+            if scale == 0:
+                units.insert(0, ('degrees', ''))
+            for unit, suffix in units:
+                sizes[f'{name}_window_center_{unit}{suffix}'] = row[f'center_eccentricity_{unit}']
+                sizes[f'{name}_window_fwhm_{unit}{suffix}'] = row[f'radial_half_width_{unit}']
+                sizes[f'{name}_window_area_{unit}{suffix}'] = row[f'half_area_{unit}']
+    return sizes
+
+
+def _band_metadata(metadata, scale_num):
+    """get the rows for a single polar angle window at scale_num (one per eccentricity band)"""
+    return metadata[(metadata.scale == scale_num) & (metadata.angle_window == 0)]
+
+
+def plot_window_widths(metadata, units='degrees', scale_num=0, figsize=(5, 5), jitter=.25,
+                       width_types=['top', 'half', 'full']):
+    r"""plot the widths of the windows, in degrees or pixels
+
+    We plot this as a stem plot against eccentricity, showing the
+    windows at their central eccentricity.
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        The window metadata, from ``window_metadata``
+    units : {'degrees', 'pixels'}, optional
+        Whether to show the information in degrees or pixels (both the
+        width and the window location will be presented in the same
+        unit).
+    scale_num : int, optional
+        Which scale window we should plot
+    figsize : tuple, optional
+        The size of the figure to create
+    jitter : float or None, optional
+        How much to move the radial widths up and the angular widths
+        down along the x-axis, to separate them.
+    width_types : list, optional
+        Which of the widths to plot (if present in ``metadata``).
+
+    Returns
+    -------
+    fig : matplotlib.figure.Figure
+        The figure containing the plot
+
+    """
+    df = _band_metadata(metadata, scale_num)
+    ecc = df[f'center_eccentricity_{units}'].values
+    if jitter is None:
+        jitter = 0
+    fig, ax = plt.subplots(1, 1, figsize=figsize)
+    i = 0
+    for direction, offset in zip(['radial', 'angular'], [jitter, -jitter]):
+        for w in width_types:
+            col = f'{direction}_{w}_width_{units}'
+            if col not in df.columns:
+                continue
+            ax.stem(ecc + offset, df[col].values, linefmt=f'C{i}-', markerfmt=f'C{i}o',
+                    basefmt=' ', label=f'{direction}_{w}')
+            i += 1
+    ax.set(xlabel=f'eccentricity ({units})', ylabel=f'window width ({units})',
+           title=f'Window widths, scale {scale_num}')
+    ax.legend(loc='upper left')
+    return fig
+
+
+def plot_window_areas(metadata, units='degrees', scale_num=0, figsize=(5, 5),
+                      area_types=['top', 'half', 'full']):
+    r"""plot the approximate areas of the windows, in degrees or pixels
+
+    We plot this as a stem plot against eccentricity, showing the
+    windows at their central eccentricity.
+
+    Parameters
+    ----------
+    metadata : pd.DataFrame
+        The window metadata, from ``window_metadata``
+    units : {'degrees', 'pixels'}, optional
+        Whether to show the information in degrees or pixels (both the
+        area and the window location will be presented in the same
+        unit).
+    scale_num : int, optional
+        Which scale window we should plot
+    figsize : tuple, optional
+        The size of the figure to create
+    area_types : list, optional
+        Which of the areas to plot (if present in ``metadata``).
+
+    Returns
+    -------
+    fig : matplotlib.figure.Figure
+        The figure containing the plot
+
+    """
+    df = _band_metadata(metadata, scale_num)
+    ecc = df[f'center_eccentricity_{units}'].values
+    fig, ax = plt.subplots(1, 1, figsize=figsize)
+    for i, a in enumerate(area_types):
+        col = f'{a}_area_{units}'
+        if col not in df.columns:
+            continue
+        ax.stem(ecc, df[col].values, linefmt=f'C{i}-', markerfmt=f'C{i}o', basefmt=' ',
+                label=a)
+    ax.set(xlabel=f'eccentricity ({units})', ylabel=f'approximate window area ({units}^2)',
+           title=f'Window areas, scale {scale_num}')
+    ax.legend(loc='upper left')
+    return fig
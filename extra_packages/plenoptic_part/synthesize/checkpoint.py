@@ -0,0 +1,106 @@
+"""writing synthesis checkpoints without blocking optimization
+"""
+import os
+import threading
+import torch
+import dill
+
+
+def snapshot(obj):
+    r"""Copy everything in obj that might change during synthesis
+
+    We recurse through lists, tuples, and dicts, copying every tensor
+    we find to the cpu (we always copy, even if it's already on the cpu,
+    because the optimizer modifies tensors in place). Everything else is
+    returned as is.
+
+    Parameters
+    ----------
+    obj : object
+        The object to copy
+
+    Returns
+    -------
+    obj_copy : object
+        The copy
+
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    elif isinstance(obj, list):
+        return [snapshot(o) for o in obj]
+    elif isinstance(obj, tuple):
+        return tuple([snapshot(o) for o in obj])
+    elif isinstance(obj, dict):
+        return dict([(k, snapshot(v)) for k, v in obj.items()])
+    return obj
+
+
+def atomic_save(save_dict, file_path):
+    r"""torch.save save_dict to file_path, atomically
+
+    We write to a temporary file in the same directory and then rename
+    it, so that file_path always contains either the previous or the
+    new version, never a partially-written one (e.g., if we get killed
+    while saving).
+
+    Parameters
+    ----------
+    save_dict : dict
+        The dictionary to save
+    file_path : str
+        The path to save it at
+
+    """
+    tmp_path = file_path + '.tmp'
+    torch.save(save_dict, tmp_path, pickle_module=dill)
+    os.replace(tmp_path, file_path)
+
+
+class CheckpointWriter(object):
+    r"""Run checkpoint writes in a background thread
+
+    Calling ``submit(func, *args)`` runs ``func(*args)`` in a new
+    thread and returns immediately, so synthesis can continue while the
+    checkpoint is serialized and written to disk. Whatever ``func``
+    writes must therefore already be a snapshot (see ``snapshot()``),
+    not something that will be modified by later iterations.
+
+    Only one write happens at a time: if the previous one is still
+    running when ``submit`` is called, we wait for it to finish first
+    (so we never build up a queue of snapshots in memory). Any exception
+    raised by the write is re-raised on the next call to ``submit`` or
+    ``wait``.
+
+    """
+
+    def __init__(self):
+        self._thread = None
+        self._error = None
+
+    def _run(self, func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            self._error = e
+
+    def wait(self):
+        """block until the current write (if any) has finished"""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def submit(self, func, *args):
+        """run ``func(*args)`` in the background, once the previous write has finished"""
+        self.wait()
+        self._thread = threading.Thread(target=self._run, args=(func, *args), daemon=True)
+        self._thread.start()
+
+    @property
+    def busy(self):
+        """whether a write is currently running"""
+        return self._thread is not None and self._thread.is_alive()
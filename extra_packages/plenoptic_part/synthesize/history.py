@@ -0,0 +1,270 @@
+"""append-only on-disk storage for the synthesis history
+"""
+import os
+import os.path as op
+import json
+import numpy as np
+import torch
+
+
+class HistoryStore(object):
+    r"""Append-only store for the ``saved_*`` attributes of a synthesis object
+
+    When saving synthesis progress, pickling the whole object means
+    re-writing every stored signal, representation, and gradient each
+    time, so checkpoints get slower and larger as synthesis goes
+    on. Instead, this writes each stored iteration exactly once: every
+    time ``append`` is called, the new values are written to a new
+    ``.npy`` segment in ``directory``, and a small JSON index (at
+    ``directory/index.json``) keeps track of the segments belonging to
+    each attribute. Reading happens lazily, through memory-mapped
+    arrays, see ``LazyHistory``.
+
+    Each store belongs to a single synthesis run, identified by
+    ``run_id``. If ``directory`` already contains a store from a
+    different run, we remove its segments and start over.
+
+    Parameters
+    ----------
+    directory : str
+        The directory containing the store. Will be created if it
+        doesn't exist.
+    run_id : str or None, optional
+        The identifier of the synthesis run this store belongs to. If
+        None, we use whatever is found in the index (i.e., we're
+        reading, not writing).
+
+    """
+
+    def __init__(self, directory, run_id=None):
+        self.directory = directory
+        self._index_path = op.join(directory, 'index.json')
+        if op.exists(self._index_path):
+            with open(self._index_path) as f:
+                self.index = json.load(f)
+        else:
+            self.index = {'run_id': run_id, 'next_segment': 0, 'attrs': {}}
+        if run_id is not None and self.index['run_id'] != run_id:
+            # then this is left over from a different run
+            self._remove_segments(list(self.index['attrs'].keys()))
+            self.index = {'run_id': run_id, 'next_segment': 0, 'attrs': {}}
+
+    def _remove_segments(self, names):
+        """remove all segments belonging to the attributes in names"""
+        for name in names:
+            for seg in self.index['attrs'].pop(name, []):
+                try:
+                    os.remove(op.join(self.directory, seg['file']))
+                except FileNotFoundError:
+                    pass
+
+    def __len__(self):
+        return len(self.index['attrs'])
+
+    def keys(self):
+        return self.index['attrs'].keys()
+
+    def n_stored(self, name):
+        """the number of values stored for attribute name"""
+        return sum([seg['length'] for seg in self.index['attrs'].get(name, [])])
+
+    def truncate(self, name, length):
+        """drop all values of attribute name after the first length"""
+        segments = []
+        n = 0
+        for seg in self.index['attrs'].get(name, []):
+            if n + seg['length'] <= length:
+                segments.append(seg)
+            elif n < length:
+                # this segment straddles the boundary, so re-write the
+                # part we want to keep to a new segment
+                arr = np.load(op.join(self.directory, seg['file']))[:length-n]
+                segments.append(self._write_segment(name, arr))
+                os.remove(op.join(self.directory, seg['file']))
+            else:
+                os.remove(op.join(self.directory, seg['file']))
+            n += seg['length']
+        self.index['attrs'][name] = segments
+
+    def _write_segment(self, name, arr):
+        """write arr to a new segment and return the entry for the index"""
+        os.makedirs(self.directory, exist_ok=True)
+        fname = f"{name}_{self.index['next_segment']:06d}.npy"
+        self.index['next_segment'] += 1
+        np.save(op.join(self.directory, fname), arr)
+        return {'file': fname, 'length': arr.shape[0], 'shape': list(arr.shape[1:]),
+                'dtype': str(arr.dtype)}
+
+    def append(self, name, values):
+        """write values to the store
+
+        values are written to one new segment, unless they have
+        different shapes (e.g., gradients during coarse-to-fine
+        optimization), in which case each run of same-shaped values gets
+        its own segment.
+
+        Parameters
+        ----------
+        name : str
+            name of the attribute these values belong to
+        values : list
+            list of tensors to append
+
+        """
+        segments = self.index['attrs'].setdefault(name, [])
+        run = []
+        for v in values:
+            v = v.detach().to('cpu')
+            if run and run[-1].shape != v.shape:
+                segments.append(self._write_segment(name, torch.stack(run).numpy()))
+                run = []
+            run.append(v)
+        if run:
+            segments.append(self._write_segment(name, torch.stack(run).numpy()))
+
+    def sync(self, name, values):
+        """write the values that aren't in the store yet
+
+        We assume that the first ``self.n_stored(name)`` entries of
+        values are already in the store (which will be the case if
+        values has been appended to ever since this run started), and
+        only write the rest. If the store contains more values than
+        values (e.g., because we died after updating the store but
+        before saving the corresponding checkpoint), we drop the extras
+        first.
+
+        Parameters
+        ----------
+        name : str
+            name of the attribute these values belong to
+        values : list, torch.Tensor, or LazyHistory
+            All values of this attribute
+
+        """
+        n_stored = self.n_stored(name)
+        if n_stored > len(values):
+            self.truncate(name, len(values))
+            n_stored = len(values)
+        self.append(name, [values[i] for i in range(n_stored, len(values))])
+
+    def write_index(self):
+        """write the index to disk
+
+        We write to a temporary file and then rename it, so the index is
+        never left half-written.
+
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self._index_path)
+
+    def load(self, name, length=None):
+        """return a LazyHistory for attribute name
+
+        Parameters
+        ----------
+        name : str
+            name of the attribute to load
+        length : int or None, optional
+            If not None, only use the first length values (the index may
+            contain values written after the checkpoint we're loading).
+
+        Returns
+        -------
+        history : LazyHistory
+            lazy, read-only view of the stored values
+
+        """
+        return LazyHistory(self.directory, self.index['attrs'].get(name, []), length)
+
+
+class LazyHistory(object):
+    r"""Lazy, read-only view of one attribute in a HistoryStore
+
+    This behaves (mostly) like the stacked tensor it stands in for:
+    ``len()``, iteration, ``shape`` (if all values have the same shape),
+    and indexing all work, where the first index selects the iteration
+    (an int or a slice) and any remaining indices are applied to the
+    resulting tensor. Values are read from memory-mapped ``.npy`` files
+    only when requested, so only the iterations we look at are loaded
+    into memory.
+
+    Parameters
+    ----------
+    directory : str
+        The directory containing the store
+    segments : list
+        List of dictionaries, the index entries for this attribute's
+        segments
+    length : int or None, optional
+        If not None, only use the first length values
+
+    """
+
+    def __init__(self, directory, segments, length=None):
+        self._directory = directory
+        self._segments = segments
+        self._offsets = np.cumsum([0] + [seg['length'] for seg in segments])
+        self._length = int(self._offsets[-1])
+        if length is not None:
+            self._length = min(length, self._length)
+        self._arrays = {}
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def shape(self):
+        shapes = set([tuple(seg['shape']) for seg in self._segments])
+        if len(shapes) > 1:
+            raise AttributeError("Values have different shapes, so this has no shape!")
+        shape = shapes.pop() if shapes else ()
+        return torch.Size((len(self), *shape))
+
+    def _array(self, seg):
+        """memory-map segment number seg"""
+        if seg not in self._arrays:
+            self._arrays[seg] = np.load(op.join(self._directory, self._segments[seg]['file']),
+                                        mmap_mode='r')
+        return self._arrays[seg]
+
+    def _get(self, i):
+        """load the value of iteration i as a tensor"""
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError(f"index {i} is out of bounds for history of length {len(self)}")
+        seg = np.searchsorted(self._offsets, i, side='right') - 1
+        return torch.from_numpy(np.array(self._array(seg)[i - self._offsets[seg]]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get(i)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, tuple):
+            idx, rest = idx[0], idx[1:]
+        else:
+            rest = ()
+        if isinstance(idx, slice):
+            vals = [self._get(i) for i in range(*idx.indices(len(self)))]
+            try:
+                vals = torch.stack(vals)
+            except RuntimeError:
+                if rest:
+                    raise
+                return vals
+            rest = (slice(None), *rest)
+        else:
+            vals = self._get(int(idx))
+        if rest:
+            vals = vals[rest]
+        return vals
+
+    def __getstate__(self):
+        # we don't want to pickle the memory-mapped arrays
+        state = self.__dict__.copy()
+        state['_arrays'] = {}
+        return state
@@ -1,3 +1,4 @@
+import copy
 import torch
 from tqdm import tqdm
 from .synthesis import Synthesis
@@ -51,7 +52,9 @@ class Metamer(Synthesis):
     ----------
     base_representation : torch.Tensor
         Whatever is returned by ``model(base_signal)``, this is
-        what we match in order to create a metamer
+        what we match in order to create a metamer. We compute this
+        without gradients, so if the model has a
+        ``representation_cache``, this is loaded from it if possible.
     synthesized_signal : torch.Tensor
         The metamer. This may be unfinished depending on how many
         iterations we've run for.
@@ -62,7 +65,10 @@ class Metamer(Synthesis):
         Number with which we seeded pytorch and numpy's random number
         generators
     loss : list
-        A list of our loss over iterations.
+        A list of our loss over iterations. If we're doing
+        coarse-to-fine optimization, this is the loss with respect to
+        the scales we were optimizing on that iteration (and so only
+        reflects all scales once we've reached ``'all'``).
     gradient : list
         A list of the gradient over iterations.
     learning_rate : list
@@ -74,6 +80,9 @@ class Metamer(Synthesis):
         ``synthesized_signal`` between iterations ``i`` and ``i-1``). note
         this is calculated before any clamping, so may have some very
         large numbers in the beginning
+    window_fraction : list
+        A list of the fraction of the model's pooling windows used on
+        each iteration (see ``synthesize``'s ``window_fraction``).
     saved_signal : torch.Tensor or list
         Saved ``self.synthesized_signal`` for later examination.
     saved_representation : torch.Tensor or list
@@ -92,6 +101,14 @@ class Metamer(Synthesis):
         the iteration where we started and stopped optimizing this scale.
     scales_finished : list or None
         List of scales that we've finished optimizing.
+    batch_loss : list
+        A list of lists containing the loss of each batch element over
+        iterations (``loss`` is their sum). Only interesting if we're
+        synthesizing multiple metamers at once.
+    batch_stopped_iter : list or None
+        List with one entry per batch element, giving the iteration at
+        which it stopped (because its loss stabilized or was NaN), or
+        None if it ran until the end.
 
     References
     -----
@@ -122,7 +139,8 @@ class Metamer(Synthesis):
         initial_image : torch.Tensor, array_like, or None, optional
             The 2d tensor we use to initialize the metamer. If None (the
             default), we initialize with uniformly-distributed random
-            noise lying between 0 and 1 or, if ``self.saved_signal`` is
+            noise lying between 0 and 1 (one image per seed, if
+            ``self.seed`` is a list) or, if ``self.saved_signal`` is
             not empty, use the final value there. If this is not a
             tensor or None, we try to cast it as a tensor.
         clamper : Clamper or None, optional
@@ -135,12 +153,28 @@ class Metamer(Synthesis):
         """
         if initial_image is None:
             try:
-                # then we have a previous run to resume
-                synthesized_signal_data = self.saved_signal[-1]
+                # then we have a previous run to resume. synthesized_signal
+                # is exactly where it left off (saved_signal[-1] may be
+                # several iterations earlier)
+                if self.synthesized_signal is not None:
+                    synthesized_signal_data = self.synthesized_signal.detach()
+                else:
+                    synthesized_signal_data = self.saved_signal[-1]
             except IndexError:
                 # else we're starting over
-                synthesized_signal_data = torch.rand_like(self.base_signal, dtype=torch.float32,
-                                                          device=self.base_signal.device)
+                if isinstance(self.seed, (list, tuple)):
+                    # one metamer per seed, each initialized exactly as
+                    # it would have been on its own
+                    synthesized_signal_data = []
+                    for seed in self.seed:
+                        torch.manual_seed(seed)
+                        synthesized_signal_data.append(torch.rand_like(self.base_signal,
+                                                                       dtype=torch.float32,
+                                                                       device=self.base_signal.device))
+                    synthesized_signal_data = torch.cat(synthesized_signal_data)
+                else:
+                    synthesized_signal_data = torch.rand_like(self.base_signal, dtype=torch.float32,
+                                                              device=self.base_signal.device)
         else:
             synthesized_signal_data = torch.tensor(initial_image, dtype=torch.float32,
                                                    device=self.base_signal.device)
@@ -152,7 +186,9 @@ class Metamer(Synthesis):
                    clamp_each_iter=True, store_progress=False, save_progress=False,
                    save_path='metamer.pt', loss_thresh=1e-4, loss_change_iter=50,
                    fraction_removed=0., loss_change_thresh=1e-2, loss_change_fraction=1.,
-                   coarse_to_fine=False, clip_grad_norm=False):
+                   coarse_to_fine=False, clip_grad_norm=False, history_dir=None,
+                   save_progress_async=False, profile=False, window_fraction=1.,
+                   precondition=False):
         r"""Synthesize a metamer
 
         This is the main method, which updates the ``initial_image`` until its
@@ -167,18 +203,31 @@ class Metamer(Synthesis):
         initial_image : torch.Tensor, array_like, or None, optional
             The 4d tensor we use to initialize the metamer. If None (the
             default), we initialize with uniformly-distributed random
-            noise lying between 0 and 1 or, if ``self.saved_signal`` is
-            not empty, use the final value there. If this is not a
-            tensor or None, we try to cast it as a tensor.
-        seed : int or None, optional
+            noise lying between 0 and 1 or, if we've already run
+            synthesis (e.g., this object was loaded from a checkpoint
+            saved with ``save_progress``), continue from where it left
+            off: we also restore the state of the optimizer, learning
+            rate scheduler (and SWA), and random number generators, so
+            the result is identical to having run uninterrupted. If this
+            is not a
+            tensor or None, we try to cast it as a tensor. If this has
+            more than one element along the batch dimension, we
+            synthesize a metamer for each of them at once (see
+            ``split_batch()``).
+        seed : int, list, or None, optional
             Number with which to seed pytorch and numy's random number
-            generators. If None, won't set the seed.
+            generators. If None, won't set the seed. If a list (and
+            ``initial_image`` is None), we synthesize one metamer per
+            seed at once, each of them initialized with noise generated
+            using its seed.
         max_iter : int, optinal
             The maximum number of iterations to run before we end
         learning_rate : float or None, optional
             The learning rate for our optimizer. None is only accepted
             if we're resuming synthesis, in which case we use the last
-            learning rate from the previous instance.
+            learning rate from the previous instance (as well as the
+            rest of the optimizer's state; pass None to continue
+            exactly where it left off).
         scheduler : bool, optional
             whether to initialize the scheduler or not. If False, the
             learning rate will never decrease.
@@ -255,6 +304,48 @@ class Metamer(Synthesis):
             Clip the gradient norm to avoid issues with numerical overflow.
             Gradient norm will be clipped to the specified value (True is
             equivalent to 1).
+        history_dir : str or None, optional
+            If not None, when saving progress, we write the ``saved_*``
+            attributes to an append-only store in this directory (each
+            stored iteration is written once), instead of including
+            them in the file at ``save_path``. This makes saving much
+            cheaper for long syntheses. ``Metamer.load`` reads them back
+            lazily.
+        save_progress_async : bool, optional
+            If True, we save progress in a background thread: we take a
+            snapshot of everything we need (including the optimizer and
+            scheduler state) and keep optimizing while it's written to
+            disk. The file at ``save_path`` is replaced atomically, so
+            it's always a complete checkpoint. If the previous save
+            hasn't finished by the time of the next one, we wait for it.
+        profile : bool, optional
+            If True, we record the time and peak memory of each phase of
+            each iteration (model forward, loss, backward, optimizer
+            step, clamping, storing, saving, and the model's own phases,
+            if it supports it) in ``self.profiler``, a
+            ``PhaseProfiler``. This adds a small amount of overhead
+            (especially on the GPU, where we have to synchronize).
+        window_fraction : float, optional
+            The fraction of the model's pooling windows to use on each
+            iteration (drawn at random every iteration), so that each
+            iteration is cheaper; the loss is then an estimate based on
+            those windows. Every time the loss stops decreasing (based
+            on ``loss_change_iter`` and ``loss_change_thresh``), we
+            double the fraction, until we use all of them, and we only
+            check whether synthesis has finished (using ``loss_thresh``)
+            after that. Only for models that pool with windows (i.e.,
+            ``PooledVentralStream`` models). The fraction used on each
+            iteration is stored in ``self.window_fraction``.
+        precondition : bool or float, optional
+            If not False, we multiply the gradient at each pixel by the
+            model's ``gradient_preconditioner`` before each step, which
+            grows with the size of the windows the pixel belongs to, so
+            the periphery converges about as quickly as the center. If a
+            float, we raise the preconditioner to that power (True is
+            equivalent to 1). The preconditioner has a mean of 1 and is
+            capped at 10, so no pixel's gradient is scaled up by more
+            than that. Only for models that pool with windows
+            (i.e., ``PooledVentralStream`` models).
 
         Returns
         -------
@@ -264,31 +355,52 @@ class Metamer(Synthesis):
             The model's representation of the metamer
 
         """
+        if (isinstance(seed, (list, tuple)) and initial_image is not None and
+            len(seed) != initial_image.shape[0]):
+            raise Exception(f"Got {len(seed)} seeds but initial_image has batch size "
+                            f"{initial_image.shape[0]}!")
+        # if we're resuming, grab the optimizer, scheduler, and rng
+        # states before we re-initialize everything
+        resume_state = self._get_resume_state(optimizer, swa)
         # set seed
         self._set_seed(seed)
 
+        # the model doesn't need to store copies of its intermediate
+        # results during synthesis
+        self._init_lean_model()
+
         # initialize synthesized_signal
         self._init_synthesized_signal(initial_image, clamper, clamp_each_iter)
 
+        self._init_profiler(profile)
+
         # initialize stuff related to coarse-to-fine and randomization
         self._init_ctf_and_randomizer(loss_thresh, fraction_removed, coarse_to_fine,
-                                      loss_change_fraction, loss_change_thresh, loss_change_iter)
+                                      loss_change_fraction, loss_change_thresh, loss_change_iter,
+                                      window_fraction)
 
         # initialize the optimizer
         self._init_optimizer(optimizer, learning_rate, scheduler, clip_grad_norm,
-                             optimizer_kwargs, swa, swa_kwargs)
+                             optimizer_kwargs, swa, swa_kwargs, precondition)
+        self._restore_resume_state(resume_state, learning_rate)
 
         # get ready to store progress
-        self._init_store_progress(store_progress, save_progress, save_path)
+        self._init_store_progress(store_progress, save_progress, save_path, history_dir,
+                                  save_progress_async)
 
-        pbar = tqdm(range(max_iter))
+        # i counts iterations across all calls to synthesize, so storing
+        # and saving progress continue on the same schedule when resuming
+        n_previous = len(self.loss)
+        pbar = tqdm(range(n_previous, n_previous + max_iter))
 
         for i in pbar:
             loss, g, lr, pixel_change = self._optimizer_step(pbar)
             self.loss.append(loss.item())
+            self.batch_loss.append(self._last_batch_loss.tolist())
             self.pixel_change.append(pixel_change.item())
             self.gradient.append(g.item())
             self.learning_rate.append(lr)
+            self.window_fraction.append(self._window_fraction)
 
             if self._check_nan_loss(loss):
                 break
@@ -296,13 +408,20 @@ class Metamer(Synthesis):
             # clamp and update saved_* attrs
             self._clamp_and_store(i)
 
+            if self.profiler is not None:
+                self.profiler.step(len(self.loss)-1)
+
             if self._check_for_stabilization(i):
                 break
 
         pbar.close()
+        self._finish_saving_progress()
+        self._finish_profiler()
+        self._finish_lean_model()
 
         if self._swa:
             self._optimizer.swap_swa_sgd()
+            self._swa_swapped = True
 
         # finally, stack the saved_* attributes
         self._finalize_stored_progress()
@@ -310,7 +429,8 @@ class Metamer(Synthesis):
         # return data
         return self.synthesized_signal.data, self.synthesized_representation.data
 
-    def save(self, file_path, save_model_reduced=False):
+    def save(self, file_path, save_model_reduced=False, history_dir=None,
+             checkpoint_writer=None):
         r"""save all relevant variables in .pt file
 
         Note that if store_progress is True, this will probably be very
@@ -326,14 +446,81 @@ class Metamer(Synthesis):
             the basic idea being that it only contains the attributes
             necessary to initialize the model, none of the (probably
             much larger) ones it gets during run-time).
+        history_dir : str or None, optional
+            If not None, the ``saved_*`` attributes are written to the
+            append-only history store in this directory (only the
+            values that aren't there already) instead of ``file_path``,
+            which then just points to it.
+        checkpoint_writer : CheckpointWriter or None, optional
+            If not None, we snapshot everything and write it in the
+            background using this writer.
 
         """
         attrs = ['model', 'synthesized_signal', 'base_signal', 'seed', 'loss', 'base_representation',
                  'synthesized_representation', 'saved_representation', 'gradient', 'saved_signal',
                  'learning_rate', 'saved_representation_gradient', 'saved_signal_gradient',
                  'coarse_to_fine', 'scales', 'scales_timing', 'scales_loss', 'loss_function',
-                 'scales_finished', 'store_progress', 'save_progress', 'save_path', 'pixel_change']
-        super().save(file_path, save_model_reduced,  attrs)
+                 'scales_finished', 'store_progress', 'save_progress', 'save_path', 'pixel_change',
+                 'batch_loss', 'batch_stopped_iter', 'window_fraction']
+        super().save(file_path, save_model_reduced,  attrs, history_dir=history_dir,
+                     checkpoint_writer=checkpoint_writer)
+
+    def split_batch(self):
+        r"""Split a batched synthesis into one Metamer object per batch element
+
+        If we synthesized multiple metamers at once (by passing a list
+        of seeds or an initial image with batch size greater than 1 to
+        ``synthesize()``), this returns a list of Metamer objects, each
+        of which looks as if it had been synthesized on its own: the
+        signals, representations, and saved history are indexed along
+        the batch dimension, ``loss`` is taken from ``batch_loss``, and
+        all the attributes stored on every iteration are truncated at
+        the iteration where that element stopped. Note that
+        ``gradient``, ``pixel_change``, ``learning_rate``, and
+        ``window_fraction`` are computed on the whole batch.
+
+        The model is shared between all of the returned objects.
+
+        Returns
+        -------
+        metamers : list
+            List of Metamer objects, one per batch element
+
+        """
+        metamers = []
+        for i in range(self.synthesized_signal.shape[0]):
+            met = copy.copy(self)
+            n_iter = len(self.loss)
+            if self.batch_stopped_iter[i] is not None:
+                n_iter = self.batch_stopped_iter[i] + 1
+            met.loss = [l[i] for l in self.batch_loss[:n_iter]]
+            met.batch_loss = [[l[i]] for l in self.batch_loss[:n_iter]]
+            met.batch_stopped_iter = [None]
+            for k in ['gradient', 'learning_rate', 'pixel_change', 'window_fraction']:
+                setattr(met, k, getattr(self, k)[:n_iter])
+            if isinstance(self.seed, (list, tuple)):
+                met.seed = self.seed[i]
+            met.synthesized_signal = torch.nn.Parameter(self.synthesized_signal.data[i:i+1].clone())
+            met.synthesized_representation = self.synthesized_representation[i:i+1].detach()
+            if self.store_progress:
+                # the first saved signal and representation come from
+                # before synthesis started, so there's one more of them
+                # than of the gradients
+                n_saved = n_iter // self.store_progress
+                for k, n in zip(['saved_signal', 'saved_representation', 'saved_signal_gradient',
+                                 'saved_representation_gradient'],
+                                [n_saved+1, n_saved+1, n_saved, n_saved]):
+                    setattr(met, k, [s[i:i+1] for s in getattr(self, k)[:n]])
+                    try:
+                        setattr(met, k, torch.stack(getattr(met, k)))
+                    except RuntimeError:
+                        # the gradients will have different shapes if
+                        # we used coarse-to-fine optimization
+                        pass
+            met._base_representation_cache = {}
+            met._base_representation_cache_model = None
+            metamers.append(met)
+        return metamers
 
     def to(self, *args, **kwargs):
         r"""Moves and/or casts the parameters and buffers.
@@ -2,6 +2,8 @@
 """
 import abc
 import re
+import os.path as op
+import uuid
 import torch
 from torch import optim
 import numpy as np
@@ -19,6 +21,10 @@ from matplotlib import animation
 from tqdm import tqdm
 import dill
 from ..tools.clamps import RangeClamper
+from .history import HistoryStore, LazyHistory
+from .checkpoint import CheckpointWriter, atomic_save, snapshot
+from ..tools.profiling import PhaseProfiler, profile_phase
+from ..simulate.representation_cache import use_representation_cache
 
 
 class Synthesis(metaclass=abc.ABCMeta):
@@ -88,16 +94,39 @@ class Synthesis(metaclass=abc.ABCMeta):
             self.loss_function = wrapped_model
             self._rep_warning = True
 
-        self.base_representation = self.analyze(self.base_signal)
+        # we never need the gradient with respect to base_signal, and this
+        # way, the model can get the representation from its
+        # representation_cache (if it has one). base_signal is the only
+        # thing we let it cache: synthesized_signal changes every
+        # iteration
+        with torch.no_grad(), use_representation_cache():
+            self.base_representation = self.analyze(self.base_signal)
+        # the base_signal never changes during synthesis, so we cache its
+        # representation (keyed by the scales used to compute it) instead
+        # of re-computing it every iteration. see
+        # _get_base_representation()
+        self._base_representation_cache = {}
+        self._base_representation_cache_model = None
+        self._base_representation_cache_hits = 0
+        self._base_representation_cache_misses = 0
         self.synthesized_signal = None
         self.synthesized_representation = None
         self._optimizer = None
         self._scheduler = None
+        # whether synthesized_signal currently holds the SWA average
+        # (instead of the value the optimizer is working on)
+        self._swa_swapped = False
 
         self.loss = []
         self.gradient = []
         self.learning_rate = []
         self.pixel_change = []
+        self.window_fraction = []
+        self._window_fraction = 1
+        self._window_fraction_start = 0
+        self._window_subset = None
+        self._preconditioner = None
+        self._preconditioner_power = None
         self._last_iter_synthesized_signal = None
         self.saved_representation = []
         self.saved_signal = []
@@ -109,6 +138,19 @@ class Synthesis(metaclass=abc.ABCMeta):
         self.scales_finished = None
         self.coarse_to_fine = False
         self.store_progress = None
+        self._history_dir = None
+        self._history_run_id = None
+        self._checkpoint_writer = None
+        self.profiler = None
+        self._analyze_kwargs = {}
+        # these are used to keep track of the individual elements when
+        # synthesizing multiple signals at once (along the batch
+        # dimension)
+        self.batch_loss = []
+        self.batch_stopped_iter = None
+        self._batch_active = None
+        self._batch_frozen_signal = None
+        self._last_batch_loss = None
 
     def _set_seed(self, seed):
         """set the seed
@@ -119,15 +161,126 @@ class Synthesis(metaclass=abc.ABCMeta):
 
         Parameters
         ----------
-        seed : int
-            the seed to set
+        seed : int, list, or None
+            the seed to set. If a list, we're synthesizing multiple
+            signals at once and we use the first one to seed the
+            generators.
         """
         self.seed = seed
+        if isinstance(seed, (list, tuple)):
+            # then we're synthesizing several signals at once, and seed
+            # the generators with the first one (the initial signals
+            # should be generated using all of them, see
+            # Metamer._init_synthesized_signal)
+            seed = seed[0]
         if seed is not None:
             # random initialization
             torch.manual_seed(seed)
             np.random.seed(seed)
 
+    @staticmethod
+    def _get_rng_state():
+        """get the state of torch's and numpy's random number generators"""
+        rng_state = {'torch': torch.get_rng_state(), 'numpy': np.random.get_state()}
+        if torch.cuda.is_available():
+            rng_state['cuda'] = torch.cuda.get_rng_state_all()
+        return rng_state
+
+    @staticmethod
+    def _set_rng_state(rng_state):
+        """set the state of the random number generators, from ``_get_rng_state``"""
+        # these must be on the cpu, regardless of the map_location we
+        # were loaded with
+        torch.set_rng_state(rng_state['torch'].to('cpu'))
+        np.random.set_state(rng_state['numpy'])
+        if 'cuda' in rng_state and torch.cuda.is_available():
+            if len(rng_state['cuda']) == torch.cuda.device_count():
+                torch.cuda.set_rng_state_all([s.to('cpu') for s in rng_state['cuda']])
+            else:
+                warnings.warn("Number of GPUs has changed since this synthesis was saved, so "
+                              "can't restore the state of their random number generators")
+
+    def _get_resume_state(self, optimizer, swa=False):
+        """get the state we need to continue a previous synthesis exactly
+
+        If we've already run synthesis (``self.loss`` is not empty), we
+        grab the state of the optimizer, learning rate scheduler, and
+        random number generators, either from the objects themselves (if
+        ``synthesize()`` was called before on this object) or from the
+        values saved with it (if it was loaded from a checkpoint), so
+        that ``_restore_resume_state`` can restore them after
+        re-initializing everything.
+
+        Parameters
+        ----------
+        optimizer : str
+            the optimizer we're about to initialize. If it's not the
+            one we were using before, we can't restore its state.
+        swa : bool, optional
+            whether we're about to use stochastic weight averaging
+
+        Returns
+        -------
+        resume_state : dict or None
+            None if this is a new synthesis, else a dictionary with
+            keys ``optimizer``, ``scheduler``, ``rng``, and
+            ``swa_swapped`` (any of which may be None)
+
+        """
+        if not self.loss:
+            return None
+        if self._optimizer is not None:
+            resume_state = {'optimizer': self._optimizer.state_dict(),
+                            'scheduler': (self._scheduler.state_dict()
+                                          if self._scheduler is not None else None),
+                            'rng': self._get_rng_state()}
+        else:
+            # older checkpoints won't have all of these
+            resume_state = {'optimizer': getattr(self, '_optimizer_state_dict', None),
+                            'scheduler': getattr(self, '_scheduler_state_dict', None),
+                            'rng': getattr(self, '_rng_state', None)}
+        resume_state['swa_swapped'] = self._swa_swapped
+        init_kwargs = getattr(self, '_init_optimizer_kwargs', {})
+        if (init_kwargs.get('optimizer', optimizer) != optimizer or
+            init_kwargs.get('swa', swa) != swa):
+            warnings.warn(f"Previous synthesis used optimizer {init_kwargs['optimizer']} (swa="
+                          f"{init_kwargs['swa']}), so can't restore its state for optimizer "
+                          f"{optimizer} (swa={swa})! Will start with a new optimizer and "
+                          "scheduler instead.")
+            resume_state.update({'optimizer': None, 'scheduler': None, 'swa_swapped': False})
+        return resume_state
+
+    def _restore_resume_state(self, resume_state, learning_rate=None):
+        """restore the state grabbed by ``_get_resume_state``
+
+        This should be called after ``_init_optimizer``.
+
+        Parameters
+        ----------
+        resume_state : dict or None
+            The output of ``_get_resume_state``. If None, we do nothing.
+        learning_rate : float or None, optional
+            If not None, we use this learning rate instead of the
+            restored one.
+
+        """
+        if resume_state is None:
+            return
+        if resume_state['optimizer'] is not None:
+            self._optimizer.load_state_dict(resume_state['optimizer'])
+            if resume_state['scheduler'] is not None and self._scheduler is not None:
+                self._scheduler.load_state_dict(resume_state['scheduler'])
+            if resume_state['swa_swapped']:
+                # synthesized_signal holds the SWA average from the end
+                # of the last synthesis, so swap back to continue
+                self._optimizer.swap_swa_sgd()
+            if learning_rate is not None:
+                for group in self._optimizer.param_groups:
+                    group['lr'] = learning_rate
+        if resume_state['rng'] is not None:
+            self._set_rng_state(resume_state['rng'])
+        self._swa_swapped = False
+
     def _init_synthesized_signal(self, synthesized_signal_data, clamper=RangeClamper((0, 1)),
                                  clamp_each_iter=True):
         """initialize the synthesized image
@@ -156,12 +309,125 @@ class Synthesis(metaclass=abc.ABCMeta):
         self.clamper = clamper
         if self.clamper is not None:
             self.synthesized_signal.data = self.clamper.clamp(self.synthesized_signal.data)
-        self.synthesized_representation = self.analyze(self.synthesized_signal)
+        # this is only used for storing progress (the first call to
+        # _closure will re-compute it), so no need to build the graph
+        with torch.no_grad():
+            self.synthesized_representation = self.analyze(self.synthesized_signal)
         self.clamp_each_iter = clamp_each_iter
+        self._init_batch()
+
+    def _init_batch(self):
+        """initialize the attributes used to track each batch element
+
+        If ``synthesized_signal`` has more than one element along the
+        batch dimension, we synthesize all of them at once, each of them
+        trying to match the (single) ``base_signal``. Each element has
+        its own loss (tracked in ``self.batch_loss``) and is checked for
+        stabilization and NaNs separately. Once an element has stopped,
+        we record the iteration in ``self.batch_stopped_iter`` and keep
+        its value fixed for the rest of synthesis (it remains part of
+        the batch, so it's still analyzed, but it no longer changes).
+
+        """
+        batch_size = self.synthesized_signal.shape[0]
+        if batch_size > 1 and self.base_signal.shape[0] != 1:
+            raise Exception("When synthesizing multiple signals at once, base_signal must have a "
+                            f"batch dimension of 1, but it has shape {self.base_signal.shape}!")
+        if (self.batch_stopped_iter is None or len(self.batch_stopped_iter) != batch_size
+            or batch_size == 1):
+            self.batch_stopped_iter = [None] * batch_size
+        self._batch_active = torch.tensor([it is None for it in self.batch_stopped_iter],
+                                          device=self.synthesized_signal.device)
+        if batch_size > 1:
+            self._batch_frozen_signal = self.synthesized_signal.detach().clone()
+
+    def _stop_batch_element(self, idx, i, signal=None):
+        """stop updating one element of the batch
+
+        Parameters
+        ----------
+        idx : int
+            The index of the batch element to stop
+        i : int
+            the current iteration (0-indexed)
+        signal : torch.Tensor or None, optional
+            If not None, the value to fix this element at (e.g., the
+            last saved value, if we hit a NaN). Otherwise, we use its
+            current value.
+
+        """
+        if signal is not None:
+            self.synthesized_signal.data[idx] = signal.to(self.synthesized_signal.device)
+        self._batch_frozen_signal[idx] = self.synthesized_signal.data[idx]
+        self._batch_active[idx] = False
+        self.batch_stopped_iter[idx] = i
+
+    def _restore_stopped_batch_elements(self):
+        """reset the stopped batch elements to their frozen values
+
+        The optimizer updates the whole batch (momentum, for example,
+        will keep moving an element even if its gradient is zero), so
+        after each step we undo any change to the elements that have
+        already stopped.
+
+        """
+        if self._batch_active is not None and not self._batch_active.all():
+            stopped = ~self._batch_active
+            self.synthesized_signal.data[stopped] = self._batch_frozen_signal[stopped]
+
+    def _init_profiler(self, profile=False):
+        """initialize the profiler
+
+        If ``profile`` is True, we create a ``PhaseProfiler`` (stored at
+        ``self.profiler``), which records the time and peak memory of
+        each phase of each iteration: the model forward pass, the loss,
+        the backward pass, the optimizer step, clamping, storing, and
+        saving. We also give it to the model (as ``model._profiler``),
+        so that models which support it can record their own phases
+        (e.g., the steerable pyramid and the pooling in
+        ``PooledV1``). See ``PhaseProfiler.summary()`` and
+        ``PhaseProfiler.iteration_summary()`` for how to get at the
+        results.
+
+        Parameters
+        ----------
+        profile : bool, optional
+            Whether to profile synthesis or not.
+
+        """
+        if profile:
+            self.profiler = PhaseProfiler(self.base_signal.device)
+        else:
+            self.profiler = None
+        if isinstance(self.model, torch.nn.Module):
+            self.model._profiler = self.profiler
+
+    def _finish_profiler(self):
+        """remove the profiler from the model, so it doesn't get saved with it"""
+        if isinstance(self.model, torch.nn.Module):
+            self.model._profiler = None
+
+    def _init_lean_model(self):
+        """tell the model not to store intermediates during synthesis
+
+        Models that support it (those with a ``store_intermediates``
+        attribute) keep copies of their intermediate results around for
+        later examination, which we don't need during synthesis. We turn
+        that off here, and ``_finish_lean_model`` restores the original
+        value.
+        """
+        self._model_store_intermediates = getattr(self.model, 'store_intermediates', None)
+        if self._model_store_intermediates is not None:
+            self.model.store_intermediates = False
+
+    def _finish_lean_model(self):
+        """restore the model's store_intermediates attribute"""
+        if getattr(self, '_model_store_intermediates', None) is not None:
+            self.model.store_intermediates = self._model_store_intermediates
 
     def _init_ctf_and_randomizer(self, loss_thresh=1e-4, fraction_removed=0, coarse_to_fine=False,
                                  loss_change_fraction=1, loss_change_thresh=1e-2,
-                                 loss_change_iter=50):
+                                 loss_change_iter=50, window_fraction=1):
         """initialize stuff related to randomization and coarse-to-fine
 
         Parameters
@@ -204,10 +470,45 @@ class Synthesis(metaclass=abc.ABCMeta):
             should only calculate the gradient with respect to the
             ``loss_change_fraction`` fraction of statistics with
             the highest error.
+        window_fraction : float, optional
+            The fraction of the model's pooling windows to use on each
+            iteration. Unlike ``fraction_removed``, the model only pools
+            with the selected windows (see the model's
+            ``set_window_subset``), so each iteration is cheaper. A new
+            random subset is drawn (on the same device as the signal)
+            every iteration, and every time the loss stops decreasing
+            (based on ``loss_change_iter`` and
+            ``loss_change_thresh``), we double the fraction, until we're
+            using all the windows. If we're resuming synthesis, we
+            continue with the fraction we'd reached.
 
         """
+        if window_fraction <= 0 or window_fraction > 1:
+            raise Exception(f"window_fraction must lie in (0, 1], but got {window_fraction}!")
+        if window_fraction < 1:
+            if not hasattr(self.model, 'set_window_subset'):
+                raise Exception("Can only use window_fraction with models that pool with "
+                                "windows (that is, that have a set_window_subset method)!")
+            if fraction_removed > 0 or loss_change_fraction < 1:
+                raise Exception("Can't use window_fraction with fraction_removed or "
+                                "loss_change_fraction!")
+        # older objects won't have recorded this, so we assume they used
+        # all the windows
+        self.window_fraction += [1] * (len(self.loss) - len(self.window_fraction))
+        if self.window_fraction and window_fraction < 1:
+            # then we're resuming, and continue from where we were
+            window_fraction = self.window_fraction[-1]
+        self._window_fraction = window_fraction
+        self._window_fraction_start = len(self.window_fraction)
+        while (self._window_fraction_start > 0 and
+               self.window_fraction[self._window_fraction_start-1] == window_fraction):
+            self._window_fraction_start -= 1
+        self._window_subset = None
         if fraction_removed > 0 or loss_change_fraction < 1:
             self._use_subset_for_gradient = True
+            if self.synthesized_signal.shape[0] > 1:
+                raise Exception("Can't use fraction_removed or loss_change_fraction when "
+                                "synthesizing multiple signals at once!")
             if isinstance(self.model, Identity):
                 raise Exception("Can't use fraction_removed or loss_change_fraction with metrics!"
                                 " Since most of the metrics rely on the image being correctly "
@@ -237,7 +538,8 @@ class Synthesis(metaclass=abc.ABCMeta):
             raise Exception("loss_thresh must be strictly less than loss_change_thresh, or things"
                             " get weird!")
 
-    def _init_store_progress(self, store_progress, save_progress, save_path):
+    def _init_store_progress(self, store_progress, save_progress, save_path, history_dir=None,
+                             save_progress_async=False):
         """initialize store_progress-related attributes
 
         sets the ``self.save_progress``, ``self.store_progress``, and
@@ -275,6 +577,17 @@ class Synthesis(metaclass=abc.ABCMeta):
         save_path : str, optional
             The path to save the synthesis-in-progress to (ignored if
             ``save_progress`` is False)
+        history_dir : str or None, optional
+            If not None, when saving progress, we write the ``saved_*``
+            attributes to an append-only ``HistoryStore`` in this
+            directory (writing each stored iteration only once), and
+            the file at ``save_path`` only contains a reference to it.
+            This keeps the cost of each save proportional to the amount
+            of new data, rather than the length of the history.
+        save_progress_async : bool, optional
+            If True, saving progress happens in a background thread (see
+            ``CheckpointWriter``), so synthesis doesn't have to wait for
+            the file to be written.
 
         """
         # python's implicit boolean-ness means we can do this! it will evaluate to False for False
@@ -294,8 +607,13 @@ class Synthesis(metaclass=abc.ABCMeta):
             self.saved_representation = list(self.saved_representation)
             self.saved_signal_gradient = list(self.saved_signal_gradient)
             self.saved_representation_gradient = list(self.saved_representation_gradient)
-            self.saved_signal.append(self.synthesized_signal.clone().to('cpu'))
-            self.saved_representation.append(self.analyze(self.synthesized_signal).to('cpu'))
+            # if we're resuming, the initial signal was already stored
+            # during the previous synthesis
+            if not self.loss:
+                self.saved_signal.append(self.synthesized_signal.detach().clone().to('cpu'))
+                # this was computed in _init_synthesized_signal, using all
+                # scales, so we don't need to run the model again
+                self.saved_representation.append(self.synthesized_representation.detach().clone().to('cpu'))
         else:
             if save_progress:
                 raise Exception("Can't save progress if we're not storing it! If save_progress is"
@@ -313,6 +631,31 @@ class Synthesis(metaclass=abc.ABCMeta):
         self.store_progress = store_progress
         self.save_progress = save_progress
         self.save_path = save_path
+        self._history_dir = history_dir
+        if history_dir is not None and self._history_run_id is None:
+            self._history_run_id = uuid.uuid4().hex
+        if save_progress and save_progress_async:
+            self._checkpoint_writer = CheckpointWriter()
+        else:
+            self._checkpoint_writer = None
+
+    def _save_progress(self):
+        """save the synthesis in progress to ``self.save_path``
+
+        We always save the reduced model and, if ``self._history_dir``
+        is set, write the ``saved_*`` attributes to the history store
+        there. If ``self._checkpoint_writer`` is set, this happens in
+        the background.
+
+        """
+        self.save(self.save_path, True, history_dir=self._history_dir,
+                  checkpoint_writer=self._checkpoint_writer)
+
+    def _finish_saving_progress(self):
+        """wait for any checkpoint still being written in the background"""
+        if getattr(self, '_checkpoint_writer', None) is not None:
+            self._checkpoint_writer.wait()
+            self._checkpoint_writer = None
 
     def _check_nan_loss(self, loss):
         """check if loss is nan and, if so, return True
@@ -329,9 +672,25 @@ class Synthesis(metaclass=abc.ABCMeta):
         Returns
         -------
         is_nan : bool
-            True if loss was nan, False otherwise
+            True if loss was nan, False otherwise. If we're synthesizing
+            multiple signals at once, this is only True once every batch
+            element has stopped.
 
         """
+        if self.synthesized_signal.shape[0] > 1:
+            # then we handle each batch element separately, reverting
+            # and stopping those that hit a NaN (see below for why we
+            # use the -2 index)
+            batch_nan = torch.isnan(self._last_batch_loss) & self._batch_active
+            if batch_nan.any():
+                warnings.warn(f"Loss is NaN for batch elements {batch_nan.nonzero().flatten().tolist()}"
+                              ", stopping them! We revert them to our last saved values (which "
+                              "means this will throw an IndexError if you're not saving anything)!")
+                for idx in batch_nan.nonzero().flatten().tolist():
+                    self._stop_batch_element(idx, len(self.loss)-1, self.saved_signal[-2][idx])
+                    self.synthesized_representation.data[idx] = self.saved_representation[-2][idx].to(
+                        self.synthesized_representation.device)
+            return not self._batch_active.any()
         if np.isnan(loss.item()):
             warnings.warn("Loss is NaN, quitting out! We revert synthesized_signal / synthesized_"
                           "representation to our last saved values (which means this will "
@@ -379,27 +738,31 @@ class Synthesis(metaclass=abc.ABCMeta):
         stored = False
         with torch.no_grad():
             if self.clamper is not None and self.clamp_each_iter:
-                self.synthesized_signal.data = self.clamper.clamp(self.synthesized_signal.data)
+                with profile_phase(self.profiler, 'clamp'):
+                    self.synthesized_signal.data = self.clamper.clamp(self.synthesized_signal.data)
 
             # i is 0-indexed but in order for the math to work out we want to be checking a
             # 1-indexed thing against the modulo (e.g., if max_iter=10 and
             # store_progress=3, then if it's 0-indexed, we'll try to save this four times,
             # at 0, 3, 6, 9; but we just want to save it three times, at 3, 6, 9)
             if self.store_progress and ((i+1) % self.store_progress == 0):
-                # want these to always be on cpu, to reduce memory use for GPUs
-                self.saved_signal.append(self.synthesized_signal.clone().to('cpu'))
-                # we do this instead of using
-                # self.synthesized_representation because its size might
-                # change over time (if we're doing coarse-to-fine), and
-                # we want to be able to stack this
-                self.saved_representation.append(self.analyze(self.synthesized_signal).to('cpu'))
-                self.saved_signal_gradient.append(self.synthesized_signal.grad.clone().to('cpu'))
-                self.saved_representation_gradient.append(self.synthesized_representation.grad.clone().to('cpu'))
+                with profile_phase(self.profiler, 'store'):
+                    # want these to always be on cpu, to reduce memory use for GPUs
+                    self.saved_signal.append(self.synthesized_signal.clone().to('cpu'))
+                    # we do this instead of using
+                    # self.synthesized_representation because its size might
+                    # change over time (if we're doing coarse-to-fine), and
+                    # we want to be able to stack this
+                    self.saved_representation.append(self.analyze(self.synthesized_signal).to('cpu'))
+                    self.saved_signal_gradient.append(self.synthesized_signal.grad.clone().to('cpu'))
+                    self.saved_representation_gradient.append(self.synthesized_representation.grad.clone().to('cpu'))
                 if self.save_progress is True:
-                    self.save(self.save_path, True)
+                    with profile_phase(self.profiler, 'checkpoint'):
+                        self._save_progress()
                 stored = True
             if type(self.save_progress) == int and ((i+1) % self.save_progress == 0):
-                self.save(self.save_path, True)
+                with profile_phase(self.profiler, 'checkpoint'):
+                    self._save_progress()
         return stored
 
     def _check_for_stabilization(self, i):
@@ -439,7 +802,31 @@ class Synthesis(metaclass=abc.ABCMeta):
         i : int
             the current iteration (0-indexed)
 
+        Returns
+        -------
+        stabilized : bool
+            Whether the loss has stabilized. If we're synthesizing
+            multiple signals at once, we check each batch element
+            separately (using ``self.batch_loss``), stop those that have
+            stabilized, and only return True once they all have.
+
         """
+        if (self._window_fraction < 1 or
+                len(self.loss) - self._window_fraction_start <= self.loss_change_iter):
+            # the loss is only an estimate until we use all the windows,
+            # so we don't stop until we've been using all of them for
+            # long enough
+            return False
+        if self.synthesized_signal.shape[0] > 1:
+            if len(self.batch_loss) > self.loss_change_iter:
+                if self.coarse_to_fine and (self.scales[0] != 'all' or
+                                            i - self.scales_timing['all'][0] <= self.loss_change_iter):
+                    return False
+                for idx, (old, new) in enumerate(zip(self.batch_loss[-self.loss_change_iter],
+                                                     self.batch_loss[-1])):
+                    if self._batch_active[idx] and abs(old - new) < self.loss_thresh:
+                        self._stop_batch_element(idx, i)
+            return not self._batch_active.any()
         if len(self.loss) > self.loss_change_iter:
             if abs(self.loss[-self.loss_change_iter] - self.loss[-1]) < self.loss_thresh:
                 if self.coarse_to_fine:
@@ -463,6 +850,13 @@ class Synthesis(metaclass=abc.ABCMeta):
         have to keep them as a list
 
         """
+        if self._window_subset is not None:
+            # synthesized_representation only contains the windows from
+            # the last iteration
+            self._window_subset = None
+            if self.clamper is None:
+                with torch.no_grad():
+                    self.synthesized_representation = self.analyze(self.synthesized_signal)
         if self.clamper is not None:
             try:
                 # setting the data directly avoids the issue of setting
@@ -498,7 +892,8 @@ class Synthesis(metaclass=abc.ABCMeta):
                    clamp_each_iter=True, store_progress=False,
                    save_progress=False, save_path='synthesis.pt', loss_thresh=1e-4,
                    loss_change_iter=50, fraction_removed=0., loss_change_thresh=1e-2,
-                   loss_change_fraction=1., coarse_to_fine=False, clip_grad_norm=False):
+                   loss_change_fraction=1., coarse_to_fine=False, clip_grad_norm=False,
+                   window_fraction=1., precondition=False):
         r"""synthesize an image
 
         this is a skeleton of how synthesize() works, just to serve as a
@@ -598,6 +993,16 @@ class Synthesis(metaclass=abc.ABCMeta):
             Clip the gradient norm to avoid issues with numerical overflow.
             Gradient norm will be clipped to the specified value (True is
             equivalent to 1).
+        window_fraction : float, optional
+            The fraction of the model's pooling windows to use on each
+            iteration, growing to 1 as the loss stops decreasing (see
+            ``_init_ctf_and_randomizer``). Only for models that pool
+            with windows.
+        precondition : bool or float, optional
+            Whether to rescale the gradient at each pixel by the model's
+            ``gradient_preconditioner`` (and, if a float, the power to
+            raise it to; see ``_init_optimizer``). Only for models that
+            pool with windows.
 
         Returns
         -------
@@ -608,6 +1013,8 @@ class Synthesis(metaclass=abc.ABCMeta):
 
         """
         raise NotImplementedError("Synthesis.synthesize() should not be called!")
+        # if we're resuming, grab the state we need to continue exactly
+        resume_state = self._get_resume_state(optimizer, swa)
         # set the seed
         self._set_seed(seed)
         # initialize synthesized_signal -- how exactly you do this will
@@ -615,15 +1022,18 @@ class Synthesis(metaclass=abc.ABCMeta):
         self._init_synthesized_signal(synthesized_signal_data, clamper, clamp_each_iter)
         # initialize stuff related to coarse-to-fine and randomization
         self._init_ctf_and_randomizer(loss_thresh, fraction_removed, coarse_to_fine,
-                                      loss_change_fraction, loss_change_thresh, loss_change_iter)
+                                      loss_change_fraction, loss_change_thresh, loss_change_iter,
+                                      window_fraction)
         # initialize the optimizer
         self._init_optimizer(optimizer, learning_rate, scheduler, clip_grad_norm,
-                             optimizer_kwargs, swa, swa_kwargs)
+                             optimizer_kwargs, swa, swa_kwargs, precondition)
+        self._restore_resume_state(resume_state, learning_rate)
         # get ready to store progress
         self._init_store_progress(store_progress, save_progress)
 
-        # initialize the progress bar...
-        pbar = tqdm(range(max_iter))
+        # initialize the progress bar (counting iterations across calls,
+        # so we continue on the same schedule if resuming)...
+        pbar = tqdm(range(len(self.loss), len(self.loss) + max_iter))
 
         # and start synthesizing.
         for i in pbar:
@@ -634,6 +1044,7 @@ class Synthesis(metaclass=abc.ABCMeta):
             self.pixel_change.append(pixel_change.item())
             self.gradient.append(g.item())
             self.learning_rate.append(lr)
+            self.window_fraction.append(self._window_fraction)
 
             # check if loss is nan
             if self._check_nan_loss(loss):
@@ -674,6 +1085,87 @@ class Synthesis(metaclass=abc.ABCMeta):
         else:
             return y
 
+    def _get_base_representation(self, **kwargs):
+        r"""Get the representation of base_signal, using the cache if possible
+
+        ``base_signal`` is constant, so its representation only depends
+        on the model and the scales we ask for (which change during
+        coarse-to-fine optimization). We therefore compute it once for
+        each set of ``scales`` and store it in
+        ``self._base_representation_cache``, so that each iteration only
+        has to analyze ``synthesized_signal``.
+
+        The cache is cleared whenever the model changes or when ``to()``
+        is called. The stored tensors are detached, since we never need
+        the gradient with respect to ``base_signal``. We always cache
+        the representation using all of the model's windows, even if
+        it's currently pooling with a subset of them (see
+        ``window_fraction``). This is also the only place (along with
+        ``__init__``) where the model may use its
+        ``representation_cache``.
+
+        Any kwargs are passed through to ``self.analyze``.
+
+        Returns
+        -------
+        base_rep : torch.Tensor
+            The model's representation of ``base_signal``
+
+        """
+        if self._base_representation_cache_model is not self.model:
+            self._clear_base_representation_cache()
+            self._base_representation_cache_model = self.model
+        key = tuple(kwargs.get('scales', []))
+        try:
+            base_rep = self._base_representation_cache[key]
+            self._base_representation_cache_hits += 1
+        except KeyError:
+            # if the model is pooling with a subset of its windows, we
+            # still want to store the full representation
+            window_subset = getattr(self.model, 'window_subset', None)
+            if window_subset is not None:
+                self.model.set_window_subset(None)
+            try:
+                with torch.no_grad(), use_representation_cache():
+                    base_rep = self.analyze(self.base_signal, **kwargs).detach()
+            finally:
+                if window_subset is not None:
+                    self.model.set_window_subset(window_subset)
+            self._base_representation_cache[key] = base_rep
+            self._base_representation_cache_misses += 1
+        return base_rep
+
+    def _get_target_representation(self, **kwargs):
+        r"""Get the representation of base_signal that we're matching this iteration
+
+        This is ``_get_base_representation``, with only the windows in
+        ``self._window_subset`` (the ones used on this iteration, see
+        ``window_fraction``) if it's set.
+
+        Any kwargs are passed through to ``self.analyze``.
+
+        Returns
+        -------
+        base_rep : torch.Tensor
+            The model's representation of ``base_signal``
+
+        """
+        base_rep = self._get_base_representation(**kwargs)
+        if self._window_subset is not None:
+            base_rep = self.model.select_windows(base_rep, self._window_subset)
+        return base_rep
+
+    def _clear_base_representation_cache(self):
+        r"""Empty the cache of base_signal representations
+
+        Call this whenever something happens that would change the
+        representation of ``base_signal`` (e.g., the model or its
+        device / dtype changes).
+
+        """
+        self._base_representation_cache = {}
+        self._base_representation_cache_model = None
+
     def objective_function(self, synth_rep, ref_rep, synth_img, ref_img):
         r"""Calculate the loss
 
@@ -709,6 +1201,38 @@ class Synthesis(metaclass=abc.ABCMeta):
         return self.loss_function(ref_rep=ref_rep, synth_rep=synth_rep, ref_img=ref_img,
                                   synth_img=synth_img)
 
+    def _batch_objective_function(self, synth_rep, ref_rep, synth_img, ref_img):
+        r"""Calculate the loss separately for each batch element
+
+        When synthesizing multiple signals at once, we want each of them
+        to be optimized exactly as they would be on their own, so we
+        compute ``self.objective_function`` for each element of the
+        batch separately (e.g., the L2-norm of the whole batch is not the
+        sum of the L2-norms of each element).
+
+        Parameters
+        ----------
+        synth_rep : torch.Tensor
+            model representation of the synthesized signals
+        ref_rep : torch.Tensor
+            model representation of the reference signal
+        synth_img : torch.Tensor
+            the synthesized signals.
+        ref_img : torch.Tensor
+            the reference signal
+
+        Returns
+        -------
+        batch_loss : torch.Tensor
+            1d tensor containing the loss of each batch element
+
+        """
+        if synth_img.shape[0] == 1:
+            return self.objective_function(synth_rep, ref_rep, synth_img, ref_img).reshape(1)
+        return torch.stack([self.objective_function(synth_rep[i:i+1], ref_rep, synth_img[i:i+1],
+                                                    ref_img)
+                            for i in range(synth_img.shape[0])])
+
     def representation_error(self, iteration=None, **kwargs):
         r"""Get the representation error
 
@@ -748,11 +1272,11 @@ class Synthesis(metaclass=abc.ABCMeta):
             # didn't give us another scale to use
             if 'scales' not in kwargs.keys():
                 kwargs['scales'] = [self.scales[-1]]
-            rep_error = synthesized_rep - self.analyze(self.base_signal, **kwargs)
+            rep_error = synthesized_rep - self._get_base_representation(**kwargs)
         return rep_error
 
     def _init_optimizer(self, optimizer, lr, scheduler=True, clip_grad_norm=False,
-                        optimizer_kwargs={}, swa=False, swa_kwargs={}):
+                        optimizer_kwargs={}, swa=False, swa_kwargs={}, precondition=False):
         """Initialize the optimzer and learning rate scheduler
 
         This gets called at the beginning of synthesize() and can also
@@ -808,6 +1332,20 @@ class Synthesis(metaclass=abc.ABCMeta):
             whether to use stochastic weight averaging or not
         swa_kwargs : dict, optional
             Dictionary of keyword arguments to pass to the SWA object.
+        precondition : bool or float, optional
+            If not False, we multiply the gradient at each pixel by the
+            model's ``gradient_preconditioner`` before each step (and
+            before clipping the gradient norm), so pixels in the
+            periphery, which belong to larger windows and so have
+            smaller gradients, move about as quickly as those near the
+            fovea. If True, we use the preconditioner as is; if a float,
+            we raise it to that power. Either way, it's normalized to
+            have a mean of 1 and capped at 10 (see the model's
+            ``gradient_preconditioner``). We compute it once, here. Only
+            for models that pool with windows (i.e., that have a
+            ``gradient_preconditioner`` method). Note that Adam already
+            rescales each pixel's gradient by its running magnitude, so
+            this mainly matters for SGD.
 
         """
         # there's a weird scoping issue that happens if we don't copy the
@@ -862,6 +1400,21 @@ class Synthesis(metaclass=abc.ABCMeta):
                 self._scheduler = optim.lr_scheduler.ReduceLROnPlateau(self._optimizer, 'min', factor=.5)
             else:
                 self._scheduler = None
+        if precondition is True:
+            precondition = 1
+        if precondition:
+            if not hasattr(self.model, 'gradient_preconditioner'):
+                raise Exception("Can only use precondition with models that pool with windows "
+                                "(that is, that have a gradient_preconditioner method)!")
+            # this only depends on the model, so we don't recompute it when
+            # we re-initialize the optimizer during coarse-to-fine
+            if self._preconditioner is None or self._preconditioner_power != precondition:
+                self._preconditioner = self.model.gradient_preconditioner(precondition).to(
+                    self.synthesized_signal.device, self.synthesized_signal.dtype)
+                self._preconditioner_power = precondition
+        else:
+            self._preconditioner = None
+            self._preconditioner_power = None
         if not hasattr(self, '_init_optimizer_kwargs'):
             # this will only happen the first time _init_optimizer gets
             # called, and ensures that we can always re-initilize the
@@ -872,8 +1425,13 @@ class Synthesis(metaclass=abc.ABCMeta):
             init_optimizer_kwargs = {'optimizer': optimizer, 'lr': initial_lr,
                                      'scheduler': scheduler, 'swa': swa,
                                      'swa_kwargs': swa_kwargs,
-                                     'optimizer_kwargs': optimizer_kwargs}
+                                     'optimizer_kwargs': optimizer_kwargs,
+                                     'precondition': precondition}
             self._init_optimizer_kwargs = init_optimizer_kwargs
+        else:
+            # when resuming, we may turn preconditioning on or off, and
+            # coarse-to-fine re-initialization should respect that
+            self._init_optimizer_kwargs['precondition'] = precondition
         if clip_grad_norm is True:
             self.clip_grad_norm = 1
         else:
@@ -894,11 +1452,15 @@ class Synthesis(metaclass=abc.ABCMeta):
                could schedule the optimization (eg. coarse to fine)
 
         Additionally, this is where:
-        - ``synthesized_representation`` is updated
+        - ``synthesized_representation`` is updated (with only the
+          windows in ``_window_subset``, if we're using
+          ``window_fraction``)
         - ``loss.backward()`` is called
 
         """
         self._optimizer.zero_grad()
+        if self._window_subset is not None:
+            self.model.set_window_subset(self._window_subset)
         analyze_kwargs = {}
         if self.coarse_to_fine:
             # if we've reached 'all', we act the same as if
@@ -909,8 +1471,12 @@ class Synthesis(metaclass=abc.ABCMeta):
                 # scales
                 if self.coarse_to_fine == 'together':
                     analyze_kwargs['scales'] += self.scales_finished
-        self.synthesized_representation = self.analyze(self.synthesized_signal, **analyze_kwargs)
-        base_rep = self.analyze(self.base_signal, **analyze_kwargs)
+        # _optimizer_step needs these to compute the loss to report
+        self._analyze_kwargs = analyze_kwargs
+        with profile_phase(self.profiler, 'forward'):
+            self.synthesized_representation = self.analyze(self.synthesized_signal, **analyze_kwargs)
+        with profile_phase(self.profiler, 'target'):
+            base_rep = self._get_target_representation(**analyze_kwargs)
         if self.store_progress:
             self.synthesized_representation.retain_grad()
 
@@ -933,18 +1499,69 @@ class Synthesis(metaclass=abc.ABCMeta):
             idx_sub = idx_shuffled[:int((1 - self.fraction_removed) * idx_shuffled.numel())]
             synthesized_rep = self.synthesized_representation.flatten()[idx_sub]
             base_rep = base_rep.flatten()[idx_sub]
+            loss = self.objective_function(synthesized_rep, base_rep, self.synthesized_signal,
+                                           self.base_signal)
         else:
-            synthesized_rep = self.synthesized_representation
-
-        loss = self.objective_function(synthesized_rep, base_rep, self.synthesized_signal,
-                                       self.base_signal)
-        loss.backward(retain_graph=True)
+            # each batch element gets its own loss, and we only want the
+            # gradient with respect to those that are still active
+            with profile_phase(self.profiler, 'loss'):
+                loss = self._batch_objective_function(self.synthesized_representation, base_rep,
+                                                      self.synthesized_signal, self.base_signal)
+                loss = loss[self._batch_active].sum()
+        # the target representation is cached and detached, so nothing
+        # outside this call uses the graph: we can let backward free it
+        with profile_phase(self.profiler, 'backward'):
+            loss.backward()
+
+        if self._preconditioner is not None:
+            self.synthesized_signal.grad.mul_(self._preconditioner)
 
         if self.clip_grad_norm:
-            torch.nn.utils.clip_grad_norm_([self.synthesized_signal], self.clip_grad_norm)
+            # this is the same as torch.nn.utils.clip_grad_norm_, but
+            # done separately for each batch element
+            grad = self.synthesized_signal.grad
+            grad_norm = grad.flatten(1).norm(dim=1)
+            clip_coef = (self.clip_grad_norm / (grad_norm + 1e-6)).clamp(max=1)
+            grad.mul_(clip_coef.view(-1, *[1]*(grad.ndim-1)))
 
         return loss
 
+    def _update_window_fraction(self):
+        r"""Double the fraction of windows we use, if the loss has stopped decreasing
+
+        As with coarse-to-fine optimization, we check whether the loss
+        has changed by less than ``self.loss_change_thresh`` over the
+        past ``self.loss_change_iter`` iterations, only considering the
+        iterations since we last changed the fraction.
+
+        """
+        if (len(self.loss) - self._window_fraction_start > self.loss_change_iter and
+                abs(self.loss[-self.loss_change_iter] - self.loss[-1]) < self.loss_change_thresh):
+            self._window_fraction = min(1, 2 * self._window_fraction)
+            self._window_fraction_start = len(self.loss)
+
+    def _sample_window_subset(self):
+        r"""Randomly select the windows to use on this iteration
+
+        We draw ``self._window_fraction`` of the model's windows without
+        replacement, on the same device as ``synthesized_signal``, and
+        sort them (so they're in the same order as in the full
+        representation).
+
+        Returns
+        -------
+        window_subset : torch.Tensor or None
+            1d tensor of ints, the indices of the windows to use, or None
+            if we're using all of them.
+
+        """
+        if self._window_fraction >= 1:
+            return None
+        n_windows = self.model.n_windows
+        n_selected = max(1, int(round(self._window_fraction * n_windows)))
+        window_subset = torch.randperm(n_windows, device=self.synthesized_signal.device)
+        return window_subset[:n_selected].sort()[0]
+
     def _optimizer_step(self, pbar=None, **kwargs):
         r"""Compute and propagate gradients, then step the optimizer to update synthesized_signal
 
@@ -961,7 +1578,9 @@ class Synthesis(metaclass=abc.ABCMeta):
         Returns
         -------
         loss : torch.Tensor
-            1-element tensor containing the loss on this step
+            1-element tensor containing the loss on this step (summed
+            across batch elements, if we're synthesizing more than one
+            signal)
         gradient : torch.Tensor
             1-element tensor containing the gradient on this step
         learning_rate : torch.Tensor
@@ -971,7 +1590,7 @@ class Synthesis(metaclass=abc.ABCMeta):
             synthesized_signal between this step and the last
 
         """
-        self._last_iter_synthesized_signal = self.synthesized_signal.clone()
+        self._last_iter_synthesized_signal = self.synthesized_signal.detach().clone()
         postfix_dict = {}
         if self.coarse_to_fine:
             # the last scale will be 'all', and we never remove
@@ -988,7 +1607,18 @@ class Synthesis(metaclass=abc.ABCMeta):
             # we have some extra info to include in the progress bar if
             # we're doing coarse-to-fine
             postfix_dict['current_scale'] = self.scales[0]
-        loss = self._optimizer.step(self._closure)
+        if self._window_fraction < 1:
+            self._update_window_fraction()
+            postfix_dict['window_fraction'] = self._window_fraction
+        self._window_subset = self._sample_window_subset()
+        with profile_phase(self.profiler, 'optimizer_step'):
+            try:
+                loss = self._optimizer.step(self._closure)
+            finally:
+                # _closure pools with the subset, but nothing else should
+                if self._window_subset is not None:
+                    self.model.set_window_subset(None)
+        self._restore_stopped_batch_elements()
         # we have this here because we want to do the above checking at
         # the beginning of each step, before computing the loss
         # (otherwise there's an error thrown because self.scales[-1] is
@@ -1002,22 +1632,33 @@ class Synthesis(metaclass=abc.ABCMeta):
         if self._scheduler is not None:
             self._scheduler.step(loss.item())
 
-        if self.coarse_to_fine and self.scales[0] != 'all':
-            with torch.no_grad():
-                tmp_im = self.synthesized_signal.detach().clone()
-                full_synthesized_rep = self.analyze(tmp_im)
-                loss = self.objective_function(full_synthesized_rep, self.base_representation,
-                                               self.synthesized_signal, self.base_signal)
-        else:
-            loss = self.objective_function(self.synthesized_representation, self.base_representation,
-                                           self.synthesized_signal, self.base_signal)
+        # we report the loss using the representation computed in
+        # _closure (so, if we're doing coarse-to-fine, this is the loss
+        # with respect to the current target scales, not all of them),
+        # instead of running the model again. the representation with
+        # respect to all scales is only computed when we store progress
+        # (see _clamp_and_store)
+        with torch.no_grad():
+            batch_loss = self._batch_objective_function(
+                self.synthesized_representation.detach(),
+                self._get_target_representation(**self._analyze_kwargs),
+                self._last_iter_synthesized_signal, self.base_signal)
+        self._last_batch_loss = batch_loss.detach()
+        if batch_loss.numel() > 1:
+            # the total loss ignores any batch element that has hit a
+            # NaN (which will be stopped in _check_nan_loss)
+            batch_loss = batch_loss[~torch.isnan(batch_loss)]
+        loss = batch_loss.sum()
 
         pixel_change = torch.max(torch.abs(self.synthesized_signal - self._last_iter_synthesized_signal))
         # for display purposes, always want loss to be positive
         postfix_dict.update(dict(loss="%.4e" % abs(loss.item()),
                                  gradient_norm="%.4e" % g.norm().item(),
                                  learning_rate=self._optimizer.param_groups[0]['lr'],
-                                 pixel_change=f"{pixel_change:.04e}", **kwargs))
+                                 pixel_change=f"{pixel_change:.04e}",
+                                 target_cache=(f"{self._base_representation_cache_hits}/"
+                                               f"{self._base_representation_cache_misses}"),
+                                 **kwargs))
         # add extra info here if you want it to show up in progress bar
         if pbar is not None:
             pbar.set_postfix(**postfix_dict)
@@ -1025,7 +1666,7 @@ class Synthesis(metaclass=abc.ABCMeta):
 
     @abc.abstractmethod
     def save(self, file_path, save_model_reduced=False, attrs=['model'],
-             model_attr_names=['model']):
+             model_attr_names=['model'], history_dir=None, checkpoint_writer=None):
         r"""save all relevant variables in .pt file
 
         This is an abstractmethod only because you need to specify which
@@ -1054,9 +1695,40 @@ class Synthesis(metaclass=abc.ABCMeta):
             The attribute that gives the model(s) names. Must be a list
             of strs. These are the attributes we try to save in reduced
             form if ``save_model_reduced`` is True.
+        history_dir : str or None, optional
+            If not None, we write the ``saved_*`` attributes found in
+            ``attrs`` to the append-only ``HistoryStore`` in this
+            directory instead of ``file_path`` (only the values that
+            aren't there already), and ``file_path`` just records where
+            to find them. ``load`` will then read them lazily.
+        checkpoint_writer : CheckpointWriter or None, optional
+            If not None, we take a snapshot of everything we're saving
+            and hand it to this writer, which writes it in a background
+            thread, so this returns (almost) immediately. If None, we
+            write before returning.
 
         """
+        # we remove attributes from this as we handle them, so don't
+        # modify the caller's list (or the default)
+        attrs = list(attrs)
         save_dict = {}
+        history = {}
+        if history_dir is not None:
+            if self._history_run_id is None:
+                self._history_run_id = uuid.uuid4().hex
+            for k in [a for a in attrs if a.startswith('saved_')]:
+                # the individual saved values never change once
+                # they've been stored, so a shallow copy is enough
+                history[k] = getattr(self, k)
+                if isinstance(history[k], list):
+                    history[k] = list(history[k])
+                attrs.remove(k)
+            # we store the path relative to the file, so the two can be
+            # moved together
+            save_dict['history'] = {'directory': op.relpath(op.abspath(history_dir),
+                                                            op.dirname(op.abspath(file_path))),
+                                    'run_id': self._history_run_id,
+                                    'lengths': dict((k, len(v)) for k, v in history.items())}
         for name in model_attr_names:
             if name in attrs:
                 model = getattr(self, name)
@@ -1074,8 +1746,62 @@ class Synthesis(metaclass=abc.ABCMeta):
             # tensors having extra hooks or the like
             if isinstance(attr, torch.Tensor):
                 attr = attr.detach()
+            elif isinstance(attr, LazyHistory):
+                attr = attr[:]
             save_dict[k] = attr
-        torch.save(save_dict, file_path, pickle_module=dill)
+        # so we can resume exactly where we left off
+        if self._optimizer is not None:
+            save_dict['_optimizer_state_dict'] = self._optimizer.state_dict()
+            save_dict['_init_optimizer_kwargs'] = self._init_optimizer_kwargs
+            save_dict['_swa_swapped'] = self._swa_swapped
+            if self._scheduler is not None:
+                save_dict['_scheduler_state_dict'] = self._scheduler.state_dict()
+        save_dict['_rng_state'] = self._get_rng_state()
+        if checkpoint_writer is None:
+            self._write_save_dict(save_dict, file_path, history_dir, history,
+                                  self._history_run_id)
+        else:
+            # copy everything the optimization loop might change, so we
+            # can keep going while the writer thread writes it out. the
+            # individual saved_* values are never modified once stored,
+            # so those lists only need a shallow copy
+            save_dict = dict((k, list(v) if k.startswith('saved_') and isinstance(v, list)
+                              else v if k.startswith('saved_') else snapshot(v))
+                             for k, v in save_dict.items())
+            checkpoint_writer.submit(self._write_save_dict, save_dict, file_path,
+                                     history_dir, history, self._history_run_id)
+
+    @staticmethod
+    def _write_save_dict(save_dict, file_path, history_dir=None, history={}, history_run_id=None):
+        r"""write the output of ``save`` to disk
+
+        This is separate from ``save`` so that it can run in a
+        background thread (see ``CheckpointWriter``), and so it
+        shouldn't touch the synthesis object itself.
+
+        Parameters
+        ----------
+        save_dict : dict
+            The dictionary to save at ``file_path``
+        file_path : str
+            The path to save ``save_dict`` to. We write it atomically,
+            so that an earlier version is never replaced by a partial one.
+        history_dir : str or None, optional
+            If not None, the directory of the history store to write
+            ``history`` to.
+        history : dict, optional
+            Dictionary of the ``saved_*`` attributes to sync with the
+            history store.
+        history_run_id : str or None, optional
+            The identifier of this synthesis run in the history store.
+
+        """
+        if history_dir is not None:
+            store = HistoryStore(history_dir, history_run_id)
+            for k, v in history.items():
+                store.sync(k, v)
+            store.write_index()
+        atomic_save(save_dict, file_path)
 
     @classmethod
     @abc.abstractmethod
@@ -1162,6 +1888,7 @@ class Synthesis(metaclass=abc.ABCMeta):
 
         """
         tmp_dict = torch.load(file_path, map_location=map_location, pickle_module=dill)
+        history = tmp_dict.pop('history', None)
         device = torch.device(map_location)
         if not isinstance(model_attr_name, list):
             model_attr_name = [model_attr_name]
@@ -1187,6 +1914,14 @@ class Synthesis(metaclass=abc.ABCMeta):
                     loss_function_kwargs=loss_function_kwargs, **models)
         for k, v in tmp_dict.items():
             setattr(synth, k, v)
+        if history is not None:
+            # then the saved_* attributes live in a HistoryStore, which
+            # we read lazily
+            directory = op.join(op.dirname(op.abspath(file_path)), history['directory'])
+            store = HistoryStore(directory)
+            for k, n in history['lengths'].items():
+                setattr(synth, k, store.load(k, n))
+            synth._history_run_id = history['run_id']
         return synth
 
     @abc.abstractmethod
@@ -1239,6 +1974,10 @@ class Synthesis(metaclass=abc.ABCMeta):
             self.model = self.model.to(*args, **kwargs)
         except AttributeError:
             warnings.warn("model has no `to` method, so we leave it as is...")
+        # the cached base representations live on the old device / dtype
+        self._clear_base_representation_cache()
+        if getattr(self, '_preconditioner', None) is not None:
+            self._preconditioner = self._preconditioner.to(*args, **kwargs)
         for k in attrs:
             if hasattr(self, k):
                 attr = getattr(self, k)
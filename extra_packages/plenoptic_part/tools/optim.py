@@ -307,6 +307,62 @@ def generate_norm_stats(model, input_dir, save_path=None, img_shape=None, as_gra
     return stats
 
 
+def _mean_std(stats):
+    """get the (mean, std) pair from stats
+
+    stats is either the per-image statistics tensor, as returned by
+    ``generate_norm_stats`` (in which case we reduce over the first
+    dimension), or the already-reduced (mean, std) tuple, as returned by
+    ``reduce_norm_stats``
+    """
+    if isinstance(stats, (tuple, list)):
+        return stats
+    return stats.mean(0), stats.std(0)
+
+
+def reduce_norm_stats(stats_dict):
+    r"""reduce the statistics in stats_dict to their mean and standard deviation
+
+    ``zscore_stats`` only needs the mean and standard deviation (across
+    images) of each statistic, but ``generate_norm_stats`` returns the
+    statistic for each image. Calling this once (e.g., when
+    initializing a model) means we don't have to reduce over all images
+    every time we normalize, and the result is much smaller to save.
+
+    This is idempotent: values that have already been reduced are
+    returned unchanged.
+
+    Parameters
+    ----------
+    stats_dict : dict
+        A dictionary containing the statistics to use for normalization
+        (as returned/saved by the ``generate_norm_stats`` function, or
+        by this one).
+
+    Returns
+    -------
+    reduced_dict : dict
+        Dictionary with the same structure as ``stats_dict``, where each
+        tensor of statistics has been replaced by a ``(mean, std)``
+        tuple of tensors.
+
+    """
+    reduced_dict = {}
+    for k, v in stats_dict.items():
+        if isinstance(v, dict):
+            reduced_dict[k] = dict((l, tuple(_mean_std(w))) for l, w in v.items())
+        else:
+            reduced_dict[k] = tuple(_mean_std(v))
+    return reduced_dict
+
+
+def _zscore(val, mean, std):
+    """zscore val, in place if autograd allows it"""
+    if val.is_leaf and val.requires_grad:
+        return (val - mean) / std
+    return val.sub_(mean).div_(std)
+
+
 def zscore_stats(stats_dict, model=None, **to_normalize):
     r"""zscore the model's statistics based on stats_dict
 
@@ -336,11 +392,19 @@ def zscore_stats(stats_dict, model=None, **to_normalize):
     ``model.forward()`` call based on *your* knowledge of the contents
     of ``stats_dict``
 
+    ``stats_dict`` can contain either the per-image statistics or their
+    already-reduced ``(mean, std)`` pairs (see ``reduce_norm_stats``);
+    if it's called repeatedly, the latter is much faster. In the first
+    case, the model's attributes are normalized in place (unless they're
+    leaf tensors that require a gradient, like ``nn.Parameters``, which
+    autograd won't let us modify).
+
     Parameters
     ----------
     stats : dict
         A dictionary containing the statistics to use for normalization
-        (as returned/saved by the ``generate_norm_stats`` function).
+        (as returned/saved by the ``generate_norm_stats`` or
+        ``reduce_norm_stats`` functions).
     model : torch.nn.Module or None, optional
         The model we want to normalize statistics for. If None,
         to_normalize keywords must be set and vice versa
@@ -358,9 +422,16 @@ def zscore_stats(stats_dict, model=None, **to_normalize):
             raise Exception("keywords were passed to normalize, so model must be None!")
         normalized = {}
         for k, v in to_normalize.items():
-            mean_stats = stats_dict[k].mean(0)
-            std_stats = stats_dict[k].std(0)
-            normalized[k] = (v - mean_stats) / std_stats
+            if isinstance(stats_dict[k], dict):
+                normalized[k] = {}
+                for l, w in v.items():
+                    if l in stats_dict[k]:
+                        mean_stats, std_stats = _mean_std(stats_dict[k][l])
+                        w = (w - mean_stats) / std_stats
+                    normalized[k][l] = w
+            else:
+                mean_stats, std_stats = _mean_std(stats_dict[k])
+                normalized[k] = (v - mean_stats) / std_stats
         return normalized
     for k, v in stats_dict.items():
         if k not in model.to_normalize:
@@ -369,10 +440,9 @@ def zscore_stats(stats_dict, model=None, **to_normalize):
         if isinstance(v, dict):
             attr = getattr(model, k)
             for l, w in v.items():
-                mean_w = w.mean(0)
-                std_w = w.std(0)
+                mean_w, std_w = _mean_std(w)
                 if l in attr.keys():
-                    val = (attr[l] - mean_w) / std_w
+                    val = _zscore(attr[l], mean_w, std_w)
                     if isinstance(attr[l], torch.nn.Parameter):
                         val = torch.nn.Parameter(val)
                     attr[l] = val
@@ -380,9 +450,8 @@ def zscore_stats(stats_dict, model=None, **to_normalize):
                     warnings.warn("stats_dict key %s not found in model.%s, skipping!" % (l, k))
             setattr(model, k, attr)
         else:
-            mean_v = v.mean(0)
-            std_v = v.std(0)
-            val = (getattr(model, k) - mean_v) / std_v
+            mean_v, std_v = _mean_std(v)
+            val = _zscore(getattr(model, k), mean_v, std_v)
             if isinstance(getattr(model, k), torch.nn.Parameter):
                 val = torch.nn.Parameter(val)
             setattr(model, k, val)
@@ -0,0 +1,166 @@
+"""timing and memory instrumentation for synthesis
+"""
+import time
+import resource
+import contextlib
+import numpy as np
+import torch
+
+
+def profile_phase(profiler, name):
+    r"""Context manager to time a phase, if we have a profiler
+
+    This is a small helper so that instrumented code can just do ``with
+    profile_phase(self._profiler, 'pooling'):``, whether or not
+    profiling is on.
+
+    Parameters
+    ----------
+    profiler : PhaseProfiler or None
+        The profiler to record with. If None, this does nothing.
+    name : str
+        The name of the phase
+
+    Returns
+    -------
+    context : contextmanager
+
+    """
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.phase(name)
+
+
+class PhaseProfiler(object):
+    r"""Record per-phase wall time and peak memory use over iterations
+
+    Wrap each phase of an iteration in ``with profiler.phase(name):``
+    and call ``profiler.step(iteration)`` at the end of each iteration.
+    Phases can be nested (e.g., the model forward within the closure),
+    and a phase that runs several times in one iteration (e.g., the
+    closure when using LBFGS) has its times summed.
+
+    For each phase, we record the wall time in seconds and the peak
+    memory in bytes. If ``device`` is a cuda device, the memory is the
+    peak memory allocated by tensors on that device during the phase
+    (and we synchronize the device at the beginning and end of each
+    phase, so that the timing is accurate). Otherwise, it's the peak
+    resident set size of the process up until the end of the phase
+    (which can only increase).
+
+    Per-iteration records are stored as arrays (one row per iteration,
+    one column per phase), which keeps this cheap enough to run on
+    every iteration.
+
+    Parameters
+    ----------
+    device : torch.device, str, or None, optional
+        The device synthesis is running on.
+
+    """
+
+    def __init__(self, device=None):
+        if device is not None:
+            device = torch.device(device)
+        self._cuda = device is not None and device.type == 'cuda'
+        self.device = device
+        self.phases = []
+        self.iterations = []
+        self._times = []
+        self._memory = []
+        self._current_times = {}
+        self._current_memory = {}
+        self._stack = []
+
+    def _peak_memory(self):
+        if self._cuda:
+            return torch.cuda.max_memory_allocated(self.device)
+        # ru_maxrss is in kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """time the code run within this context as phase name"""
+        if name not in self.phases:
+            self.phases.append(name)
+        if self._cuda:
+            torch.cuda.synchronize(self.device)
+            torch.cuda.reset_peak_memory_stats(self.device)
+        # the peak memory of any nested phases gets added to this
+        self._stack.append(0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self._cuda:
+                torch.cuda.synchronize(self.device)
+            elapsed = time.perf_counter() - start
+            peak = max(self._peak_memory(), self._stack.pop())
+            if self._stack:
+                self._stack[-1] = max(self._stack[-1], peak)
+            self._current_times[name] = self._current_times.get(name, 0) + elapsed
+            self._current_memory[name] = max(self._current_memory.get(name, 0), peak)
+
+    def step(self, iteration):
+        """finish recording iteration"""
+        self.iterations.append(iteration)
+        self._times.append([self._current_times.get(p, np.nan) for p in self.phases])
+        self._memory.append([self._current_memory.get(p, np.nan) for p in self.phases])
+        self._current_times = {}
+        self._current_memory = {}
+
+    def _as_arrays(self):
+        """per-iteration times and memory, as 2d arrays of the same shape"""
+        n = len(self.phases)
+        times = np.array([t + [np.nan] * (n - len(t)) for t in self._times]).reshape(-1, n)
+        memory = np.array([m + [np.nan] * (n - len(m)) for m in self._memory]).reshape(-1, n)
+        return times, memory
+
+    def iteration_summary(self, iteration):
+        r"""Get the times and memory recorded for a single iteration
+
+        Parameters
+        ----------
+        iteration : int
+            The iteration to get
+
+        Returns
+        -------
+        summary : dict
+            Dictionary with keys ``time_{phase}`` (in seconds) and
+            ``peak_memory_{phase}`` (in bytes) for each phase. Empty if
+            we didn't record that iteration.
+
+        """
+        try:
+            idx = self.iterations.index(iteration)
+        except ValueError:
+            return {}
+        times, memory = self._as_arrays()
+        summary = {}
+        for i, p in enumerate(self.phases):
+            summary[f'time_{p}'] = times[idx, i]
+            summary[f'peak_memory_{p}'] = memory[idx, i]
+        return summary
+
+    def summary(self):
+        r"""Summarize the times and memory across all recorded iterations
+
+        Returns
+        -------
+        summary : dict
+            Dictionary with keys ``time_{phase}_total`` and
+            ``time_{phase}_mean`` (in seconds), and
+            ``peak_memory_{phase}`` (in bytes, the max across
+            iterations) for each phase.
+
+        """
+        if not self._times:
+            return {}
+        times, memory = self._as_arrays()
+        summary = {}
+        for i, p in enumerate(self.phases):
+            summary[f'time_{p}_total'] = np.nansum(times[:, i])
+            summary[f'time_{p}_mean'] = np.nanmean(times[:, i])
+            summary[f'peak_memory_{p}'] = np.nanmax(memory[:, i])
+        return summary
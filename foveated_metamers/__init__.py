@@ -15,3 +15,4 @@ from . import other_data
 from . import compose_figures
 from . import create_mad_images
 from . import create_other_synth
+from . import benchmark
@@ -0,0 +1,952 @@
+#!/usr/bin/env python3
+"""benchmark the speed and memory use of metamer synthesis
+
+This is meant for checking whether changes to the models or the
+synthesis loop actually help: run it with the same arguments before and
+after the change (e.g., on two different git revisions) and compare the
+resulting csvs.
+"""
+import argparse
+import glob
+import multiprocessing
+import re
+import resource
+import time
+import torch
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import os.path as op
+from . import create_metamers
+import sys
+sys.path.append(op.join(op.dirname(op.realpath(__file__)), '..', 'extra_packages'))
+import plenoptic_part as pop
+from plenoptic_part.simulate.pooling_backends import windows_nbytes
+
+
+def _peak_memory(device):
+    """peak memory used on device (in bytes) since the last reset"""
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device)
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _time_forward_backward(model, image, n_iter):
+    """average time (in seconds) and peak memory of n_iter forward and backward passes"""
+    device = image.device
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+    start_time = time.time()
+    for i in range(n_iter):
+        rep = model(image)
+        rep.pow(2).sum().backward()
+        image.grad = None
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return (time.time() - start_time) / n_iter, _peak_memory(device)
+
+
+def _measure_forward_backward(model_name, scaling, image, gpu_id=None, **model_kwargs):
+    """set up the model and measure the time and peak memory of a forward and backward pass"""
+    model, _, _, _ = create_metamers.setup_model(model_name, scaling, image, **model_kwargs)
+    image, model = create_metamers.setup_device(image, model, gpu_id=gpu_id)
+    image = image.clone().requires_grad_()
+    return _time_forward_backward(model, image, 1)
+
+
+def _forward_backward_in_subprocess(*args, **kwargs):
+    """run _measure_forward_backward in a fresh process
+
+    On the CPU, the peak memory we can measure (the max resident set
+    size) only ever grows over the life of a process, so to compare
+    models we need to measure each one separately.
+
+    """
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_measure_forward_backward, *args, **kwargs).result()
+
+
+def benchmark_synthesis(model_name, scaling, image, max_iter=20, store_progress=False,
+                        min_ecc=.5, max_ecc=15, cache_dir=None, normalize_dict=None,
+                        gpu_id=None, seed=0, initial_image_type='white', window_backend='dense',
+                        window_memory_budget=None, gradient_checkpointing=False,
+                        window_dtype=None, **synth_kwargs):
+    r"""Time metamer synthesis and measure its peak memory use
+
+    We set up the model, reference image, and initial image as
+    ``create_metamers.main`` does, then run ``max_iter`` iterations of
+    synthesis (with ``profile=True``, so we also get the time and memory
+    of each phase).
+
+    Parameters
+    ----------
+    model_name : str
+        str specifying which of the ``PooledVentralStream`` models we
+        should initialize. See ``create_metamers.setup_model`` for more
+        details.
+    scaling : float
+        The scaling parameter for the model
+    image : str or array_like
+        Either the path to the file to load in or the loaded-in
+        image. See ``create_metamers.setup_image``.
+    max_iter : int, optional
+        The number of iterations to run. We set ``loss_change_iter`` to
+        this (unless it's in ``synth_kwargs``), so synthesis won't stop
+        early.
+    store_progress : bool or int, optional
+        Passed to ``Metamer.synthesize``. Storing progress is part of
+        the cost of synthesis, so you may want to benchmark with it on.
+    min_ecc, max_ecc : float, optional
+        The minimum and maximum eccentricity of the pooling windows
+    cache_dir : str or None, optional
+        The directory to cache the windows tensors in
+    normalize_dict : str or None, optional
+        If a str, the path to the dictionary containing the statistics
+        to use for normalization.
+    gpu_id : int or None, optional
+        If not None, the GPU we will use. If None, we run on CPU.
+    seed : int, optional
+        The seed for the initial image
+    initial_image_type : str, optional
+        The type of initial image, see
+        ``create_metamers.setup_initial_image``
+    window_backend : {'dense', 'sparse', 'chunked'}, optional
+        How to store the pooling windows, see
+        ``create_metamers.setup_model``
+    window_memory_budget : float or None, optional
+        If ``window_backend='chunked'``, the memory (in GB) to use for
+        each chunk of windows.
+    gradient_checkpointing : bool, optional
+        Whether to use gradient checkpointing (V1 models only), see
+        ``create_metamers.setup_model``
+    window_dtype : {None, 'float32', 'float16', 'bfloat16'}, optional
+        The dtype to store the pooling windows in, see
+        ``create_metamers.setup_model``
+    synth_kwargs :
+        Passed to ``Metamer.synthesize``
+
+    Returns
+    -------
+    results : dict
+        Dictionary with the arguments that define the benchmark,
+        ``num_iterations``, ``total_time`` (in seconds),
+        ``iterations_per_sec``, ``peak_memory`` (in bytes; the max
+        allocated by tensors on the GPU, or the max resident set size of
+        the process on the CPU), and the per-phase times and memory from
+        ``metamer.profiler.summary()``.
+
+    """
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    image_name = image
+    image = create_metamers.setup_image(image)
+    if normalize_dict:
+        normalize_dict = torch.load(normalize_dict)
+    model, _, _, _ = create_metamers.setup_model(model_name, scaling, image, min_ecc, max_ecc,
+                                                 cache_dir, normalize_dict, window_backend,
+                                                 window_memory_budget, gradient_checkpointing,
+                                                 window_dtype=window_dtype)
+    initial_image = create_metamers.setup_initial_image(initial_image_type, model, image)
+    image, initial_image, model = create_metamers.setup_device(image, initial_image, model,
+                                                               gpu_id=gpu_id)
+    device = image.device
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+    synth_kwargs.setdefault('loss_change_iter', max_iter)
+    metamer = pop.Metamer(image, model)
+    start_time = time.time()
+    metamer.synthesize(initial_image=initial_image, max_iter=max_iter, seed=seed,
+                       store_progress=store_progress, profile=True, **synth_kwargs)
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    duration = time.time() - start_time
+    results = {'model': model_name, 'scaling': scaling,
+               'image': op.basename(image_name) if isinstance(image_name, str) else 'array',
+               'img_res': 'x'.join([str(i) for i in image.shape[-2:]]),
+               'device': str(device), 'store_progress': store_progress,
+               'window_backend': window_backend, 'window_memory_budget': window_memory_budget,
+               'gradient_checkpointing': gradient_checkpointing, 'window_dtype': window_dtype,
+               'num_iterations': len(metamer.loss), 'total_time': duration,
+               'iterations_per_sec': len(metamer.loss) / duration,
+               'peak_memory': _peak_memory(device)}
+    results.update(metamer.profiler.summary())
+    return results
+
+
+def compare_window_backends(model_name, scaling, image, n_iter=10, min_ecc=.5, max_ecc=15,
+                            cache_dir=None, normalize_dict=None, gpu_id=None,
+                            backends=['dense', 'sparse', 'chunked'], window_memory_budget=None):
+    r"""Compare the memory, speed, and accuracy of the pooling window backends
+
+    For each backend, we initialize the model and record the memory used
+    by the windows, and the average time of ``n_iter`` forward and
+    backward passes on ``image``. We also check how close the
+    representation and the projection of the representation back into
+    image space are to those of the first backend (which should be
+    'dense').
+
+    Parameters
+    ----------
+    model_name : str
+        str specifying which of the ``PooledVentralStream`` models we
+        should initialize. See ``create_metamers.setup_model`` for more
+        details.
+    scaling : float
+        The scaling parameter for the model
+    image : str or array_like
+        Either the path to the file to load in or the loaded-in
+        image. See ``create_metamers.setup_image``.
+    n_iter : int, optional
+        The number of forward and backward passes to average over
+    min_ecc, max_ecc : float, optional
+        The minimum and maximum eccentricity of the pooling windows
+    cache_dir : str or None, optional
+        The directory to cache the windows tensors in
+    normalize_dict : str or None, optional
+        If a str, the path to the dictionary containing the statistics
+        to use for normalization.
+    gpu_id : int or None, optional
+        If not None, the GPU we will use. If None, we run on CPU.
+    backends : list, optional
+        The backends to compare. The first one is the reference for the
+        accuracy checks.
+    window_memory_budget : float or None, optional
+        The memory budget (in GB) for the 'chunked' backend
+
+    Returns
+    -------
+    results : pd.DataFrame
+        One row per backend, with columns ``windows_nbytes``,
+        ``forward_backward_time`` (in seconds, per iteration),
+        ``peak_memory`` (in bytes), ``max_abs_diff_representation``, and
+        ``max_abs_diff_projection``
+
+    """
+    image_name = image
+    image = create_metamers.setup_image(image)
+    if normalize_dict:
+        normalize_dict = torch.load(normalize_dict)
+    results = []
+    ref_rep, ref_proj = None, None
+    for backend in backends:
+        model, _, _, _ = create_metamers.setup_model(model_name, scaling, image, min_ecc, max_ecc,
+                                                     cache_dir, normalize_dict, backend,
+                                                     window_memory_budget)
+        img, model = create_metamers.setup_device(image, model, gpu_id=gpu_id)
+        img = img.detach().clone().requires_grad_()
+        device = img.device
+        duration, peak_memory = _time_forward_backward(model, img, n_iter)
+        with torch.no_grad():
+            rep = model(img).detach().to('cpu')
+            proj = model.PoolingWindows.project(model.PoolingWindows(img))
+            proj = proj.detach().to('cpu')
+        if ref_rep is None:
+            ref_rep, ref_proj = rep, proj
+        results.append({'model': model_name, 'scaling': scaling, 'window_backend': backend,
+                        'image': (op.basename(image_name) if isinstance(image_name, str)
+                                  else 'array'),
+                        'device': str(device),
+                        'windows_nbytes': windows_nbytes(model.PoolingWindows),
+                        'forward_backward_time': duration,
+                        'peak_memory': peak_memory,
+                        'max_abs_diff_representation': (rep - ref_rep).abs().max().item(),
+                        'max_abs_diff_projection': (proj - ref_proj).abs().max().item()})
+        print(f"{model_name}, scaling {scaling}, {backend} windows: "
+              f"{results[-1]['windows_nbytes'] / 1e9:.03f} GB, "
+              f"{duration:.03f} sec per forward/backward")
+        del model
+    return pd.DataFrame(results)
+
+
+def compare_window_dtypes(model_name, scaling, image, window_dtypes=['float32', 'float16',
+                                                                      'bfloat16'],
+                          max_iter=50, min_ecc=.5, max_ecc=15, cache_dir=None,
+                          normalize_dict=None, gpu_id=None, seed=0, initial_image_type='white',
+                          window_backend='dense', window_memory_budget=None):
+    r"""Compare the accuracy of storing the pooling windows in reduced precision
+
+    For each window dtype, we initialize the model and record the memory
+    used to store the windows, the peak memory of a forward and backward
+    pass (measured in a separate process, which includes the stored
+    windows and any windows cast back to the input's dtype while
+    pooling), and how close the representation of ``image`` is to that
+    of the first dtype (which should be 'float32'). Since small
+    differences in the representation could still add up over the
+    course of synthesis, we also run ``max_iter`` iterations of synthesis
+    from the same initial image and with the same seed, and record the
+    final loss and how far the resulting metamer is from the first
+    dtype's.
+
+    Parameters
+    ----------
+    model_name : str
+        str specifying which of the ``PooledVentralStream`` models we
+        should initialize. See ``create_metamers.setup_model`` for more
+        details.
+    scaling : float
+        The scaling parameter for the model
+    image : str or array_like
+        Either the path to the file to load in or the loaded-in
+        image. See ``create_metamers.setup_image``.
+    window_dtypes : list, optional
+        The window dtypes to compare. The first one is the reference for
+        the accuracy checks.
+    max_iter : int, optional
+        The number of iterations of synthesis to run (we set
+        ``loss_change_iter`` to this, so it won't stop early). If 0, we
+        don't run synthesis.
+    min_ecc, max_ecc : float, optional
+        The minimum and maximum eccentricity of the pooling windows
+    cache_dir : str or None, optional
+        The directory to cache the windows tensors in
+    normalize_dict : str or None, optional
+        If a str, the path to the dictionary containing the statistics
+        to use for normalization.
+    gpu_id : int or None, optional
+        If not None, the GPU we will use. If None, we run on CPU.
+    seed : int, optional
+        The seed for the initial image and synthesis
+    initial_image_type : str, optional
+        The type of initial image, see
+        ``create_metamers.setup_initial_image``
+    window_backend : {'dense', 'sparse', 'chunked'}, optional
+        How to store the pooling windows, see
+        ``create_metamers.setup_model``
+    window_memory_budget : float or None, optional
+        The memory budget (in GB) for the 'chunked' backend
+
+    Returns
+    -------
+    results : pd.DataFrame
+        One row per window dtype, with columns ``windows_nbytes``,
+        ``peak_memory`` and ``time_forward_backward`` (in bytes and
+        seconds, for a single forward and backward pass; see
+        ``_peak_memory``), ``max_abs_diff_representation``,
+        ``max_rel_diff_representation`` (relative to the largest
+        absolute value of the reference representation),
+        ``final_loss``, ``final_loss_rel_diff`` (relative to the
+        reference's final loss), and ``max_abs_diff_metamer``
+
+    """
+    image_name = image
+    image = create_metamers.setup_image(image)
+    if normalize_dict:
+        normalize_dict = torch.load(normalize_dict)
+    results = []
+    ref_rep, ref_loss, ref_metamer = None, None, None
+    initial_image = None
+    for dtype in window_dtypes:
+        model, _, _, _ = create_metamers.setup_model(model_name, scaling, image, min_ecc, max_ecc,
+                                                     cache_dir, normalize_dict, window_backend,
+                                                     window_memory_budget, window_dtype=dtype)
+        if initial_image is None:
+            torch.manual_seed(seed)
+            np.random.seed(seed)
+            initial_image = create_metamers.setup_initial_image(initial_image_type, model, image)
+        img, init_img, model = create_metamers.setup_device(image, initial_image, model,
+                                                            gpu_id=gpu_id)
+        with torch.no_grad():
+            rep = model(img).detach().to('cpu')
+        fwd_bwd_time, peak_memory = _forward_backward_in_subprocess(
+            model_name, scaling, image, gpu_id, min_ecc=min_ecc, max_ecc=max_ecc,
+            cache_dir=cache_dir, normalize_dict=normalize_dict, window_backend=window_backend,
+            window_memory_budget=window_memory_budget, window_dtype=dtype)
+        loss, metamer_image = np.nan, None
+        if max_iter > 0:
+            metamer = pop.Metamer(img, model)
+            metamer.synthesize(initial_image=init_img.clone(), max_iter=max_iter, seed=seed,
+                               loss_change_iter=max_iter)
+            loss = metamer.loss[-1]
+            metamer_image = metamer.synthesized_signal.detach().to('cpu')
+        if ref_rep is None:
+            ref_rep, ref_loss, ref_metamer = rep, loss, metamer_image
+        diff = (rep - ref_rep).abs().max().item()
+        results.append({'model': model_name, 'scaling': scaling, 'window_dtype': dtype,
+                        'window_backend': window_backend,
+                        'image': (op.basename(image_name) if isinstance(image_name, str)
+                                  else 'array'),
+                        'device': str(img.device),
+                        'windows_nbytes': windows_nbytes(model.PoolingWindows),
+                        'peak_memory': peak_memory, 'time_forward_backward': fwd_bwd_time,
+                        'max_abs_diff_representation': diff,
+                        'max_rel_diff_representation': diff / ref_rep.abs().max().item(),
+                        'final_loss': loss,
+                        'final_loss_rel_diff': (loss - ref_loss) / ref_loss,
+                        'max_abs_diff_metamer': (np.nan if metamer_image is None else
+                                                 (metamer_image - ref_metamer).abs().max().item())})
+        print(f"{model_name}, scaling {scaling}, {dtype} windows: "
+              f"{results[-1]['windows_nbytes'] / 1e9:.03f} GB stored, "
+              f"{peak_memory / 1e9:.03f} GB peak, "
+              f"relative representation difference {results[-1]['max_rel_diff_representation']:.03e}, "
+              f"final loss {loss:.05e}")
+        del model
+    return pd.DataFrame(results)
+
+
+def compare_window_fractions(model_name, scaling, image, window_fractions=[1, .5, .25, .1],
+                             target_loss=None, max_iter=500, eval_every=10, learning_rate=.1,
+                             optimizer='SGD', loss_change_iter=50, loss_change_thresh=1e-2,
+                             min_ecc=.5, max_ecc=15, cache_dir=None, normalize_dict=None,
+                             gpu_id=None, seed=0, initial_image_type='white',
+                             window_backend='dense', window_memory_budget=None):
+    r"""Compare the wall-clock time to reach a target loss with stochastic window subsets
+
+    With ``window_fraction < 1``, each iteration of synthesis only pools
+    with a random subset of the windows, so it's cheaper, but the
+    gradient is noisier (see ``Metamer.synthesize``). For each window
+    fraction, we run synthesis from the same initial image and with the
+    same seed, ``eval_every`` iterations at a time, and after each of
+    those we compute the loss using all the windows (outside of the
+    timed region), stopping once it's at or below ``target_loss`` or
+    after ``max_iter`` iterations.
+
+    Parameters
+    ----------
+    model_name : str
+        str specifying which of the ``PooledVentralStream`` models we
+        should initialize. See ``create_metamers.setup_model`` for more
+        details.
+    scaling : float
+        The scaling parameter for the model
+    image : str or array_like
+        Either the path to the file to load in or the loaded-in
+        image. See ``create_metamers.setup_image``.
+    window_fractions : list, optional
+        The window fractions to compare. The first one should be 1,
+        full-batch synthesis, which is the reference for the speedup.
+    target_loss : float or None, optional
+        The (full) loss to reach. If None, we use the loss the first
+        window fraction reaches after ``max_iter`` iterations.
+    max_iter : int, optional
+        The maximum number of iterations to run for each fraction.
+    eval_every : int, optional
+        How many iterations to run between checks of the full loss.
+    learning_rate : float, optional
+        The learning rate to use
+    optimizer : str, optional
+        The optimizer to use (by default, SGD, the optimizer we compare
+        against).
+    loss_change_iter, loss_change_thresh : int, float, optional
+        Used to determine when to increase the window fraction, see
+        ``Metamer.synthesize``. We never stop synthesis early.
+    min_ecc, max_ecc : float, optional
+        The minimum and maximum eccentricity of the pooling windows
+    cache_dir : str or None, optional
+        The directory to cache the windows tensors in
+    normalize_dict : str or None, optional
+        If a str, the path to the dictionary containing the statistics
+        to use for normalization.
+    gpu_id : int or None, optional
+        If not None, the GPU we will use. If None, we run on CPU.
+    seed : int, optional
+        The seed for the initial image and synthesis
+    initial_image_type : str, optional
+        The type of initial image, see
+        ``create_metamers.setup_initial_image``
+    window_backend : {'dense', 'sparse', 'chunked'}, optional
+        How to store the pooling windows, see
+        ``create_metamers.setup_model``
+    window_memory_budget : float or None, optional
+        The memory budget (in GB) for the 'chunked' backend
+
+    Returns
+    -------
+    results : pd.DataFrame
+        One row per window fraction, with columns ``target_loss``,
+        ``reached_target``, ``iterations_to_target`` and
+        ``time_to_target`` (in seconds; the totals if we didn't reach
+        it), ``final_loss`` (using all windows),
+        ``final_window_fraction``, and ``speedup`` (the first fraction's
+        ``time_to_target`` divided by this one's, NaN if either didn't
+        reach the target).
+
+    """
+    image_name = image
+    image = create_metamers.setup_image(image)
+    if normalize_dict:
+        normalize_dict = torch.load(normalize_dict)
+    model, _, _, _ = create_metamers.setup_model(model_name, scaling, image, min_ecc, max_ecc,
+                                                 cache_dir, normalize_dict, window_backend,
+                                                 window_memory_budget)
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+    initial_image = create_metamers.setup_initial_image(initial_image_type, model, image)
+    image, initial_image, model = create_metamers.setup_device(image, initial_image, model,
+                                                               gpu_id=gpu_id)
+    device = image.device
+    results = []
+    for frac in window_fractions:
+        metamer = pop.Metamer(image, model)
+        duration = 0
+        full_loss = np.nan
+        reached = False
+        # we never stop early, since loss_thresh=0
+        synth_kwargs = {'max_iter': eval_every, 'loss_thresh': 0, 'seed': seed,
+                        'optimizer': optimizer, 'loss_change_iter': loss_change_iter,
+                        'loss_change_thresh': loss_change_thresh, 'window_fraction': frac}
+        while len(metamer.loss) < max_iter:
+            synth_kwargs['max_iter'] = min(eval_every, max_iter - len(metamer.loss))
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+            start_time = time.time()
+            if not metamer.loss:
+                metamer.synthesize(initial_image=initial_image.clone(),
+                                   learning_rate=learning_rate, **synth_kwargs)
+            else:
+                # this resumes exactly where we left off
+                metamer.synthesize(learning_rate=None, **synth_kwargs)
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+            duration += time.time() - start_time
+            with torch.no_grad():
+                full_loss = metamer._batch_objective_function(
+                    model(metamer.synthesized_signal), metamer._get_base_representation(),
+                    metamer.synthesized_signal, image).sum().item()
+            if target_loss is not None and full_loss <= target_loss:
+                reached = True
+                break
+        if target_loss is None:
+            # then this is the reference, which defines the target
+            target_loss = full_loss
+            reached = True
+        results.append({'model': model_name, 'scaling': scaling, 'window_fraction': frac,
+                        'optimizer': optimizer, 'learning_rate': learning_rate,
+                        'window_backend': window_backend,
+                        'image': (op.basename(image_name) if isinstance(image_name, str)
+                                  else 'array'),
+                        'device': str(device), 'target_loss': target_loss,
+                        'reached_target': reached, 'iterations_to_target': len(metamer.loss),
+                        'time_to_target': duration, 'final_loss': full_loss,
+                        'final_window_fraction': metamer.window_fraction[-1]})
+        print(f"{model_name}, scaling {scaling}, window fraction {frac}: "
+              f"{'reached' if reached else 'did not reach'} loss {target_loss:.05e} in "
+              f"{len(metamer.loss)} iterations, {duration:.03f} seconds")
+    results = pd.DataFrame(results)
+    ref = results.iloc[0]
+    results['speedup'] = np.where(results.reached_target & ref.reached_target,
+                                  ref.time_to_target / results.time_to_target, np.nan)
+    return results
+
+
+def compare_gradient_preconditioning(model_name, scaling, images=None,
+                                     preconditions=[False, True], max_iter=1000, learning_rate=.1,
+                                     optimizer='SGD', loss_thresh=1e-4, loss_change_iter=50,
+                                     min_ecc=.5, max_ecc=15, cache_dir=None, normalize_dict=None,
+                                     gpu_id=None, seed=0, initial_image_type='white',
+                                     window_backend='dense', window_memory_budget=None):
+    r"""Compare the number of iterations synthesis takes with and without preconditioning
+
+    With ``precondition``, we rescale the gradient at each pixel by the
+    model's ``gradient_preconditioner``, so the periphery (where the
+    windows are large and so the gradients small) converges about as
+    quickly as the center (see ``Metamer.synthesize``). For each image
+    and value of ``precondition``, we run synthesis from the same
+    initial image and with the same seed until it stops (because the
+    loss has changed by less than ``loss_thresh`` over the last
+    ``loss_change_iter`` iterations) or we hit ``max_iter``. Since
+    stopping earlier at a higher loss isn't an improvement, we also
+    record the first iteration at which each run's loss is at or below
+    the final loss of the first value of ``precondition``.
+
+    Parameters
+    ----------
+    model_name : str
+        str specifying which of the ``PooledVentralStream`` models we
+        should initialize. See ``create_metamers.setup_model`` for more
+        details.
+    scaling : float
+        The scaling parameter for the model
+    images : list or None, optional
+        List of paths to the images to compare on. If None, we use the
+        test images in ``extra_packages/data``.
+    preconditions : list, optional
+        The values of ``precondition`` to compare. The first one should
+        be False, which is the reference.
+    max_iter : int, optional
+        The maximum number of iterations to run
+    learning_rate : float, optional
+        The learning rate to use
+    optimizer : str, optional
+        The optimizer to use. By default, SGD, since Adam already
+        rescales each pixel's gradient.
+    loss_thresh, loss_change_iter : float, int, optional
+        Used to determine when synthesis has finished, see
+        ``Metamer.synthesize``
+    min_ecc, max_ecc : float, optional
+        The minimum and maximum eccentricity of the pooling windows
+    cache_dir : str or None, optional
+        The directory to cache the windows tensors in
+    normalize_dict : str or None, optional
+        If a str, the path to the dictionary containing the statistics
+        to use for normalization.
+    gpu_id : int or None, optional
+        If not None, the GPU we will use. If None, we run on CPU.
+    seed : int, optional
+        The seed for the initial image and synthesis
+    initial_image_type : str, optional
+        The type of initial image, see
+        ``create_metamers.setup_initial_image``
+    window_backend : {'dense', 'sparse', 'chunked'}, optional
+        How to store the pooling windows, see
+        ``create_metamers.setup_model``
+    window_memory_budget : float or None, optional
+        The memory budget (in GB) for the 'chunked' backend
+
+    Returns
+    -------
+    results : pd.DataFrame
+        One row per image and value of ``precondition``, with columns
+        ``num_iterations``, ``total_time`` (in seconds), ``final_loss``,
+        ``stopped_early`` (whether synthesis stopped before
+        ``max_iter``), ``reference_loss`` (the final loss of the first
+        value of ``precondition``), ``iterations_to_reference`` (NaN if
+        it never reached it), and ``iteration_ratio`` (the reference's
+        ``iterations_to_reference`` divided by this one's).
+
+    """
+    if images is None:
+        data_dir = op.join(op.dirname(op.realpath(__file__)), '..', 'extra_packages', 'data')
+        images = sorted(glob.glob(op.join(data_dir, '*.pgm')))
+    if normalize_dict:
+        normalize_dict = torch.load(normalize_dict)
+    results = []
+    for image_name in images:
+        image = create_metamers.setup_image(image_name)
+        model, _, _, _ = create_metamers.setup_model(model_name, scaling, image, min_ecc, max_ecc,
+                                                     cache_dir, normalize_dict, window_backend,
+                                                     window_memory_budget)
+        torch.manual_seed(seed)
+        np.random.seed(seed)
+        initial_image = create_metamers.setup_initial_image(initial_image_type, model, image)
+        image, initial_image, model = create_metamers.setup_device(image, initial_image, model,
+                                                                   gpu_id=gpu_id)
+        device = image.device
+        image_results = []
+        for precondition in preconditions:
+            metamer = pop.Metamer(image, model)
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+            start_time = time.time()
+            metamer.synthesize(initial_image=initial_image.clone(), seed=seed,
+                               max_iter=max_iter, learning_rate=learning_rate,
+                               optimizer=optimizer, loss_thresh=loss_thresh,
+                               loss_change_iter=loss_change_iter, precondition=precondition)
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+            duration = time.time() - start_time
+            loss = np.array(metamer.loss)
+            image_results.append({'model': model_name, 'scaling': scaling,
+                                  'image': op.basename(image_name), 'precondition': precondition,
+                                  'optimizer': optimizer, 'learning_rate': learning_rate,
+                                  'loss_thresh': loss_thresh, 'device': str(device),
+                                  'num_iterations': len(loss), 'total_time': duration,
+                                  'final_loss': loss[-1], 'stopped_early': len(loss) < max_iter,
+                                  'loss': loss})
+        reference_loss = image_results[0]['final_loss']
+        for res in image_results:
+            loss = res.pop('loss')
+            reached = np.where(loss <= reference_loss)[0]
+            res['reference_loss'] = reference_loss
+            res['iterations_to_reference'] = reached[0] + 1 if len(reached) else np.nan
+            print(f"{model_name}, scaling {scaling}, {res['image']}, precondition "
+                  f"{res['precondition']}: {res['num_iterations']} iterations "
+                  f"({res['total_time']:.03f} seconds), final loss {res['final_loss']:.05e}, "
+                  f"{res['iterations_to_reference']} iterations to reach {reference_loss:.05e}")
+        image_results = pd.DataFrame(image_results)
+        image_results['iteration_ratio'] = (image_results.iterations_to_reference.iloc[0] /
+                                            image_results.iterations_to_reference)
+        results.append(image_results)
+    return pd.concat(results, ignore_index=True)
+
+
+def compare_gradient_checkpointing(model_name, scaling, image, num_scales=[1, 2, 3, 4],
+                                   n_iter=5, min_ecc=.5, max_ecc=15, cache_dir=None,
+                                   normalize_dict=None, gpu_id=None):
+    r"""Compare the memory and speed of V1 models with and without gradient checkpointing
+
+    For each number of scales, we initialize the V1 model with and
+    without ``gradient_checkpointing`` and record the average time and
+    the peak memory of ``n_iter`` forward and backward passes on
+    ``image`` (with ``store_intermediates=False``, as during synthesis).
+    We also check that the gradients are the same.
+
+    On the CPU, the peak memory is the maximum resident set size of the
+    process so far, which never decreases, so the checkpointed model is
+    run first, and the comparison is only meaningful on the GPU (or with
+    one number of scales per process).
+
+    Parameters
+    ----------
+    model_name : str
+        str specifying which V1 model we should initialize, see
+        ``create_metamers.setup_model``. The number of scales in it (if
+        any) is replaced by each of ``num_scales`` in turn.
+    scaling : float
+        The scaling parameter for the model
+    image : str or array_like
+        Either the path to the file to load in or the loaded-in
+        image. See ``create_metamers.setup_image``.
+    num_scales : list, optional
+        The numbers of scales to compare
+    n_iter : int, optional
+        The number of forward and backward passes to average over
+    min_ecc, max_ecc : float, optional
+        The minimum and maximum eccentricity of the pooling windows
+    cache_dir : str or None, optional
+        The directory to cache the windows tensors in
+    normalize_dict : str or None, optional
+        If a str, the path to the dictionary containing the statistics
+        to use for normalization.
+    gpu_id : int or None, optional
+        If not None, the GPU we will use. If None, we run on CPU.
+
+    Returns
+    -------
+    results : pd.DataFrame
+        One row per number of scales and checkpointing setting, with
+        columns ``forward_backward_time`` (in seconds, per iteration),
+        ``peak_memory`` (in bytes), and ``max_abs_diff_gradient``
+        (relative to the model without checkpointing)
+
+    """
+    if not model_name.startswith('V1'):
+        raise Exception("Gradient checkpointing is only supported for the V1 models!")
+    image_name = image
+    image = create_metamers.setup_image(image)
+    if normalize_dict:
+        normalize_dict = torch.load(normalize_dict)
+    results = []
+    for n in num_scales:
+        if re.findall('_s[0-9]+_', model_name):
+            name = re.sub('_s[0-9]+_', f'_s{n}_', model_name)
+        else:
+            name = model_name.replace('V1', f'V1_s{n}', 1)
+        grads = {}
+        for checkpointing in [True, False]:
+            model, _, _, _ = create_metamers.setup_model(name, scaling, image, min_ecc, max_ecc,
+                                                         cache_dir, normalize_dict,
+                                                         gradient_checkpointing=checkpointing)
+            model.store_intermediates = False
+            img, model = create_metamers.setup_device(image, model, gpu_id=gpu_id)
+            img = img.detach().clone().requires_grad_()
+            duration, peak_memory = _time_forward_backward(model, img, n_iter)
+            model(img).pow(2).sum().backward()
+            grads[checkpointing] = img.grad.detach().to('cpu')
+            results.append({'model': name, 'scaling': scaling, 'num_scales': n,
+                            'gradient_checkpointing': checkpointing,
+                            'image': (op.basename(image_name) if isinstance(image_name, str)
+                                      else 'array'),
+                            'device': str(img.device), 'forward_backward_time': duration,
+                            'peak_memory': peak_memory})
+            print(f"{name}, scaling {scaling}, checkpointing {checkpointing}: "
+                  f"{duration:.03f} sec per forward/backward, "
+                  f"peak memory {peak_memory / 1e9:.03f} GB")
+            del model
+        diff = (grads[True] - grads[False]).abs().max().item()
+        for res in results[-2:]:
+            res['max_abs_diff_gradient'] = diff
+    return pd.DataFrame(results)
+
+
+def main(model_name, scaling, image, save_path, n_repeats=1, compare_backends=False,
+         compare_checkpointing=False, compare_dtypes=False, compare_fractions=False,
+         target_loss=None, compare_preconditioning=False, **kwargs):
+    r"""Run ``benchmark_synthesis`` several times and save the results
+
+    Parameters
+    ----------
+    model_name : str
+        str specifying which of the ``PooledVentralStream`` models we
+        should initialize.
+    scaling : float or list
+        The scaling parameter(s) for the model. If a list, we benchmark
+        each of them.
+    image : str
+        The path to the reference image (ignored if
+        ``compare_preconditioning`` is True)
+    save_path : str
+        The path to the csv where we should save the results
+    n_repeats : int, optional
+        How many times to run each benchmark
+    compare_backends : bool, optional
+        If True, instead of benchmarking synthesis, we compare the
+        pooling window backends with ``compare_window_backends`` (in
+        which case ``n_repeats`` is ignored).
+    compare_checkpointing : bool, optional
+        If True, instead of benchmarking synthesis, we compare the V1
+        model with and without gradient checkpointing, for 1 up to the
+        model's number of scales, with
+        ``compare_gradient_checkpointing`` (in which case ``n_repeats``
+        is ignored).
+    compare_dtypes : bool, optional
+        If True, instead of benchmarking synthesis, we compare the
+        accuracy of storing the pooling windows in float32, float16, and
+        bfloat16 with ``compare_window_dtypes`` (in which case
+        ``n_repeats`` is ignored).
+    compare_fractions : bool, optional
+        If True, instead of benchmarking synthesis, we compare the time
+        it takes full-batch synthesis and synthesis with stochastic
+        window subsets (``window_fraction`` of .5, .25, and .1) to reach
+        the same loss with ``compare_window_fractions`` (in which case
+        ``n_repeats`` is ignored).
+    target_loss : float or None, optional
+        Only used if ``compare_fractions`` is True, the loss to reach
+        (see ``compare_window_fractions``).
+    compare_preconditioning : bool, optional
+        If True, instead of benchmarking synthesis, we compare how many
+        iterations synthesis takes with and without preconditioning the
+        gradient, on the test images in ``extra_packages/data``, with
+        ``compare_gradient_preconditioning`` (in which case ``n_repeats`` is
+        ignored and ``max_iter`` is the maximum number of iterations).
+    kwargs :
+        passed to ``benchmark_synthesis`` (or
+        ``compare_window_backends`` / ``compare_gradient_checkpointing``
+        / ``compare_window_dtypes`` / ``compare_window_fractions`` /
+        ``compare_gradient_preconditioning``)
+
+    Returns
+    -------
+    results : pd.DataFrame
+        The results, one row per run
+
+    """
+    if not hasattr(scaling, '__iter__'):
+        scaling = [scaling]
+    results = []
+    if compare_preconditioning:
+        for k in ['store_progress', 'coarse_to_fine', 'gradient_checkpointing', 'window_dtype',
+                  'window_fraction']:
+            kwargs.pop(k, None)
+        # compare against the requested power, if there is one
+        precondition = kwargs.pop('precondition', None) or True
+        results = pd.concat([compare_gradient_preconditioning(model_name, sc,
+                                                              preconditions=[False, precondition],
+                                                              **kwargs)
+                             for sc in scaling])
+        results.to_csv(save_path, index=False)
+        return results
+    kwargs.pop('loss_thresh', None)
+    if compare_fractions:
+        for k in ['store_progress', 'coarse_to_fine', 'gradient_checkpointing', 'window_dtype',
+                  'window_fraction', 'precondition']:
+            kwargs.pop(k, None)
+        results = pd.concat([compare_window_fractions(model_name, sc, image,
+                                                      target_loss=target_loss, **kwargs)
+                             for sc in scaling])
+        results.to_csv(save_path, index=False)
+        return results
+    if compare_dtypes:
+        kwargs.pop('window_fraction', None)
+        kwargs.pop('precondition', None)
+        for k in ['store_progress', 'coarse_to_fine', 'gradient_checkpointing', 'window_dtype']:
+            kwargs.pop(k, None)
+        results = pd.concat([compare_window_dtypes(model_name, sc, image, **kwargs)
+                             for sc in scaling])
+        results.to_csv(save_path, index=False)
+        return results
+    if compare_backends or compare_checkpointing:
+        for k in ['max_iter', 'store_progress', 'coarse_to_fine', 'window_backend', 'seed',
+                  'initial_image_type', 'gradient_checkpointing', 'window_dtype',
+                  'window_fraction', 'precondition']:
+            kwargs.pop(k, None)
+        if compare_backends:
+            results = pd.concat([compare_window_backends(model_name, sc, image, **kwargs)
+                                 for sc in scaling])
+        else:
+            kwargs.pop('window_memory_budget', None)
+            try:
+                n_scales = int(re.findall('_s([0-9]+)_', model_name)[0])
+            except IndexError:
+                n_scales = 4
+            results = pd.concat([compare_gradient_checkpointing(model_name, sc, image,
+                                                                list(range(1, n_scales+1)),
+                                                                **kwargs)
+                                 for sc in scaling])
+        results.to_csv(save_path, index=False)
+        return results
+    for sc in scaling:
+        for i in range(n_repeats):
+            res = benchmark_synthesis(model_name, sc, image, **kwargs)
+            res['repeat'] = i
+            print(f"{model_name}, scaling {sc}, repeat {i}: "
+                  f"{res['iterations_per_sec']:.03f} iterations/sec, "
+                  f"peak memory {res['peak_memory'] / 1e9:.03f} GB")
+            results.append(pd.DataFrame(res, index=[len(results)]))
+    results = pd.concat(results)
+    results.to_csv(save_path, index=False)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=("Benchmark the speed (iterations per second) and peak memory use of metamer "
+                     "synthesis. Run before and after a change and compare the outputs."),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("model_name", help="Name of the model to benchmark, e.g., V1_norm_s6_gaussian")
+    parser.add_argument("image", help="Path to the reference image")
+    parser.add_argument("save_path", help="Path to the csv to save the results at")
+    parser.add_argument("--scaling", '-s', type=float, nargs='+', default=[.5],
+                        help="Scaling value(s) to benchmark")
+    parser.add_argument("--max_iter", '-m', type=int, default=20,
+                        help="Number of iterations of synthesis to run")
+    parser.add_argument("--n_repeats", '-n', type=int, default=1,
+                        help="Number of times to run each benchmark")
+    parser.add_argument("--store_progress", type=int, default=0,
+                        help="How often to store progress (0 means never)")
+    parser.add_argument("--gpu_id", '-g', type=int, default=None,
+                        help="GPU to use. If unset, we use the CPU")
+    parser.add_argument("--cache_dir", '-c', default=None,
+                        help="Directory to cache the windows in")
+    parser.add_argument("--normalize_dict", default=None,
+                        help="Path to the normalization statistics, for the norm models")
+    parser.add_argument("--coarse_to_fine", default=False,
+                        help="Coarse-to-fine mode to use: 'together', 'separate', or False")
+    parser.add_argument("--window_backend", default='dense',
+                        help="How to store the pooling windows: 'dense', 'sparse', or 'chunked'")
+    parser.add_argument("--window_memory_budget", type=float, default=None,
+                        help="Memory (in GB) to use per chunk of windows, for the chunked backend")
+    parser.add_argument("--compare_backends", action='store_true',
+                        help=("Instead of benchmarking synthesis, compare the memory, speed, and "
+                              "accuracy of the pooling window backends"))
+    parser.add_argument("--gradient_checkpointing", action='store_true',
+                        help="Use gradient checkpointing (V1 models only)")
+    parser.add_argument("--compare_checkpointing", action='store_true',
+                        help=("Instead of benchmarking synthesis, compare the memory and speed of "
+                              "the V1 model with and without gradient checkpointing, for each "
+                              "number of scales up to the model's"))
+    parser.add_argument("--window_dtype", default=None,
+                        help="dtype to store the pooling windows in: 'float16' or 'bfloat16'")
+    parser.add_argument("--compare_dtypes", action='store_true',
+                        help=("Instead of benchmarking synthesis, compare the memory and accuracy "
+                              "(of the representation and the final loss of --max_iter iterations "
+                              "of synthesis) of storing the windows in float32, float16, and "
+                              "bfloat16"))
+    parser.add_argument("--window_fraction", type=float, default=1,
+                        help=("Fraction of the pooling windows to use on each iteration (drawn at "
+                              "random every iteration)"))
+    parser.add_argument("--compare_fractions", action='store_true',
+                        help=("Instead of benchmarking synthesis, compare the wall-clock time it "
+                              "takes full-batch SGD and SGD with random subsets of .5, .25, and .1 "
+                              "of the windows to reach the same loss (--max_iter is then the "
+                              "maximum number of iterations)"))
+    parser.add_argument("--target_loss", type=float, default=None,
+                        help=("Loss to reach with --compare_fractions. If unset, the loss "
+                              "full-batch SGD reaches after --max_iter iterations"))
+    parser.add_argument("--precondition", type=float, default=0,
+                        help=("Rescale the gradient at each pixel by the size of the windows it "
+                              "belongs to, raised to this power (0 means don't)"))
+    parser.add_argument("--loss_thresh", type=float, default=1e-4,
+                        help="Loss change threshold for --compare_preconditioning")
+    parser.add_argument("--compare_preconditioning", action='store_true',
+                        help=("Instead of benchmarking synthesis, compare how many iterations "
+                              "synthesis takes (up to --max_iter) to reach --loss_thresh with and "
+                              "without preconditioning the gradient (with --precondition's power, "
+                              "if set), on the images in extra_packages/data (the image argument "
+                              "is then ignored)"))
+    args = vars(parser.parse_args())
+    if args['coarse_to_fine'] == 'False':
+        args['coarse_to_fine'] = False
+    main(**args)
@@ -6,6 +6,7 @@ import re
 import imageio
 import warnings
 import os
+import shutil
 import time
 import numpy as np
 import plenoptic as po
@@ -15,8 +16,8 @@ import os.path as op
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 import seaborn as sns
-from skimage import color
-from .utils import convert_im_to_float, convert_im_to_int
+from skimage import color, transform
+from .utils import convert_im_to_float, convert_im_to_int, find_nearest_scaling_metamer
 # by default matplotlib uses the TK gui toolkit which can cause problems
 # when I'm trying to render an image into a file, see
 # https://stackoverflow.com/questions/27147300/matplotlib-tcl-asyncdelete-async-handler-deleted-by-the-wrong-thread
@@ -187,7 +188,9 @@ def find_figsizes(model_name, model, image_shape):
     return animate_figsize, rep_image_figsize, img_zoom
 
 
-def setup_model(model_name, scaling, image, min_ecc, max_ecc, cache_dir, normalize_dict=None):
+def setup_model(model_name, scaling, image, min_ecc, max_ecc, cache_dir, normalize_dict=None,
+                window_backend='dense', window_memory_budget=None, gradient_checkpointing=False,
+                representation_cache_dir=None, window_dtype=None):
     r"""setup the model
 
     We initialize the model, with the specified parameters, and return
@@ -248,6 +251,28 @@ def setup_model(model_name, scaling, image, min_ecc, max_ecc, cache_dir, normali
         None, we don't normalize. This can only be set (and must be set)
         if the model is "V1_norm". In any other case, we'll throw an
         Exception.
+    window_backend : {'dense', 'sparse', 'chunked'}, optional
+        How to store the pooling windows, see
+        ``plenoptic.simul.PooledVentralStream`` for details.
+    window_memory_budget : float or None, optional
+        If ``window_backend='chunked'``, the memory (in GB) to use for
+        each chunk of windows.
+    gradient_checkpointing : bool, optional
+        If True, recompute the steerable pyramid during the backward
+        pass instead of storing it, which reduces the memory needed for
+        synthesis at some cost in speed. Only supported for the V1
+        models.
+    representation_cache_dir : str or None, optional
+        If set, the directory of the on-disk cache of model
+        representations (see
+        ``plenoptic_part.simulate.representation_cache``), which the
+        model will use for the reference image (the metamers themselves
+        are never cached). If None, we don't cache them.
+    window_dtype : {None, 'float32', 'float16', 'bfloat16'}, optional
+        If not None, the dtype to store the pooling windows in. 'float16'
+        and 'bfloat16' halve the memory used by the windows, while
+        pooling is still computed in the image's dtype. See
+        ``benchmark.compare_window_dtypes`` for the effect on accuracy.
 
     Returns
     -------
@@ -273,6 +298,8 @@ def setup_model(model_name, scaling, image, min_ecc, max_ecc, cache_dir, normali
         t_width = 1
         std_dev = None
     if model_name.startswith('RGC'):
+        if gradient_checkpointing:
+            raise Exception("Gradient checkpointing is only supported for the V1 models!")
         if 'norm' not in model_name:
             if normalize_dict:
                 raise Exception("Cannot normalize RGC model (must be RGC_norm)!")
@@ -286,7 +313,10 @@ def setup_model(model_name, scaling, image, min_ecc, max_ecc, cache_dir, normali
                               transition_region_width=t_width,
                               cache_dir=cache_dir,
                               std_dev=std_dev,
-                              normalize_dict=normalize_dict)
+                              normalize_dict=normalize_dict,
+                              window_backend=window_backend,
+                              window_memory_budget=window_memory_budget,
+                              window_dtype=window_dtype)
     elif model_name.startswith('V1'):
         if 'norm' not in model_name:
             if normalize_dict:
@@ -312,9 +342,15 @@ def setup_model(model_name, scaling, image, min_ecc, max_ecc, cache_dir, normali
                              normalize_dict=normalize_dict,
                              num_scales=num_scales,
                              window_type=window_type,
-                             moments=moments)
+                             moments=moments,
+                             window_backend=window_backend,
+                             window_memory_budget=window_memory_budget,
+                             gradient_checkpointing=gradient_checkpointing,
+                             window_dtype=window_dtype)
     else:
         raise Exception("Don't know how to handle model_name %s" % model_name)
+    if representation_cache_dir is not None:
+        model.representation_cache = pop.RepresentationCache(representation_cache_dir)
     animate_figsize, rep_image_figsize, img_zoom = find_figsizes(model_name, model,
                                                                  image.shape)
     return model, animate_figsize, rep_image_figsize, img_zoom
@@ -331,7 +367,7 @@ def add_center_to_image(model, image, reference_image):
     ----------
     model : plenoptic.simul.VentralStream
         The model used to create the metamer. Specifically, we need its
-        windows attribute
+        ``window_coverage`` attribute
     image : torch.Tensor
         The image to add the center back to
     reference_image : torch.Tensor
@@ -344,10 +380,7 @@ def add_center_to_image(model, image, reference_image):
         ``image`` with the reference image center added back in
 
     """
-    model(image)
-    rep = model.representation['mean_luminance']
-    dummy_ones = torch.ones_like(rep)
-    windows = model.PoolingWindows.project(dummy_ones).squeeze().to(image.device)
+    windows = model.window_coverage.to(image.device)
     # these aren't exactly zero, so we can't convert it to boolean
     anti_windows = 1 - windows
     return ((windows * image) + (anti_windows * reference_image))
@@ -404,8 +437,11 @@ def summary_plots(metamer, rep_image_figsize, img_zoom):
     titles = ['Initial image', 'Metamer', 'Reference image']
     titles += ['Windowed '+t for t in titles]
     windowed_fig = pt.imshow(images, col_wrap=3, title=titles, vrange=(0, 1), zoom=img_zoom)
-    for ax in windowed_fig.axes[3:]:
-        metamer.model.plot_windows(ax)
+    # the sparse window backend doesn't hold onto the dense windows, so
+    # it can't plot them
+    if getattr(metamer.model, 'window_backend', 'dense') != 'sparse':
+        for ax in windowed_fig.axes[3:]:
+            metamer.model.plot_windows(ax)
     return rep_fig, windowed_fig
 
 
@@ -475,6 +511,10 @@ def summarize_history(metamer, save_path, **kwargs):
     - pixel_change: the max pixel change in the synthesized image from
       previous iteration to this
 
+    - time_{phase}, peak_memory_{phase}: if synthesis was profiled
+      (i.e., ``metamer.profiler`` is not None), the time (in seconds)
+      and peak memory (in bytes) of each phase of this iteration
+
     - error terms: the summarized error terms, as returned by
       `metamer.model.summarize_representation(metamer.representation_error())`. This
       will be the error at each scale and each band.
@@ -503,7 +543,9 @@ def summarize_history(metamer, save_path, **kwargs):
         iteration
 
     """
-    num_saves = metamer.saved_signal.shape[0]
+    # saved_signal may be read lazily from disk (if metamer was loaded
+    # from an in-progress save), so only index into it one at a time
+    num_saves = len(metamer.saved_signal)
     summary = []
     keys = ['loss', 'image_mse', 'iteration', 'learning_rate', 'gradient_norm', 'num_statistics',
             'pixel_change']
@@ -512,11 +554,17 @@ def summarize_history(metamer, save_path, **kwargs):
             warnings.warn(f"{k} found in the kwargs to add to history.csv, but we're going to "
                           "add that ourselves! Removing...")
             kwargs.pop(k)
+    rep_errors = [metamer.representation_error(i) for i in range(1, num_saves)]
+    if len(set([r.shape for r in rep_errors])) == 1:
+        # then we can summarize them all at once
+        summarized_reps, keys = metamer.model.summarize_representation_batch(
+            torch.stack(rep_errors))
+        summarized_reps = [dict(zip(keys, r)) for r in summarized_reps.tolist()]
+    else:
+        summarized_reps = [metamer.model.summarize_representation(r) for r in rep_errors]
     for i in range(1, num_saves):
-        rep_error = metamer.representation_error(i)
         image_mse = torch.pow(metamer.base_signal - metamer.saved_signal[i], 2).mean().item()
-        summarized_rep = metamer.model.summarize_representation(rep_error)
-        summarized_rep = _transform_summarized_rep(summarized_rep)
+        summarized_rep = _transform_summarized_rep(summarized_reps[i-1])
         it = (i-1) * metamer.store_progress
         if it >= len(metamer.loss):
             it = -1
@@ -524,6 +572,8 @@ def summarize_history(metamer, save_path, **kwargs):
                 'learning_rate': metamer.learning_rate[it], 'gradient_norm': metamer.gradient[it],
                 'num_statistics': metamer.base_representation.numel(),
                 'pixel_change': metamer.pixel_change[it]}
+        if getattr(metamer, 'profiler', None) is not None:
+            data.update(metamer.profiler.iteration_summary(it if it >= 0 else len(metamer.loss)-1))
         data.update(summarized_rep)
         data.update(kwargs)
         summary.append(pd.DataFrame(data, index=[i]))
@@ -562,6 +612,11 @@ def summarize(metamer, save_path, **kwargs):
     - window  sizes:  the  summarized   window  sizes,  as  returned  by
       `metamer.model.summarize_window_sizes()`
 
+    - time_{phase}_total, time_{phase}_mean, peak_memory_{phase}: if
+      synthesis was profiled (i.e., ``metamer.profiler`` is not None),
+      the total and mean time (in seconds) and the peak memory (in
+      bytes) of each phase of synthesis
+
     Parameters
     ----------
     metamer : pop.Metamer
@@ -589,6 +644,8 @@ def summarize(metamer, save_path, **kwargs):
     summarized_rep = _transform_summarized_rep(summarized_rep)
     data.update(summarized_rep)
     data.update(metamer.model.summarize_window_sizes())
+    if getattr(metamer, 'profiler', None) is not None:
+        data.update(metamer.profiler.summary())
     summary = pd.DataFrame(data, index=[0])
     summary.to_csv(save_path, index=False)
     return summary
@@ -705,25 +762,34 @@ def save(save_path, metamer, animate_figsize, rep_image_figsize, img_zoom,
     fig.savefig(window_check_path)
 
 
-def setup_initial_image(initial_image_type, model, image):
+def setup_initial_image(initial_image_type, model, image, metamer_path=None):
     r"""setup the initial image
 
     Parameters
     ----------
-    initial_image_type : {'white', 'pink', 'gray', 'blue'} or path to file
+    initial_image_type : {'white', 'pink', 'gray', 'blue', 'nearest-scaling'} or path to file
         What to use for the initial image. If 'white', we use white
         noise. If 'pink', we use pink noise
         (``pyrtools.synthetic_images.pink_noise(fract_dim=1)``). If
         'blue', we use blue noise
         (``pyrtools.synthetic_images.blue_noise(fract_dim=1)``). If
         'gray', we use a flat image with values of .5 everywhere. If
-        path to a file, that's what we use as our initial image (and so
-        the seed will have no effect on this).
+        'nearest-scaling', we use the finished metamer with the nearest
+        scaling value that is otherwise identical to the one we're
+        synthesizing (same model, image, seed, etc., see
+        ``utils.find_nearest_scaling_metamer``), falling back to white
+        noise if there isn't one. If path to a file, that's what we use
+        as our initial image (and so the seed will have no effect on
+        this); this can be an image or a ``.npy`` file, like the
+        ``_metamer.npy`` files saved by ``save``.
     model : plenoptic.simul.VentralStream
         The model used to create the metamer. Specifically, we need its
         windows attribute
     image : torch.Tensor
         The reference image tensor
+    metamer_path : str or None, optional
+        The path we're saving the metamer at. Required if
+        ``initial_image_type='nearest-scaling'`` (ignored otherwise).
 
     Returns
     -------
@@ -731,6 +797,16 @@ def setup_initial_image(initial_image_type, model, image):
         The initial image to pass to metamer.synthesize
 
     """
+    if initial_image_type == 'nearest-scaling':
+        if metamer_path is None:
+            raise Exception("metamer_path must be set if initial_image_type='nearest-scaling'!")
+        nearest_path, _ = find_nearest_scaling_metamer(metamer_path)
+        if nearest_path is None:
+            warnings.warn("Unable to find a finished metamer at another scaling value for "
+                          f"{metamer_path}, using white noise as initial image!")
+            initial_image_type = 'white'
+        else:
+            initial_image_type = nearest_path
     if initial_image_type == 'white':
         initial_image = torch.rand_like(image, dtype=torch.float32)
     elif initial_image_type == 'gray':
@@ -751,12 +827,18 @@ def setup_initial_image(initial_image_type, model, image):
         initial_image = torch.Tensor(initial_image).unsqueeze(0).unsqueeze(0)
     elif op.isfile(initial_image_type):
         warnings.warn("Using image %s as initial image!" % initial_image_type)
-        initial_image = imageio.imread(initial_image_type)
-        initial_image = convert_im_to_float(initial_image)
-        initial_image = torch.tensor(initial_image, dtype=torch.float32).unsqueeze(0).unsqueeze(0)
+        if initial_image_type.endswith('.npy'):
+            # already a float between 0 and 1
+            initial_image = np.load(initial_image_type)
+        else:
+            initial_image = imageio.imread(initial_image_type)
+            initial_image = convert_im_to_float(initial_image)
+        initial_image = torch.tensor(initial_image, dtype=torch.float32)
+        while initial_image.ndimension() < 4:
+            initial_image = initial_image.unsqueeze(0)
     else:
         raise Exception("Don't know how to handle initial_image_type %s! Must be one of {'white',"
-                        " 'gray', 'pink', 'blue'}" % initial_image_type)
+                        " 'gray', 'pink', 'blue', 'nearest-scaling'}" % initial_image_type)
     initial_image = add_center_to_image(model, initial_image, image)
     return torch.nn.Parameter(initial_image)
 
@@ -814,11 +896,251 @@ def setup_device(*args, gpu_id=None):
     return [a.to(device) for a in args]
 
 
+def synthesize_scaling_sweep(model, image, initial_image, max_iter=100, learning_rate=.01,
+                             loss=pop.optim.l2_norm, loss_kwargs={}, clamper=None):
+    r"""Synthesize metamers for several scaling values at once
+
+    This is a simple synthesis loop (Adam, with a fixed number of
+    iterations) that synthesizes one metamer per scaling value of
+    ``model``, all in one batch: each iteration, we compute the
+    steerable pyramid of the whole batch once, and then pool each image
+    with the windows of its own scaling value. Since the images are
+    independent, the gradient of the summed loss with respect to each
+    image is the gradient of that image's own loss.
+
+    Parameters
+    ----------
+    model : pop.PooledV1Sweep
+        The model, containing all the scaling values to synthesize
+    image : torch.Tensor
+        The 4d reference image (with a batch of 1)
+    initial_image : torch.Tensor
+        The 4d initial image, with one image per scaling value along
+        the batch dimension. See ``setup_initial_image``; since the
+        initial image has the reference image's center added back in
+        (which depends on the windows), you should call it once for
+        each of ``model.models`` and concatenate them.
+    max_iter : int, optional
+        The number of iterations to run
+    learning_rate : float, optional
+        The learning rate for the Adam optimizer
+    loss : callable, optional
+        The loss function, one of the functions in ``pop.optim``. Will
+        be called once per scaling value with ``synth_rep``,
+        ``ref_rep``, ``synth_img`` (that scaling's image), and
+        ``loss_kwargs``.
+    loss_kwargs : dict, optional
+        Additional keyword arguments for ``loss``
+    clamper : pop.clamps.Clamper or None, optional
+        If not None, we clamp the images after each iteration
+
+    Returns
+    -------
+    synthesized_signal : torch.Tensor
+        The 4d synthesized images, one per scaling value (in the same
+        order as ``model.scaling``)
+    loss : np.ndarray
+        2d array of shape ``(max_iter, len(model.scaling))`` containing
+        the loss of each scaling value's image on each iteration
+
+    """
+    with torch.no_grad():
+        ref_reps = model(image)
+    synthesized_signal = torch.nn.Parameter(initial_image.detach().clone())
+    optimizer = torch.optim.Adam([synthesized_signal], lr=learning_rate, amsgrad=True)
+    losses = []
+    for i in range(max_iter):
+        optimizer.zero_grad()
+        synth_reps = model(synthesized_signal, split_batch=True)
+        scaling_losses = [loss(synth_reps[sc], ref_reps[sc], synth_img=synthesized_signal[j:j+1],
+                               **loss_kwargs) for j, sc in enumerate(model.scaling)]
+        torch.stack(scaling_losses).sum().backward()
+        optimizer.step()
+        if clamper is not None:
+            synthesized_signal.data = clamper.clamp(synthesized_signal.data)
+        losses.append([l.item() for l in scaling_losses])
+        if np.isnan(losses[-1]).any():
+            raise Exception(f"Found a NaN in loss during iteration {i}!")
+    return synthesized_signal.detach(), np.array(losses)
+
+
+def downsample_image(image, downsample):
+    r"""Downsample the image, the same way the pipeline creates the downsampled reference images
+
+    We use ``skimage.transform.pyramid_reduce``, as the
+    ``preprocess_image`` rule does for the ``downsample-{n}`` images
+    (without converting to 16 bit afterwards).
+
+    Parameters
+    ----------
+    image : torch.Tensor
+        The 4d image tensor to downsample
+    downsample : float
+        The factor to downsample by
+
+    Returns
+    -------
+    downsampled : torch.Tensor
+        The downsampled 4d image, on the same device and with the same
+        dtype as ``image``
+
+    """
+    im = image.detach().to('cpu').numpy()
+    im = np.stack([np.stack([transform.pyramid_reduce(c, downsample) for c in b]) for b in im])
+    return torch.tensor(im, dtype=image.dtype, device=image.device)
+
+
+def multiresolution_initial_image(model_name, scaling, image, resolution_levels, min_ecc=.5,
+                                  max_ecc=15, cache_dir=None, normalize_dict=None, seed=0,
+                                  initial_image_type='white', max_iter=100, loss_thresh=1e-4,
+                                  loss_change_iter=50, gpu_id=None, model_kwargs={},
+                                  loss_function=None, loss_function_kwargs={}, **synth_kwargs):
+    r"""Synthesize at lower resolutions to get an initial image for full-resolution synthesis
+
+    Synthesizing metamers for large images from noise takes many
+    full-resolution iterations, most of which are spent getting the
+    coarse structure right. Instead, we synthesize a metamer against the
+    same model built for a downsampled version of ``image`` (see
+    ``downsample_image``), upsample the result (bilinearly) and use it
+    as the initial image for the next, finer level, adding the center of
+    that level's reference image back in (see ``add_center_to_image``).
+    We return the upsampled metamer from the last level, at the
+    resolution of ``image``, so full-resolution synthesis starts from
+    it.
+
+    The model's eccentricities are in degrees, so every level pools over
+    the same part of the visual field, just with fewer pixels per
+    degree. Note that the normalization statistics (if any) are computed
+    at full resolution and used as is.
+
+    Parameters
+    ----------
+    model_name : str
+        str specifying which of the ``PooledVentralStream`` models we
+        should initialize. See ``setup_model`` for more details.
+    scaling : float
+        The scaling parameter for the model
+    image : torch.Tensor
+        The 4d reference image, at full resolution
+    resolution_levels : list
+        The factors to downsample ``image`` by at each level, from
+        coarsest to finest, e.g., ``[4, 2]``. Each should be greater
+        than 1.
+    min_ecc, max_ecc : float, optional
+        The minimum and maximum eccentricity of the pooling windows
+    cache_dir : str or None, optional
+        The directory to cache the windows tensors in
+    normalize_dict : dict or None, optional
+        The (loaded) normalization statistics, see ``setup_model``
+    seed : int or list, optional
+        The seed for the initial image of the coarsest level and for
+        synthesis. If a list, we synthesize one metamer per seed at
+        once, as in ``main``.
+    initial_image_type : {'white', 'pink', 'gray', 'blue'}, optional
+        The initial image for the coarsest level, generated at that
+        level's resolution (see ``setup_initial_image``). Initial images
+        loaded from a file are not supported.
+    max_iter, loss_thresh, loss_change_iter : int, float, int, or list, optional
+        The maximum number of iterations and the convergence criteria
+        for synthesis at each level (see ``Metamer.synthesize``). If a
+        list, should have one value per level; otherwise, every level
+        uses the same value.
+    gpu_id : int or None, optional
+        If not None, the GPU we will use. If None, we run on CPU.
+    model_kwargs : dict, optional
+        Additional keyword arguments for ``setup_model`` (e.g.,
+        ``window_backend``)
+    loss_function : callable or None, optional
+        The loss function to use, see ``Metamer``
+    loss_function_kwargs : dict, optional
+        Additional keyword arguments for the loss function
+    synth_kwargs :
+        Passed to ``Metamer.synthesize`` at every level (e.g.,
+        ``learning_rate``, ``optimizer``, ``clamper``)
+
+    Returns
+    -------
+    initial_image : torch.Tensor
+        The upsampled metamer from the finest level, at the resolution
+        of ``image`` (on the cpu). Its center is not the reference
+        image's, so pass it through ``add_center_to_image`` before using
+        it.
+    level_summary : dict
+        Dictionary with, for each level ``i``,
+        ``multires_level_{i}_downsample``, ``multires_level_{i}_img_res``,
+        ``multires_level_{i}_num_iterations``,
+        ``multires_level_{i}_loss``, and ``multires_level_{i}_duration``
+        (in seconds), as well as ``multires_duration``, the total.
+
+    """
+    if initial_image_type not in ['white', 'pink', 'gray', 'blue']:
+        raise Exception("Multi-resolution synthesis only supports initial_image_type 'white', "
+                        f"'pink', 'gray', or 'blue', but got {initial_image_type}!")
+    n_levels = len(resolution_levels)
+    level_kwargs = {}
+    for k, v in zip(['max_iter', 'loss_thresh', 'loss_change_iter'],
+                    [max_iter, loss_thresh, loss_change_iter]):
+        if not isinstance(v, (list, tuple)):
+            v = [v] * n_levels
+        if len(v) != n_levels:
+            raise Exception(f"Need one value of {k} per resolution level, but got {len(v)} "
+                            f"values for {n_levels} levels!")
+        level_kwargs[k] = v
+    seeds = seed if isinstance(seed, (list, tuple)) else [seed]
+    level_summary = {}
+    initial_image = None
+    total_start_time = time.time()
+    for i, downsample in enumerate(resolution_levels):
+        level_image = downsample_image(image, downsample)
+        model, _, _, _ = setup_model(model_name, scaling, level_image, min_ecc, max_ecc,
+                                     cache_dir, normalize_dict, **model_kwargs)
+        if initial_image is None:
+            initial_image = []
+            for s in seeds:
+                torch.manual_seed(s)
+                np.random.seed(s)
+                initial_image.append(setup_initial_image(initial_image_type, model,
+                                                         level_image).detach())
+            initial_image = torch.cat(initial_image)
+        else:
+            initial_image = torch.nn.functional.interpolate(initial_image, level_image.shape[-2:],
+                                                            mode='bilinear', align_corners=False)
+            initial_image = add_center_to_image(model, initial_image, level_image)
+        level_image, initial_image, model = setup_device(level_image, initial_image, model,
+                                                         gpu_id=gpu_id)
+        print(f"Multi-resolution level {i}: downsampling by {downsample}, image size "
+              f"{tuple(level_image.shape[-2:])}")
+        metamer = pop.Metamer(level_image, model, loss_function=loss_function,
+                              loss_function_kwargs=loss_function_kwargs)
+        start_time = time.time()
+        metamer.synthesize(initial_image=initial_image, seed=seed,
+                           max_iter=level_kwargs['max_iter'][i],
+                           loss_thresh=level_kwargs['loss_thresh'][i],
+                           loss_change_iter=level_kwargs['loss_change_iter'][i], **synth_kwargs)
+        duration = time.time() - start_time
+        level_summary.update({f'multires_level_{i}_downsample': downsample,
+                              f'multires_level_{i}_img_res': 'x'.join([str(j) for j in
+                                                                       level_image.shape[-2:]]),
+                              f'multires_level_{i}_num_iterations': len(metamer.loss),
+                              f'multires_level_{i}_loss': metamer.loss[-1],
+                              f'multires_level_{i}_duration': duration})
+        initial_image = metamer.synthesized_signal.detach().to('cpu')
+        del metamer, model
+    initial_image = torch.nn.functional.interpolate(initial_image, image.shape[-2:],
+                                                    mode='bilinear', align_corners=False)
+    level_summary['multires_duration'] = time.time() - total_start_time
+    return initial_image, level_summary
+
+
 def main(model_name, scaling, image, seed=0, min_ecc=.5, max_ecc=15, learning_rate=1, max_iter=100,
          loss_thresh=1e-4, loss_change_iter=50, save_path=None, initial_image_type='white',
          gpu_id=None, cache_dir=None, normalize_dict=None, optimizer='SGD', fraction_removed=0,
          loss_change_fraction=1, loss_change_thresh=.1, coarse_to_fine=False, clamper_name='clamp',
-         clamp_each_iter=True, loss_func='l2', continue_path=None, save_all=False, num_threads=None):
+         clamp_each_iter=True, loss_func='l2', continue_path=None, save_all=False, num_threads=None,
+         profile=False, window_backend='dense', window_memory_budget=None,
+         gradient_checkpointing=False, representation_cache_dir=None, window_dtype=None,
+         resolution_levels=None, level_max_iter=None, level_loss_thresh=None,
+         level_loss_change_iter=None, window_fraction=1, precondition=False):
     r"""create metamers!
 
     Given a model_name, model parameters, a target image, and some
@@ -864,10 +1186,32 @@ def main(model_name, scaling, image, seed=0, min_ecc=.5, max_ecc=15, learning_ra
     and max_iter (which gives the number of extra iterations you want to
     do). Specifically, I think things might get weird if you do this
     initially on a GPU and then try to resume on a CPU (or vice versa),
-    for example. When resuming, there's always a slight increase in the
-    loss that, as far as I can tell, is unavoidable; it goes away
-    quickly (and the loss continues its earlier trend) and so I don't
-    think is an issue.
+    for example. The checkpoint includes the state of the optimizer,
+    learning rate scheduler (and SWA), random number generators, and
+    coarse-to-fine optimization, so (with learning_rate=None, as we set
+    it when resuming from the `_inprogress.pt` file) synthesis continues
+    exactly where it left off: the loss is the same as if it had never
+    been interrupted.
+
+    If `resolution_levels` is set (e.g., `[4, 2]`), we don't start
+    full-resolution synthesis from noise: we first synthesize a metamer
+    for the reference image downsampled by each of those factors in
+    turn, from coarsest to finest, each level starting from the
+    upsampled metamer of the previous one, and full-resolution synthesis
+    starts from the upsampled metamer of the finest level (see
+    `multiresolution_initial_image`). The number of iterations and
+    convergence criteria of each level are set by `level_max_iter`,
+    `level_loss_thresh`, and `level_loss_change_iter`, and the summary
+    csv includes the time spent on each level. This is skipped when
+    resuming synthesis.
+
+    If `seed` is a list, we synthesize one metamer per seed at once
+    (along the batch dimension), so the model is only built and the
+    windows only loaded once. Each metamer is initialized as it would
+    have been on its own and stops separately (see `Metamer.synthesize`
+    for details), and we write out the same outputs for each of them as
+    we would for a single seed, so `save_path` must then be a list of
+    the same length.
 
     Parameters
     ----------
@@ -880,9 +1224,10 @@ def main(model_name, scaling, image, seed=0, min_ecc=.5, max_ecc=15, learning_ra
         Either the path to the file to load in or the loaded-in
         image. If array_like, we assume it's already 2d (i.e.,
         grayscale)
-    seed : int, optional
+    seed : int or list, optional
         The number to use for initializing numpy and torch's random
-        number generators
+        number generators. If a list, we synthesize one metamer per
+        seed, see above.
     min_ecc : float, optional
         The minimum eccentricity for the pooling windows (see
         plenoptic.simul.VentralStream for more details)
@@ -901,19 +1246,28 @@ def main(model_name, scaling, image, seed=0, min_ecc=.5, max_ecc=15, learning_ra
         How many iterations back to check in order to see if the loss
         has stopped decreasing (for both loss_change_iter and
         coarse-to-fine optimization)
-    save_path : str or None, optional
+    save_path : str, list, or None, optional
         If a str, the path to the file to save the metamer object to. If
         None, we don't save the synthesis output (that's probably a bad
-        idea)
-    initial_image_type : {'white', 'pink', 'gray', 'blue'} or path to a file
+        idea). If `seed` is a list, this must be a list of the same
+        length, giving the path for each seed's metamer.
+    initial_image_type : {'white', 'pink', 'gray', 'blue', 'nearest-scaling'} or path to a file
         What to use for the initial image. If 'white', we use white
         noise. If 'pink', we use pink noise
         (``pyrtools.synthetic_images.pink_noise(fract_dim=1)``). If
         'blue', we use blue noise
         (``pyrtools.synthetic_images.blue_noise(fract_dim=1)``). If
         'gray', we use a flat image with values of .5 everywhere. If
-        path to a file, that's what we use as our initial image (and so
-        the seed will have no effect on this).
+        'nearest-scaling', we warm-start from the finished metamer with
+        the nearest scaling value that matches this one in everything
+        else (including the seed, see
+        ``utils.find_nearest_scaling_metamer``), using white noise if
+        there isn't one; which metamer we used is recorded in the
+        ``warm_start_path`` and ``warm_start_scaling`` columns of the
+        summary csv. This requires ``save_path`` and can't be combined
+        with ``resolution_levels``. If path to a file, that's what we
+        use as our initial image (and so the seed will have no effect
+        on this).
     gpu_id : int or None, optional
         If not None, the GPU we will use. If None, we run on CPU. We
         don't do anything clever to handle that here, but the
@@ -996,17 +1350,77 @@ def main(model_name, scaling, image, seed=0, min_ecc=.5, max_ecc=15, learning_ra
         matter (all costly computations are done on the GPU). If one the CPU,
         we seem to only improve performance up to ~12 threads (at least with
         RGC model), and actively start to harm performance as we get above 40.
+    profile : bool, optional
+        If True, we record the time and peak memory of each phase of
+        synthesis (model forward, backward, optimizer step, storing,
+        saving, etc.) and add them to the summary and history csvs (as
+        the ``time_*`` and ``peak_memory_*`` columns).
+    window_backend : {'dense', 'sparse', 'chunked'}, optional
+        How to store the pooling windows. 'sparse' uses much less memory
+        for small scaling values, but then we can't plot the windows on
+        the windowed images in the summary plots. 'chunked' bounds the
+        peak memory of pooling, at some cost in speed. See
+        ``plenoptic.simul.PooledVentralStream`` for details.
+    window_memory_budget : float or None, optional
+        If ``window_backend='chunked'``, the memory (in GB) to use for
+        each chunk of windows. Use this to fit synthesis on a machine
+        with less memory.
+    gradient_checkpointing : bool, optional
+        If True, the V1 model recomputes its steerable pyramid during the
+        backward pass instead of storing it. This greatly reduces the
+        memory needed for synthesis, at some cost in speed. Only
+        supported for the V1 models.
+    representation_cache_dir : str or None, optional
+        If set, the directory to cache the representation of the
+        reference image in (shared with all other runs using the same
+        image and model), so it's only computed once.
+    window_dtype : {None, 'float32', 'float16', 'bfloat16'}, optional
+        If not None, the dtype to store the pooling windows in. Use
+        'float16' or 'bfloat16' to halve the memory used by the windows,
+        at a small cost in accuracy.
+    resolution_levels : list or None, optional
+        If not None, the factors to downsample the reference image by
+        for multi-resolution synthesis, from coarsest to finest (see
+        above). If None, we synthesize at full resolution only.
+    level_max_iter, level_loss_thresh, level_loss_change_iter : int, float, int, list, or None, optional
+        The maximum number of iterations, loss_thresh, and
+        loss_change_iter to use at each resolution level (a list with
+        one value per level, or a single value for all of them). If
+        None, we use the values of max_iter, loss_thresh, and
+        loss_change_iter.
+    window_fraction : float, optional
+        The fraction of the pooling windows to use on each iteration of
+        synthesis (a new random subset each iteration), doubling every
+        time the loss stops decreasing until we use all of them, which
+        makes the early iterations cheaper. See
+        ``plenoptic_part.Metamer.synthesize``. Can't be used with
+        ``fraction_removed`` or ``loss_change_fraction``.
+    precondition : bool or float, optional
+        Whether to rescale the gradient at each pixel by how large the
+        windows it belongs to are (and, if a float, the power to raise
+        that rescaling to), so the periphery converges about as quickly
+        as the center. Used at every resolution level as well. See
+        ``plenoptic_part.Metamer.synthesize``.
 
     """
     print("Using seed %s" % seed)
+    if isinstance(seed, (list, tuple)):
+        seeds = list(seed)
+        if not isinstance(save_path, (list, tuple)) or len(save_path) != len(seeds):
+            raise Exception("If seed is a list, save_path must be a list of the same length!")
+        save_paths = list(save_path)
+        save_path = save_paths[0]
+    else:
+        seeds = [seed]
+        save_paths = [save_path]
     if num_threads is not None:
         print(f"Using {num_threads} threads")
         torch.set_num_threads(num_threads)
     else:
         print("Not restricting number of threads, will probably use max "
               f"available ({torch.get_num_threads()})")
-    torch.manual_seed(seed)
-    np.random.seed(seed)
+    torch.manual_seed(seeds[0])
+    np.random.seed(seeds[0])
     image_name = image
     image = setup_image(image)
     # this will be false if normalize_dict is None or an empty list
@@ -1014,9 +1428,44 @@ def main(model_name, scaling, image, seed=0, min_ecc=.5, max_ecc=15, learning_ra
         normalize_dict = torch.load(normalize_dict)
     model, animate_figsize, rep_figsize, img_zoom = setup_model(model_name, scaling, image,
                                                                 min_ecc, max_ecc, cache_dir,
-                                                                normalize_dict)
+                                                                normalize_dict, window_backend,
+                                                                window_memory_budget,
+                                                                gradient_checkpointing,
+                                                                representation_cache_dir,
+                                                                window_dtype)
     print("Using model %s from %.02f degrees to %.02f degrees" % (model_name, min_ecc, max_ecc))
-    initial_image = setup_initial_image(initial_image_type, model, image)
+    # where each seed's initial image comes from, which only differ when
+    # we're warm-starting from the metamers at other scaling values
+    initial_image_types = [initial_image_type] * len(seeds)
+    warm_starts = [{}] * len(seeds)
+    if initial_image_type == 'nearest-scaling':
+        if resolution_levels:
+            raise Exception("Can't use initial_image_type='nearest-scaling' with "
+                            "resolution_levels!")
+        for i, p in enumerate(save_paths):
+            if p is None:
+                raise Exception("save_path must be set if initial_image_type='nearest-scaling'!")
+            warm_start_path, warm_start_scaling = find_nearest_scaling_metamer(p, scaling)
+            if warm_start_path is None:
+                warnings.warn("Unable to find a finished metamer at another scaling value for "
+                              f"{p}, using white noise as initial image!")
+                initial_image_types[i] = 'white'
+            else:
+                print(f"Warm-starting from metamer with scaling {warm_start_scaling}")
+                initial_image_types[i] = warm_start_path
+            warm_starts[i] = {'warm_start_path': warm_start_path,
+                              'warm_start_scaling': warm_start_scaling}
+    if len(seeds) == 1:
+        initial_image = setup_initial_image(initial_image_types[0], model, image)
+    else:
+        # generate each initial image with its own seed, so they're the
+        # same as if we'd synthesized them separately
+        initial_image = []
+        for s, init_type in zip(seeds, initial_image_types):
+            torch.manual_seed(s)
+            np.random.seed(s)
+            initial_image.append(setup_initial_image(init_type, model, image))
+        initial_image = torch.nn.Parameter(torch.cat(initial_image))
     image, initial_image, model = setup_device(image, initial_image, model, gpu_id=gpu_id)
     if clamper_name == 'clamp':
         clamper = pop.clamps.RangeClamper((0, 1))
@@ -1076,8 +1525,15 @@ def main(model_name, scaling, image, seed=0, min_ecc=.5, max_ecc=15, learning_ra
         store_progress = max(10, max_iter//100)
     if save_path is not None:
         inprogress_path = save_path.replace('.pt', '_inprogress.pt')
+        # the stored history of the in-progress synthesis lives here, so
+        # saving progress only has to write the new iterations
+        history_dir = inprogress_path.replace('.pt', '_history')
     else:
         inprogress_path = None
+        history_dir = None
+    # the time spent at each resolution level, if we do multi-resolution
+    # synthesis
+    level_summary = {}
     if continue_path is not None or (inprogress_path is not None and op.exists(inprogress_path)):
         if op.exists(inprogress_path):
             continue_path = inprogress_path
@@ -1095,6 +1551,29 @@ def main(model_name, scaling, image, seed=0, min_ecc=.5, max_ecc=15, learning_ra
     else:
         metamer = pop.Metamer(image, model, loss_function=loss,
                               loss_function_kwargs=loss_kwargs)
+        if resolution_levels:
+            model_kwargs = {'window_backend': window_backend,
+                            'window_memory_budget': window_memory_budget,
+                            'gradient_checkpointing': gradient_checkpointing,
+                            'representation_cache_dir': representation_cache_dir,
+                            'window_dtype': window_dtype}
+            initial_image, level_summary = multiresolution_initial_image(
+                model_name, scaling, image, resolution_levels, min_ecc, max_ecc, cache_dir,
+                normalize_dict, seed=seed if len(seeds) > 1 else seeds[0],
+                initial_image_type=initial_image_type,
+                max_iter=level_max_iter if level_max_iter is not None else max_iter,
+                loss_thresh=level_loss_thresh if level_loss_thresh is not None else loss_thresh,
+                loss_change_iter=(level_loss_change_iter if level_loss_change_iter is not None
+                                  else loss_change_iter),
+                gpu_id=gpu_id, model_kwargs=model_kwargs, loss_function=loss,
+                loss_function_kwargs=loss_kwargs, learning_rate=learning_rate,
+                clamper=clamper, clamp_each_iter=clamp_each_iter, optimizer=optimizer, swa=swa,
+                swa_kwargs=swa_kwargs, fraction_removed=fraction_removed,
+                loss_change_fraction=loss_change_fraction,
+                loss_change_thresh=loss_change_thresh, coarse_to_fine=coarse_to_fine,
+                precondition=precondition)
+            initial_image = add_center_to_image(model, initial_image.to(image.device), image)
+            initial_image = torch.nn.Parameter(initial_image)
     print(f"Using learning rate {learning_rate}, loss_thresh {loss_thresh} (loss_change_iter "
           f"{loss_change_iter}), and max_iter {max_iter}")
     if save_path is not None:
@@ -1116,7 +1595,7 @@ def main(model_name, scaling, image, seed=0, min_ecc=.5, max_ecc=15, learning_ra
                                                  max_iter=max_iter,
                                                  loss_thresh=loss_thresh,
                                                  loss_change_iter=loss_change_iter,
-                                                 seed=seed,
+                                                 seed=seed if len(seeds) > 1 else seeds[0],
                                                  initial_image=initial_image,
                                                  clamp_each_iter=clamp_each_iter,
                                                  save_progress=save_progress,
@@ -1126,11 +1605,22 @@ def main(model_name, scaling, image, seed=0, min_ecc=.5, max_ecc=15, learning_ra
                                                  loss_change_fraction=loss_change_fraction,
                                                  loss_change_thresh=loss_change_thresh,
                                                  coarse_to_fine=coarse_to_fine,
-                                                 save_path=inprogress_path)
+                                                 save_path=inprogress_path,
+                                                 history_dir=history_dir,
+                                                 save_progress_async=True,
+                                                 profile=profile,
+                                                 window_fraction=window_fraction,
+                                                 precondition=precondition)
     duration = time.time() - start_time
     # make sure everything's on the cpu for saving
     metamer = metamer.to('cpu')
-    if save_path is not None:
+    if len(seeds) > 1:
+        metamers = metamer.split_batch()
+    else:
+        metamers = [metamer]
+    for seed, metamer, save_path, warm_start in zip(seeds, metamers, save_paths, warm_starts):
+        if save_path is None:
+            continue
         summarize(metamer, save_path.replace('.pt', '_summary.csv'),
                   duration_human_readable=convert_seconds_to_str(duration), duration=duration,
                   optimizer=optimizer, fraction_removed=fraction_removed, model=model_name,
@@ -1141,7 +1631,8 @@ def main(model_name, scaling, image, seed=0, min_ecc=.5, max_ecc=15, learning_ra
                   loss_thresh=loss_thresh, scaling=scaling, clamper=clamper_name,
                   clamp_each_iter=clamp_each_iter, loss_change_iter=loss_change_iter,
                   image_name=op.basename(image_name).replace('.pgm', '').replace('.png', ''),
-                  loss_function=loss_func)
+                  loss_function=loss_func, window_fraction=window_fraction,
+                  precondition=precondition, **level_summary, **warm_start)
         summarize_history(metamer, save_path.replace('.pt', '_history.csv'),
                           duration_human_readable=convert_seconds_to_str(duration), duration=duration,
                           optimizer=optimizer, fraction_removed=fraction_removed, model=model_name,
@@ -1155,3 +1646,5 @@ def main(model_name, scaling, image, seed=0, min_ecc=.5, max_ecc=15, learning_ra
         save(save_path, metamer, animate_figsize, rep_figsize, img_zoom, save_all)
     if save_progress and op.exists(inprogress_path):
         os.remove(inprogress_path)
+    if history_dir is not None and op.exists(history_dir):
+        shutil.rmtree(history_dir)
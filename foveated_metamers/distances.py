@@ -81,6 +81,22 @@ def _grab_seed_n(x):
         return x
 
 
+def _distance_df(rep_1, rep_2, image_1, image_2, distance_func):
+    """compute the distance between two representations and put it in a DataFrame
+
+    if the representations are dictionaries (from a model with several scaling
+    values, like pop.PooledV1Sweep), we get one row per scaling value, with the
+    scaling in the distance_scaling column
+    """
+    if isinstance(rep_1, dict):
+        return pd.DataFrame({'distance': [distance_func(rep_1[sc], rep_2[sc]).item()
+                                          for sc in rep_1.keys()],
+                             'distance_scaling': list(rep_1.keys()),
+                             'image_1': image_1, 'image_2': image_2})
+    return pd.DataFrame({'distance': distance_func(rep_1, rep_2).item(), 'image_1': image_1,
+                         'image_2': image_2}, index=[0])
+
+
 def model_distance(model, synth_model_name, ref_image_name, scaling,
                    distance_func=pop.optim.l2_norm):
     """Calculate distances between images for a model.
@@ -107,7 +123,11 @@ def model_distance(model, synth_model_name, ref_image_name, scaling,
     ----------
     model : po.synth model
         Instantiated model, which takes image tensor as input and returns some
-        output.
+        output. If it returns a dictionary, its keys should be scaling values
+        and its values the output of the model at that scaling (as with
+        ``pop.PooledV1Sweep``): then we compute the distances at all those
+        scaling values at once, while only computing the steerable pyramid
+        once per image.
     synth_model_name : str
         str defining the name of the model used to synthesize the images we're
         checking (e.g., "V1_norm_s6_gaussian").
@@ -127,6 +147,8 @@ def model_distance(model, synth_model_name, ref_image_name, scaling,
     df : pd.DataFrame
         DataFrame containing the distances. Contains column identifying the
         synthesis model and scaling, but not the distance model and scaling
+        (unless model returns a dictionary, in which case the
+        ``distance_scaling`` column gives the scaling value)
 
     """
     paths = utils.generate_metamer_paths(synth_model_name,
@@ -159,9 +181,8 @@ def model_distance(model, synth_model_name, ref_image_name, scaling,
     for i, (im, p) in enumerate(zip(synth_images.unsqueeze(1), paths)):
         image_name = op.splitext(op.basename(p))[0]
         reps[image_name] = model(im)
-        dist = distance_func(reps[image_name], ref_image_rep).item()
-        df.append(pd.DataFrame({'distance': dist, 'image_1': image_name,
-                                'image_2': ref_image_name}, index=[0]))
+        df.append(_distance_df(reps[image_name], ref_image_rep, image_name, ref_image_name,
+                               distance_func))
     rep_keys = list(reps.keys())
     if len(rep_keys) != 3 and len(rep_keys) != 6:
         raise Exception("We need either 3 (all init-white) or 6 (init-white"
@@ -176,9 +197,7 @@ def model_distance(model, synth_model_name, ref_image_name, scaling,
                             # (rep_keys[5], rep_keys[3])]
     met_comparisons = itertools.combinations(rep_keys, 2)
     for im_1, im_2 in met_comparisons:
-        dist = distance_func(reps[im_1], reps[im_2]).item()
-        df.append(pd.DataFrame({'distance': dist, 'image_1': im_1,
-                                'image_2': im_2}, index=[0]))
+        df.append(_distance_df(reps[im_1], reps[im_2], im_1, im_2, distance_func))
     df = pd.concat(df).reset_index(drop=True)
     df['synthesis_model'] = synth_model_name
     df['synthesis_scaling'] = scaling
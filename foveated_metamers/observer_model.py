@@ -9,6 +9,7 @@ streamlining it. We then added on extra bells and whistles in order to improve
 the predictive ability of the observer model.
 
 """
+import copy
 import torch
 import warnings
 import pyrtools as pt
@@ -16,6 +17,7 @@ import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 from torch import nn
+from torch.utils.checkpoint import checkpoint
 import plenoptic as po
 import sys
 import os.path as op
@@ -27,6 +29,13 @@ from pooling import PoolingWindows
 sys.path.append(op.join(op.dirname(op.realpath(__file__)), '..',
                         'extra-packages', 'plenoptic_part'))
 from plenoptic_part.tools.display import clean_up_axes, update_stem, clean_stem_plot
+from plenoptic_part.tools.profiling import profile_phase
+from plenoptic_part.simulate.pooling_backends import setup_windows
+from plenoptic_part.simulate.window_cache import get_windows
+from plenoptic_part.simulate.representation_cache import cached_forward
+from plenoptic_part.simulate.model_registry import model_registry
+from plenoptic_part.simulate.window_metadata import (window_metadata, summarize_window_sizes,
+                                                     plot_window_widths, plot_window_areas)
 
 
 class ObserverModel(nn.Module):
@@ -85,11 +94,39 @@ class ObserverModel(nn.Module):
         The directory to cache the windows tensor in. If set, we'll look
         there for cached versions of the windows we create, load them if
         they exist and create and cache them if they don't. If None, we
-        don't check for or cache the windows.
+        don't check for or cache the windows. We also write a
+        memory-mapped copy of the windows there, which all processes
+        using the same windows share (see
+        ``plenoptic_part.simulate.window_cache``).
     sf_weighting_{slope,intercept,sigma,amplitude,mean_lum} : float, optional
         Initial values for parameters for reweighting different scales across
         eccentricities. Default parameters are equivalent to weighting all
         equally everywhere (probably).
+    window_backend : {'dense', 'sparse', 'chunked'}, optional
+        How to store the pooling windows. If 'dense', we use the
+        ``PoolingWindows`` object as is. If 'sparse', we store each
+        window (the product of an angle and an eccentricity window)
+        as a sparse matrix, dropping negligible values, which uses much
+        less memory for small scaling values (see
+        ``plenoptic_part.simulate.pooling_backends.SparsePoolingWindows``).
+        Pooled values match the dense backend up to floating point error.
+        If 'chunked', we pool with a chunk of windows at a time, which
+        bounds the peak memory of pooling at some cost in speed (see
+        ``ChunkedPoolingWindows`` in the same module).
+    window_memory_budget : float or None, optional
+        If ``window_backend='chunked'``, the memory (in GB) to use for
+        each chunk of windows. If None, we use the default (1 GB).
+    gradient_checkpointing : bool, optional
+        If True, forward doesn't keep the steerable pyramid coefficients
+        around for the backward pass, but recomputes them, one scale at
+        a time, during it. This reduces the memory needed when
+        computing gradients (for synthesis or fitting), at the cost of
+        running the pyramid twice.
+    window_dtype : {None, 'float32', 'float16', 'bfloat16'}, optional
+        If not None, the dtype to store the pooling windows in,
+        regardless of the dtype the model is cast to. 'float16' and
+        'bfloat16' halve the windows' memory; pooling is still computed
+        in the dtype of the input.
 
     Attributes
     ----------
@@ -183,6 +220,11 @@ class ObserverModel(nn.Module):
     cache_dir : str or None
         If str, this is the directory where we cached / looked for
         cached windows tensors
+    window_backend : str
+        How the pooling windows are stored, 'dense', 'sparse', or 'chunked'
+    gradient_checkpointing : bool
+        Whether to recompute the pyramid during the backward pass
+        instead of storing it
     cache_paths : list
         List of strings, one per scale, that we either saved or loaded
         the cached windows tensors from
@@ -199,6 +241,13 @@ class ObserverModel(nn.Module):
     sf_weighting_{slope,intercept,sigma,amplitude,mean_lum} : torch.nn.Parameter
         Parameters for reweighting different spatial frequencies across
         eccentricities.
+    representation_cache : RepresentationCache or None
+        If set, the on-disk cache forward uses (inside a
+        ``use_representation_cache()`` block) for the representations
+        of images it doesn't need gradients for (see
+        ``plenoptic_part.simulate.representation_cache``). Since these
+        parameters are part of the cache key, we never use it while
+        fitting them.
 
     """
 
@@ -207,15 +256,19 @@ class ObserverModel(nn.Module):
                  normalize_dict={}, cache_dir=None,
                  sf_weighting_slope=0, sf_weighting_intercept=1,
                  sf_weighting_sigma=1e10, sf_weighting_amplitude=1,
-                 sf_weighting_mean_lum=1):
+                 sf_weighting_mean_lum=1, window_backend='dense',
+                 window_memory_budget=None, gradient_checkpointing=False,
+                 window_dtype=None):
         super().__init__()
-        self.PoolingWindows = PoolingWindows(scaling, img_res,
-                                             min_eccentricity,
-                                             max_eccentricity,
-                                             num_scales=num_scales,
-                                             cache_dir=cache_dir,
-                                             window_type='gaussian',
-                                             std_dev=1)
+        # attach to the memory-mapped cache in cache_dir, if it exists, so
+        # processes using the same windows can share them
+        self.PoolingWindows = get_windows(PoolingWindows, scaling, img_res,
+                                          min_eccentricity,
+                                          max_eccentricity,
+                                          num_scales=num_scales,
+                                          cache_dir=cache_dir,
+                                          window_type='gaussian',
+                                          std_dev=1)
         for attr in ['n_polar_windows', 'n_eccentricity_bands', 'scaling',
                      'state_dict_reduced', 'window_width_pixels',
                      'window_width_degrees', 'min_eccentricity',
@@ -230,6 +283,14 @@ class ObserverModel(nn.Module):
         # initialize ObserverModel
         for k in ['transition_region_width', 'window_type', 'std_dev']:
             self.state_dict_reduced.pop(k)
+        self.state_dict_reduced['window_backend'] = window_backend
+        self.state_dict_reduced['window_memory_budget'] = window_memory_budget
+        self.state_dict_reduced['gradient_checkpointing'] = gradient_checkpointing
+        self.state_dict_reduced['window_dtype'] = window_dtype
+        self.gradient_checkpointing = gradient_checkpointing
+        self.PoolingWindows = setup_windows(self.PoolingWindows, window_backend,
+                                            window_memory_budget, window_dtype)
+        self.window_backend = window_backend
         # just store the mean and std, which is all we need for normalization
         self.normalize_dict = {}
         # check if this is the "raw" normalize_dict, as used by the
@@ -282,7 +343,26 @@ class ObserverModel(nn.Module):
                 raise Exception(f"Parameter sf_weighting_{param} must be "
                                 "initialized with a non-negative value!")
             setattr(self, f'sf_weighting_{param}', torch.nn.Parameter(p))
+        # set by the synthesis object, if profiling
+        self._profiler = None
+        self.representation_cache = None
+        self._window_metadata = None
 
+    @property
+    def window_metadata(self):
+        r"""Table describing the location and size of each window.
+
+        pandas DataFrame with one row per window per scale, in the same
+        order as the representation, computed analytically from the
+        window parameters (see
+        ``plenoptic_part.simulate.window_metadata.window_metadata``).
+
+        """
+        if self._window_metadata is None:
+            self._window_metadata = window_metadata(self)
+        return self._window_metadata
+
+    @cached_forward
     def forward(self, image, scales=[]):
         r"""Generate the V1 representation of an image.
 
@@ -314,28 +394,76 @@ class ObserverModel(nn.Module):
         if not scales:
             scales = self.scales
         representation = {}
-        if any([i in self.complex_steerable_pyramid.scales for i in scales]):
+        profiler = getattr(self, '_profiler', None)
+        use_pyramid = any([i in self.complex_steerable_pyramid.scales for i in scales])
+        if use_pyramid:
             sf_weight = self._sf_weighting()
+        if (use_pyramid and self.gradient_checkpointing and torch.is_grad_enabled() and
+                (image.requires_grad or sf_weight.requires_grad)):
+            # then the pyramid coefficients are recomputed, one scale at a
+            # time, during the backward pass, so we only hold onto the
+            # pooled values
+            with profile_phase(profiler, 'pyramid'):
+                # go through them in the same order as the pyramid does
+                for scale in [i for i in range(self.num_scales) if i in scales]:
+                    pooled = checkpoint(self._pooled_scale, image, scale, sf_weight)
+                    representation.update({(scale, i): p for i, p in enumerate(pooled)})
+        elif use_pyramid:
             # because self.scales never includes residual_highpass and
             # residual_lowpass, we never have the residuals in pyr_coeffs.
-            pyr_coeffs = self.complex_steerable_pyramid(image, scales)
-            # to get the energy, we just square and take the absolute value
-            # (since this is a complex tensor, this is equivalent to summing
-            # across the real and imaginary components).
-            pyr_coeffs = {k: v.pow(2).abs() for k, v in pyr_coeffs.items()}
+            with profile_phase(profiler, 'pyramid'):
+                pyr_coeffs = self.complex_steerable_pyramid(image, scales)
+                # to get the energy, we just square and take the absolute value
+                # (since this is a complex tensor, this is equivalent to summing
+                # across the real and imaginary components).
+                pyr_coeffs = {k: v.pow(2).abs() for k, v in pyr_coeffs.items()}
             # normalize before pooling
-            for k, (mn, std) in self.normalize_dict.items():
-                if k in pyr_coeffs:
-                    pyr_coeffs[k] = (pyr_coeffs[k] - mn) / std
-            representation = self.PoolingWindows(pyr_coeffs, weights=sf_weight)
+            with profile_phase(profiler, 'normalize'):
+                for k, (mn, std) in self.normalize_dict.items():
+                    if k in pyr_coeffs:
+                        pyr_coeffs[k] = (pyr_coeffs[k] - mn) / std
+            with profile_phase(profiler, 'pooling'):
+                representation = self.PoolingWindows(pyr_coeffs, weights=sf_weight)
         if 'mean_luminance' in scales:
             # normalize before pooling
             if 'mean_luminance' in self.normalize_dict:
                 mn, std = self.normalize_dict['mean_luminance']
                 image = (image - mn) / std
-            representation['mean_luminance'] = self.sf_weighting_mean_lum * self.PoolingWindows(image)
+            with profile_phase(profiler, 'pooling'):
+                representation['mean_luminance'] = self.sf_weighting_mean_lum * self.PoolingWindows(image)
         return torch.cat(list(representation.values()), dim=-1)
 
+    def _pooled_scale(self, image, scale, sf_weight):
+        r"""Compute the pooled, weighted complex cell responses at a single scale
+
+        This is what forward does for each scale, from the image to the
+        pooled responses, in a single function so it can be
+        checkpointed, see ``gradient_checkpointing``.
+
+        Parameters
+        ----------
+        image : torch.Tensor
+            The 4d image to analyze
+        scale : int
+            The scale of the pyramid to compute
+        sf_weight : torch.Tensor
+            The output of ``self._sf_weighting()``
+
+        Returns
+        -------
+        pooled : tuple
+            Tuple of 3d tensors, the pooled responses for each
+            orientation at this scale
+
+        """
+        pyr_coeffs = self.complex_steerable_pyramid(image, [scale])
+        pyr_coeffs = {k: v.pow(2).abs() for k, v in pyr_coeffs.items()}
+        for k, (mn, std) in self.normalize_dict.items():
+            if k in pyr_coeffs:
+                pyr_coeffs[k] = (pyr_coeffs[k] - mn) / std
+        pooled = self.PoolingWindows(pyr_coeffs, weights=sf_weight)
+        return tuple(pooled[(scale, i)] for i in range(self.order+1))
+
     def _sf_weighting(self):
         """Get weights based on sf_weighting.
 
@@ -430,15 +558,17 @@ class ObserverModel(nn.Module):
             correspond to that angular region
 
         """
+        if n_angles == 4:
+            metadata = self.window_metadata
+        else:
+            metadata = window_metadata(self, n_angles)
+        # the windows have the same layout at every scale
+        regions = torch.from_numpy(metadata[metadata.scale == 0].region.values)
+        regions = regions.to(self.PoolingWindows.angle_windows[0].device)
         masks = {}
         for i in range(self.num_scales):
-            ecc = torch.ones_like(self.PoolingWindows.ecc_windows[0], dtype=int)
-            angles = torch.zeros_like(self.PoolingWindows.angle_windows[0], dtype=int)
             for j in range(n_angles):
-                angles[j*angles.shape[0]//4:(j+1)*angles.shape[0]//4] = j
-            windows = torch.einsum('ahw,ehw->ea', angles, ecc)
-            for j, val in enumerate(sorted(windows.unique())):
-                masks[(i, f'region_{j}')] = (windows == val).flatten()
+                masks[(i, f'region_{j}')] = regions == j
         return masks
 
     def to(self, *args, do_windows=True, **kwargs):
@@ -548,10 +678,13 @@ class ObserverModel(nn.Module):
         -------
         sizes : dict
             dictionary with the keys described above, summarizing window
-            sizes. all values are scalar floats
+            sizes (``{min,max}_window_{center,fwhm,area}_degrees`` and
+            ``{min,max}_window_{center,fwhm,area}_pixels_scale_{i}``).
+            all values are scalar floats
 
         """
-        return self.PoolingWindows.summarize_window_sizes()
+        return summarize_window_sizes(self.window_metadata, self.min_eccentricity,
+                                      self.max_eccentricity)
 
     def plot_window_widths(self, units='degrees', figsize=(5, 5), jitter=.25):
         r"""Plot the widths of the windows, in degrees or pixels.
@@ -585,15 +718,10 @@ class ObserverModel(nn.Module):
             The figure containing the plot
 
         """
-        fig = self.PoolingWindows.plot_window_widths(units, 0, figsize, jitter)
         # since ObserverModel always uses Gaussian windows, the top width is
-        # always 0 and so we remove it.
-        for c in fig.axes[0].containers:
-            if 'top' in c.get_label():
-                c.remove()
-        # recreate the legend
-        fig.axes[0].legend(loc='upper left')
-        return fig
+        # always 0 and so we don't plot it.
+        return plot_window_widths(self.window_metadata, units, 0, figsize, jitter,
+                                  width_types=['half', 'full'])
 
     def plot_window_areas(self, units='degrees', figsize=(5, 5)):
         r"""Plot the approximate areas of the windows, in degrees or pixels.
@@ -627,15 +755,10 @@ class ObserverModel(nn.Module):
             The figure containing the plot
 
         """
-        fig = self.PoolingWindows.plot_window_areas(units, 0, figsize)
         # since ObserverModel always uses Gaussian windows, the top area is
-        # always 0 and so we remove it.
-        for c in fig.axes[0].containers:
-            if c.get_label() == 'top':
-                c.remove()
-        # recreate the legend
-        fig.axes[0].legend(loc='upper left')
-        return fig
+        # always 0 and so we don't plot it.
+        return plot_window_areas(self.window_metadata, units, 0, figsize,
+                                 area_types=['half', 'full'])
 
     def save_reduced(self, file_path):
         r"""Save the relevant parameters to make saving/loading more efficient.
@@ -654,26 +777,48 @@ class ObserverModel(nn.Module):
         torch.save(self.state_dict_reduced, file_path)
 
     @classmethod
-    def load_reduced(cls, file_path):
+    def load_reduced(cls, file_path, shared=True):
         r"""Load from the dictionary saved by ``save_reduced``.
 
         Parameters
         ----------
         file_path : str
             The path to load the model object from
+        shared : bool, optional
+            Whether to return the shared instance of the model, see
+            ``from_state_dict_reduced``.
         """
         state_dict_reduced = torch.load(file_path)
-        return cls.from_state_dict_reduced(state_dict_reduced)
+        return cls.from_state_dict_reduced(state_dict_reduced, shared)
 
     @classmethod
-    def from_state_dict_reduced(cls, state_dict_reduced):
+    def from_state_dict_reduced(cls, state_dict_reduced, shared=True):
         r"""Initialize model from ``state_dict_reduced``.
 
+        We only initialize each model once per process: models are
+        held in ``plenoptic_part.simulate.model_registry.model_registry``
+        (keyed by ``state_dict_reduced``), so loading many metamers
+        synthesized with the same model only creates its windows once.
+
         Parameters
         ----------
         state_dict_reduced : dict
             The reduced state dict to load
+        shared : bool, optional
+            If True, we return the instance of the model shared with
+            everything else that loaded this ``state_dict_reduced``, so
+            anything done to it (e.g., calling ``to()``) affects them as
+            well. If False, we return a deep copy of it, which can be
+            safely modified.
         """
+        model = model_registry.get(state_dict_reduced, cls._init_from_state_dict_reduced)
+        if not shared:
+            model = copy.deepcopy(model)
+        return model
+
+    @classmethod
+    def _init_from_state_dict_reduced(cls, state_dict_reduced):
+        """initialize a new model from state_dict_reduced, see from_state_dict_reduced"""
         state_dict_reduced = state_dict_reduced.copy()
         model_name = state_dict_reduced.pop('model_name')
         # want to remove class if it's here
@@ -744,11 +889,9 @@ class ObserverModel(nn.Module):
             False, will just have a single value per key in
             representation. If True, keys will be (k, 'region_{i}'),
             where goes from 0 to 3 and represents quadrants, starting
-            from bottom right. Note that, if this is the first time
-            doing this, we'll need to create spatial masks to do this,
-            which will massively increase the amount of memory used
-            (because we create copies of the PoolingWindows at the
-            coarsest scale to do so).
+            from bottom right. The regions come from
+            ``self.window_metadata``, so this doesn't need the windows
+            themselves.
 
         Returns
         -------
@@ -240,6 +240,130 @@ def find_attempts(wildcards, increment=False, extra_iter=None, gpu_split=.09):
     return start + op.join(*p.split('/'))
 
 
+def _template_regex(template, patterns={}):
+    """regex matching paths created from template, with one named group per format key
+
+    patterns gives the regex to use for specific keys, the rest match
+    anything without a slash (except DATA_DIR, which can match anything)
+    """
+    regex = ''
+    last = 0
+    for m in re.finditer(r'{([A-Za-z_]+?)(:[A-Za-z\d\.]+)?}', template):
+        key = m.group(1)
+        pattern = patterns.get(key, '.*?' if key == 'DATA_DIR' else '[^/]*?')
+        regex += re.escape(template[last:m.start()]) + f'(?P<{key}>{pattern})'
+        last = m.end()
+    return regex + re.escape(template[last:])
+
+
+def find_nearest_scaling_metamer(metamer_path, scaling=None):
+    """Find the finished metamer with the nearest scaling value
+
+    Synthesis at one scaling value can be initialized with a finished
+    metamer at a nearby scaling value (see
+    ``create_metamers.setup_initial_image``). Here, we look for finished
+    metamers (those whose ``_metamer.npy`` file exists) that are
+    identical to the one at ``metamer_path`` (same model, image, seed,
+    optimization arguments, etc., as given by METAMER_TEMPLATE_PATH in
+    config.yml) except for their scaling value, initial image, and
+    whether they were synthesized on the GPU (which depends on scaling,
+    see ``find_attempts``), and return the one whose scaling is closest to ``scaling`` (on a log
+    scale; ties go to the smaller scaling value, whose metamer is also
+    approximately a metamer for larger ones).
+
+    Parameters
+    ----------
+    metamer_path : str
+        Path to any of the outputs (e.g., the ``.pt`` file or the
+        ``_metamer.png`` image) of the metamer we're synthesizing, as
+        created from METAMER_TEMPLATE_PATH.
+    scaling : float or None, optional
+        The scaling value of that metamer. If None, we grab it from
+        ``metamer_path``.
+
+    Returns
+    -------
+    path : str or None
+        Path to the ``_metamer.npy`` file of the nearest-scaling
+        finished metamer, or None if there isn't one.
+    nearest_scaling : float or None
+        The scaling value of that metamer, or None if there isn't one.
+
+    """
+    with open(op.join(op.dirname(op.realpath(__file__)), '..', 'config.yml')) as f:
+        defaults = yaml.safe_load(f)
+    # the outputs all share this prefix, and only differ in what comes
+    # after it
+    template = defaults['METAMER_TEMPLATE_PATH'].replace('_metamer.png', '')
+    # outputs are named by appending something like '.pt' or
+    # '_metamer.npy' to the template, so the suffix must start with a
+    # period or underscore
+    regex = re.compile(_template_regex(template, {'save_all': '(?:_saveall)?'}) +
+                       r'(?P<suffix>[\._].*)')
+    match = regex.fullmatch(metamer_path)
+    if match is None:
+        raise Exception(f"{metamer_path} doesn't match METAMER_TEMPLATE_PATH, so can't find "
+                        "its neighbors!")
+    if scaling is None:
+        scaling = float(match.group('scaling'))
+    glob_path = metamer_path[:match.start('suffix')]
+    ignore = ['scaling', 'init_type', 'gpu']
+    # replace the fields we ignore with wildcards, going backwards so the
+    # indices stay valid
+    for k in sorted(ignore, key=lambda k: match.start(k), reverse=True):
+        glob_path = glob_path[:match.start(k)] + '*' + glob_path[match.end(k):]
+    candidates = []
+    for p in glob(glob_path + '_metamer.npy'):
+        m = regex.fullmatch(p)
+        if m is None or any([m.group(k) != match.group(k) for k in regex.groupindex
+                             if k not in ignore + ['suffix']]):
+            continue
+        try:
+            sc = float(m.group('scaling'))
+        except ValueError:
+            continue
+        if not np.isclose(sc, scaling):
+            candidates.append((abs(np.log(sc / scaling)), sc, p))
+    if not candidates:
+        return None, None
+    _, nearest_scaling, path = min(candidates)
+    return path, nearest_scaling
+
+
+def warm_start_scaling(scaling, scaling_ladder):
+    """Get the scaling value whose metamer should warm-start synthesis at scaling
+
+    When synthesizing a ladder of scaling values with
+    ``init_type='nearest-scaling'``, we synthesize them from the smallest
+    scaling up: each one starts from the finished metamer at the
+    next-smallest scaling value. The Snakefile uses this to make that
+    metamer an input of this one, so it's always finished first (and so
+    is what ``find_nearest_scaling_metamer`` finds, unless a closer
+    one already exists).
+
+    Parameters
+    ----------
+    scaling : float
+        The scaling value we're synthesizing
+    scaling_ladder : list
+        All the scaling values we're synthesizing (e.g., the ``scaling``
+        and ``met_v_met_scaling`` values for the model from config.yml)
+
+    Returns
+    -------
+    previous_scaling : float or None
+        The largest value in ``scaling_ladder`` that's smaller than
+        ``scaling``, or None if there isn't one (i.e., ``scaling`` is the
+        bottom of the ladder, so synthesis starts from noise).
+
+    """
+    smaller = [float(sc) for sc in scaling_ladder
+               if float(sc) < scaling and not np.isclose(float(sc), scaling)]
+    if not smaller:
+        return None
+    return max(smaller)
+
+
 def get_ref_image_full_path(image_name,
                             preproc_methods=['full', 'gamma-corrected',
                                              'range', 'degamma',
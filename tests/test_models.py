@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
+import os
 import os.path as op
 import sys
 import torch
 import matplotlib.pyplot as plt
 import pytest
+import yaml
 import plenoptic as po
 import numpy as np
 sys.path.append(op.join(op.dirname(op.realpath(__file__)), '..',
@@ -106,6 +108,405 @@ class TestPooledVentralStream(object):
         metamer.synthesize(max_iter=3)
         assert not torch.isnan(metamer.synthesized_signal).any(), "There's a NaN here!"
 
+    def test_rgc_metamer_batch(self, img):
+        rgc = pop.PooledRGC(.5, img.shape[2:])
+        metamer = pop.Metamer(img, rgc)
+        metamer.synthesize(max_iter=3, seed=[0, 1], store_progress=1)
+        assert metamer.synthesized_signal.shape[0] == 2
+        assert len(metamer.batch_loss) == len(metamer.loss)
+        assert np.allclose(np.sum(metamer.batch_loss, 1), metamer.loss)
+        metamers = metamer.split_batch()
+        assert len(metamers) == 2
+        for i, met in enumerate(metamers):
+            assert met.seed == i
+            assert met.synthesized_signal.shape == img.shape
+            assert met.saved_signal.shape[0] == len(met.loss) + 1
+            assert met.loss == [l[i] for l in metamer.batch_loss]
+
+    def test_rgc_metamer_history(self, img, tmp_path):
+        rgc = pop.PooledRGC(.5, img.shape[2:])
+        metamer = pop.Metamer(img, rgc)
+        save_path = op.join(tmp_path, 'test_rgc_metamer_history.pt')
+        history_dir = op.join(tmp_path, 'test_rgc_metamer_history')
+        metamer.synthesize(max_iter=4, store_progress=1, save_progress=2, save_path=save_path,
+                           history_dir=history_dir)
+        met_copy = pop.Metamer.load(save_path, rgc.from_state_dict_reduced)
+        assert isinstance(met_copy.saved_signal, pop.synthesize.history.LazyHistory)
+        assert met_copy.saved_signal.shape == metamer.saved_signal.shape
+        assert torch.equal(met_copy.saved_signal[:], metamer.saved_signal)
+        assert torch.equal(met_copy.saved_representation[-1], metamer.saved_representation[-1])
+        # and we can resume from it
+        met_copy.synthesize(max_iter=2, store_progress=1, save_progress=2, save_path=save_path,
+                            history_dir=history_dir, learning_rate=None)
+        assert met_copy.saved_signal.shape[0] == 7
+        # save doesn't modify the attrs it's given
+        attrs = ['model', 'loss', 'saved_signal']
+        pop.synthesize.synthesis.Synthesis.save(metamer, save_path, True, attrs,
+                                                history_dir=history_dir)
+        assert attrs == ['model', 'loss', 'saved_signal']
+
+    def test_rgc_metamer_save_async(self, img, tmp_path):
+        rgc = pop.PooledRGC(.5, img.shape[2:])
+        metamer = pop.Metamer(img, rgc)
+        save_path = op.join(tmp_path, 'test_rgc_metamer_save_async.pt')
+        metamer.synthesize(max_iter=4, store_progress=1, save_progress=2, save_path=save_path,
+                           save_progress_async=True)
+        assert not op.exists(save_path + '.tmp')
+        met_copy = pop.Metamer.load(save_path, rgc.from_state_dict_reduced)
+        assert len(met_copy.loss) == 4
+        assert torch.equal(met_copy.saved_signal[-1], metamer.saved_signal[-1])
+        assert '_optimizer_state_dict' in vars(met_copy)
+
+    @pytest.mark.parametrize('optimizer', ['SGD', 'Adam'])
+    def test_rgc_metamer_resume(self, img, tmp_path, optimizer):
+        rgc = pop.PooledRGC(.5, img.shape[2:])
+        metamer = pop.Metamer(img, rgc)
+        save_path = op.join(tmp_path, f'test_rgc_metamer_resume_{optimizer}.pt')
+        metamer.synthesize(max_iter=10, store_progress=2, save_progress=3, save_path=save_path,
+                           optimizer=optimizer, learning_rate=.1)
+        # the last checkpoint was written after the 9th iteration
+        met_copy = pop.Metamer.load(save_path, rgc.from_state_dict_reduced)
+        assert len(met_copy.loss) == 9
+        met_copy.synthesize(max_iter=1, store_progress=2, optimizer=optimizer,
+                            learning_rate=None)
+        # resuming should be exact, not just close
+        assert met_copy.loss == metamer.loss
+        assert met_copy.learning_rate == metamer.learning_rate
+        assert torch.equal(met_copy.synthesized_signal, metamer.synthesized_signal)
+        assert torch.equal(met_copy.saved_signal, metamer.saved_signal)
+
+    def test_rgc_multiresolution_initial_image(self, img):
+        init, summary = fov.create_metamers.multiresolution_initial_image(
+            'RGC_gaussian', .5, img, [4, 2], max_iter=[3, 2], learning_rate=.1)
+        assert init.shape == img.shape
+        assert [summary[f'multires_level_{i}_num_iterations'] for i in range(2)] == [3, 2]
+        assert summary['multires_level_0_img_res'] == '16x16'
+        assert summary['multires_duration'] >= summary['multires_level_1_duration']
+
+    def test_rgc_nearest_scaling_initial_image(self, img, tmp_path):
+        with open(op.join(op.dirname(op.realpath(__file__)), '..', 'config.yml')) as f:
+            template = yaml.safe_load(f)['METAMER_TEMPLATE_PATH']
+        wildcards = dict(DATA_DIR=str(tmp_path), model_name='RGC_gaussian', image_name='nuts',
+                         optimizer='Adam', loss='mse', fract_removed=0, loss_fract=1,
+                         loss_change_thresh=.01, loss_change_iter=50, coarse_to_fine=False,
+                         clamp='clamp', clamp_each_iter=True, seed=0, learning_rate=.01,
+                         min_ecc=.5, max_ecc=15., max_iter=100, loss_thresh=1e-8, save_all='')
+        finished = {}
+        for scaling, seed in [(.1, 0), (.4, 0), (.15, 1)]:
+            wildcards.update(scaling=scaling, seed=seed, init_type='white',
+                             gpu=int(scaling > .09))
+            path = template.format(**wildcards).replace('.png', '.npy')
+            os.makedirs(op.dirname(path), exist_ok=True)
+            finished[(scaling, seed)] = torch.rand_like(img)
+            np.save(path, finished[(scaling, seed)].squeeze().numpy())
+        wildcards.update(scaling=.2, seed=0, init_type='nearest-scaling', gpu=1)
+        save_path = template.format(**wildcards).replace('_metamer.png', '.pt')
+        path, scaling = fov.utils.find_nearest_scaling_metamer(save_path)
+        # .15 is closer, but has a different seed
+        assert scaling == .1 and path.endswith('_metamer.npy')
+        assert fov.utils.warm_start_scaling(.2, [.1, .4, .2, .15]) == .15
+        assert fov.utils.warm_start_scaling(.1, [.1, .4, .2, .15]) is None
+        rgc = pop.PooledRGC(.2, img.shape[2:])
+        init = fov.create_metamers.setup_initial_image('nearest-scaling', rgc, img, save_path)
+        assert torch.allclose(init, fov.create_metamers.add_center_to_image(
+            rgc, finished[(.1, 0)], img))
+        with pytest.warns(UserWarning):
+            fov.create_metamers.setup_initial_image(
+                'nearest-scaling', rgc, img, save_path.replace('nuts', 'einstein'))
+
+    @pytest.mark.parametrize('window_backend', ['dense', 'sparse'])
+    def test_rgc_metamer_window_fraction(self, img, window_backend):
+        rgc = pop.PooledRGC(.5, img.shape[2:], window_backend=window_backend)
+        subset = torch.arange(0, rgc.n_windows, 3)
+        full = rgc(img)
+        rgc.set_window_subset(subset)
+        assert torch.allclose(rgc(img), rgc.select_windows(full, subset), atol=1e-6)
+        rgc.set_window_subset(None)
+        assert rgc(img).shape == full.shape
+        metamer = pop.Metamer(img, rgc)
+        # with this loss_change_thresh, we double the fraction every 3 iterations
+        metamer.synthesize(max_iter=10, window_fraction=.25, loss_change_iter=2,
+                           loss_change_thresh=1e10)
+        assert metamer.window_fraction[:7] == [.25]*3 + [.5]*3 + [1]
+        assert metamer.synthesized_representation.shape == full.shape
+
+    def test_rgc_metamer_window_fraction_target(self, img):
+        rgc = pop.PooledRGC(.5, img.shape[2:])
+        subset = torch.arange(0, rgc.n_windows, 3)
+        full = rgc(img)
+        metamer = pop.Metamer(img, rgc)
+        # the target is first computed while the model pools with the
+        # subset, but the cache should still hold the full representation
+        metamer._window_subset = subset
+        rgc.set_window_subset(subset)
+        target = metamer._get_target_representation()
+        assert torch.equal(rgc.window_subset, subset)
+        assert metamer._get_base_representation().shape == full.shape
+        assert torch.allclose(metamer._get_base_representation(), full, atol=1e-6)
+        assert torch.allclose(target, rgc.select_windows(full, subset), atol=1e-6)
+        rgc.set_window_subset(None)
+        assert rgc.window_subset is None
+
+    def test_rgc_representation_cache_subset(self, img, tmp_path):
+        rgc = pop.PooledRGC(.5, img.shape[2:])
+        rgc.representation_cache = pop.RepresentationCache(tmp_path)
+        subset = torch.arange(0, rgc.n_windows, 3)
+        with pop.use_representation_cache():
+            full = rgc(img)
+            rgc.set_window_subset(subset)
+            # the subset is part of the key, so this is a miss
+            assert torch.allclose(rgc(img), rgc.select_windows(full, subset), atol=1e-6)
+            rgc.set_window_subset(None)
+            assert torch.equal(rgc(img), full)
+        cache = rgc.representation_cache
+        assert (cache.misses, cache.hits) == (2, 1)
+
+    def test_rgc_metamer_representation_cache(self, img, tmp_path):
+        rgc = pop.PooledRGC(.5, img.shape[2:])
+        rgc.representation_cache = pop.RepresentationCache(tmp_path)
+        metamer = pop.Metamer(img, rgc)
+        metamer.synthesize(max_iter=5, store_progress=1)
+        # only the representation of base_signal is cached, not those of
+        # the stored iterations
+        assert len(list(tmp_path.glob('*.npy'))) == 1
+        assert len(list(tmp_path.glob('*.pt'))) == 1
+
+    def test_rgc_gradient_preconditioner(self, img):
+        rgc = pop.PooledRGC(.5, img.shape[2:])
+        preconditioner = rgc.gradient_preconditioner()
+        assert preconditioner.shape == img.shape[2:]
+        unclipped = rgc.gradient_preconditioner(max_value=float('inf'))
+        assert torch.allclose(unclipped.mean(), torch.ones(1))
+        assert torch.equal(preconditioner, unclipped.clamp(max=10))
+        # the windows are bigger in the periphery
+        center = img.shape[2] // 2
+        assert preconditioner[center, 2] > preconditioner[center, center + 5]
+        squared = unclipped.pow(2)
+        assert torch.allclose(rgc.gradient_preconditioner(2, float('inf')),
+                              squared / squared.mean())
+        # the cap bounds how much any pixel's gradient gets scaled up
+        assert unclipped.max() > 1
+        capped = rgc.gradient_preconditioner(max_value=1)
+        assert capped.max() <= 1
+        assert torch.equal(capped, unclipped.clamp(max=1))
+        with pytest.raises(Exception):
+            rgc.gradient_preconditioner(max_value=.5)
+        metamer = pop.Metamer(img, rgc)
+        metamer.synthesize(max_iter=5, precondition=True)
+        assert metamer._init_optimizer_kwargs['precondition'] == 1
+        assert torch.equal(metamer._preconditioner, preconditioner)
+        metamer.synthesize(max_iter=5, precondition=False, learning_rate=None)
+        assert metamer._preconditioner is None
+        assert not metamer._init_optimizer_kwargs['precondition']
+
+    def test_rgc_metamer_profile(self, img):
+        rgc = pop.PooledRGC(.5, img.shape[2:])
+        metamer = pop.Metamer(img, rgc)
+        metamer.synthesize(max_iter=3, store_progress=1, profile=True)
+        summary = metamer.profiler.summary()
+        for phase in ['forward', 'backward', 'optimizer_step', 'store', 'pooling']:
+            assert summary[f'time_{phase}_total'] >= 0
+            assert f'peak_memory_{phase}' in summary
+        assert len(metamer.profiler.iterations) == 3
+        assert 'time_pooling' in metamer.profiler.iteration_summary(0)
+        assert rgc._profiler is None
+
+    def test_v1_sparse_windows(self, img):
+        v1 = pop.PooledV1(.5, img.shape[2:], num_scales=2)
+        v1_sparse = pop.PooledV1(.5, img.shape[2:], num_scales=2, window_backend='sparse')
+        assert v1_sparse.state_dict_reduced['window_backend'] == 'sparse'
+        assert torch.allclose(v1(img), v1_sparse(img), atol=1e-5)
+        pooled = v1.PoolingWindows(img)
+        assert torch.allclose(pooled, v1_sparse.PoolingWindows(img), atol=1e-5)
+        assert torch.allclose(v1.PoolingWindows.project(pooled),
+                              v1_sparse.PoolingWindows.project(pooled), atol=1e-5)
+        dense_nbytes = pop.simulate.pooling_backends.windows_nbytes(v1.PoolingWindows)
+        assert v1_sparse.PoolingWindows.nbytes < dense_nbytes
+        v1_sparse.summarize_representation(by_angle=True)
+        with pytest.raises(Exception):
+            v1_sparse.plot_windows()
+
+    def test_v1_window_metadata(self, img):
+        v1 = pop.PooledV1(.5, img.shape[2:], num_scales=2)
+        rep = v1(img)
+        metadata = v1.window_metadata
+        for i in range(2):
+            assert (metadata.scale == i).sum() == v1.representation[(i, 0)].shape[-1]
+        assert (metadata[metadata.scale == 0].groupby('eccentricity_band').size() ==
+                v1.n_polar_windows).all()
+        # each eccentricity window should peak at the metadata's center
+        # (to within a pixel, since we don't know exactly where the windows
+        # put the image's center)
+        ecc_windows = v1.PoolingWindows.ecc_windows[0]
+        assert len(ecc_windows) == metadata.eccentricity_band.nunique()
+        h, w = ecc_windows.shape[-2:]
+        y = (torch.arange(h, dtype=DTYPE) - (h-1)/2).unsqueeze(1)
+        x = (torch.arange(w, dtype=DTYPE) - (w-1)/2).unsqueeze(0)
+        pixel_ecc = (x.pow(2) + y.pow(2)).sqrt()
+        bands = metadata[(metadata.scale == 0) & (metadata.angle_window == 0)]
+        n_checked = 0
+        for band, center in zip(bands.eccentricity_band, bands.center_eccentricity_pixels):
+            # windows centered outside the image don't peak within it
+            if center > min(h, w) / 2 - 1:
+                continue
+            window = ecc_windows[band]
+            peak = pixel_ecc[window >= window.max() - 1e-3]
+            assert peak.min() - 1 <= center <= peak.max() + 1
+            n_checked += 1
+        assert n_checked > 0
+        sizes = v1.summarize_window_sizes()
+        assert sizes['min_window_center_degrees'] < sizes['max_window_center_degrees']
+        summarized = v1.summarize_representation(rep, by_angle=True)
+        assert len(summarized) == 4 * len(v1.representation)
+
+    @pytest.mark.parametrize('by_angle', [True, False])
+    def test_v1_summarize_representation_batch(self, img, by_angle):
+        v1 = pop.PooledV1(.5, img.shape[2:], num_scales=2)
+        reps = torch.stack([v1(img), v1(torch.rand_like(img))])
+        summarized, keys = v1.summarize_representation_batch(reps, by_angle=by_angle)
+        assert summarized.shape == (2, len(keys))
+        for rep, summ in zip(reps, summarized):
+            # a callable summary_func uses the per-key loop
+            looped = v1.summarize_representation(rep, lambda x: torch.pow(x, 2).mean(),
+                                                 by_angle=by_angle)
+            assert list(looped.keys()) == keys
+            assert np.allclose(list(looped.values()), summ.numpy(), rtol=1e-4)
+
+    def test_v1_summarize_representation_dict(self, img):
+        v1 = pop.PooledV1(.5, img.shape[2:], num_scales=2)
+        v1(img)
+        # a dict with fewer keys than the last forward pass
+        data = {k: v for k, v in v1.representation.items() if not isinstance(k, str) and k[0] == 1}
+        for by_angle in [True, False]:
+            summarized = v1.summarize_representation(data, by_angle=by_angle)
+            looped = v1.summarize_representation(data, lambda x: torch.pow(x, 2).mean(),
+                                                 by_angle=by_angle)
+            assert list(summarized.keys()) == list(looped.keys())
+            assert np.allclose(list(summarized.values()), list(looped.values()), rtol=1e-4)
+        # and with fewer statistics per key (e.g., a window subset)
+        data = {k: v[..., :5] for k, v in data.items()}
+        summarized = v1.summarize_representation(data)
+        assert np.allclose(list(summarized.values()),
+                           [v.pow(2).mean().item() for v in data.values()], rtol=1e-4)
+        with pytest.raises(Exception):
+            v1.summarize_representation(data, by_angle=True)
+
+    def test_v1_chunked_windows(self, img):
+        v1 = pop.PooledV1(.5, img.shape[2:], num_scales=2)
+        # tiny budget, so each chunk is a single eccentricity window
+        v1_chunked = pop.PooledV1(.5, img.shape[2:], num_scales=2, window_backend='chunked',
+                                  window_memory_budget=1e-9)
+        assert v1_chunked.PoolingWindows.get_chunk_size(img, 0) == 1
+        im = img.clone().requires_grad_()
+        im_chunked = img.clone().requires_grad_()
+        rep = v1(im)
+        rep_chunked = v1_chunked(im_chunked)
+        assert torch.allclose(rep, rep_chunked, atol=1e-5)
+        rep.pow(2).sum().backward()
+        rep_chunked.pow(2).sum().backward()
+        assert torch.allclose(im.grad, im_chunked.grad, rtol=1e-4, atol=1e-5)
+        pooled = v1.PoolingWindows(img)
+        assert torch.allclose(v1.PoolingWindows.project(pooled),
+                              v1_chunked.PoolingWindows.project(pooled), atol=1e-5)
+
+    @pytest.mark.parametrize('window_backend', ['dense', 'sparse'])
+    def test_v1_window_dtype(self, img, window_backend):
+        v1 = pop.PooledV1(.5, img.shape[2:], num_scales=2, window_backend=window_backend)
+        v1_half = pop.PooledV1(.5, img.shape[2:], num_scales=2, window_backend=window_backend,
+                               window_dtype='bfloat16')
+        nbytes = pop.simulate.pooling_backends.windows_nbytes
+        assert nbytes(v1_half.PoolingWindows) < nbytes(v1.PoolingWindows)
+        rep = v1(img)
+        rep_half = v1_half(img)
+        assert rep_half.dtype == rep.dtype
+        assert torch.allclose(rep, rep_half, rtol=1e-2, atol=1e-3)
+        # the windows stay in reduced precision when the model is cast
+        v1_half.to(torch.float32)
+        assert v1_half.PoolingWindows.window_dtype == torch.bfloat16
+        assert torch.allclose(v1_half(img), rep_half)
+
+    def test_rgc_window_dtype_cast_in_chunks(self, img):
+        # chunked: casting one angle window at a time gives the same
+        # answer as casting them all at once
+        windows = pop.PooledRGC(.5, img.shape[2:], window_dtype='bfloat16').PoolingWindows
+        im = img.clone().requires_grad_()
+        pooled = windows(im)
+        pooled.pow(2).sum().backward()
+        windows.chunk_size = 1
+        im_chunked = img.clone().requires_grad_()
+        pooled_chunked = windows(im_chunked)
+        pooled_chunked.pow(2).sum().backward()
+        assert pooled_chunked.dtype == img.dtype
+        assert torch.allclose(pooled, pooled_chunked, rtol=1e-4, atol=1e-6)
+        assert torch.allclose(im.grad, im_chunked.grad, rtol=1e-4, atol=1e-6)
+        # sparse: casting one eccentricity band at a time gives the same
+        # answer as casting all of the windows at once
+        windows = pop.PooledRGC(.5, img.shape[2:], window_backend='sparse',
+                                window_dtype='bfloat16').PoolingWindows
+        full = windows.windows[0].to(img.dtype)
+        pooled = windows(img)
+        assert pooled.dtype == img.dtype
+        assert torch.allclose(pooled.flatten(),
+                              torch.sparse.mm(full, img.flatten().unsqueeze(1)).flatten(),
+                              rtol=1e-4, atol=1e-6)
+        assert torch.allclose(windows.project(pooled).flatten(),
+                              torch.sparse.mm(full.t(), pooled.reshape(-1, 1)).flatten(),
+                              rtol=1e-4, atol=1e-6)
+
+    def test_v1_sweep(self, img):
+        sweep = pop.PooledV1Sweep([.5, 1], img.shape[2:], num_scales=2)
+        reps = sweep(img)
+        for sc in [.5, 1]:
+            v1 = pop.PooledV1(sc, img.shape[2:], num_scales=2)
+            assert torch.allclose(reps[sc], v1(img))
+        init = torch.rand(2, *img.shape[1:])
+        split_reps = sweep(init, split_batch=True)
+        for i, sc in enumerate(sweep.scaling):
+            assert torch.allclose(split_reps[sc], sweep(init[i:i+1])[sc])
+        synth, loss = fov.create_metamers.synthesize_scaling_sweep(sweep, img, init, max_iter=3)
+        assert synth.shape == init.shape
+        assert loss.shape == (3, 2)
+
+    def test_v1_representation_cache(self, img, tmp_path):
+        v1 = pop.PooledV1(.5, img.shape[2:], num_scales=2)
+        rep = v1(img)
+        pyr_coeffs = v1.pyr_coeffs
+        v1.representation_cache = pop.RepresentationCache(tmp_path)
+        v1_copy = pop.PooledV1(.5, img.shape[2:], num_scales=2)
+        v1_copy.representation_cache = pop.RepresentationCache(tmp_path)
+        # the cache is only used inside use_representation_cache()
+        v1(img)
+        assert (v1.representation_cache.misses, len(list(tmp_path.iterdir()))) == (0, 0)
+        with pop.use_representation_cache():
+            for model in [v1, v1_copy]:
+                assert torch.allclose(model(img), rep)
+        assert (v1.representation_cache.misses, v1_copy.representation_cache.hits) == (1, 1)
+        for k, v in v1.representation.items():
+            assert torch.allclose(v1_copy.representation[k], v)
+        for k, v in pyr_coeffs.items():
+            assert torch.allclose(v1_copy.pyr_coeffs[k], v)
+        # nor when we need the gradient
+        with pop.use_representation_cache():
+            v1_copy(img.clone().requires_grad_())
+        assert v1_copy.representation_cache.hits == 1
+        v1_copy.representation_cache.max_size = 0
+        v1_copy.representation_cache.evict()
+        assert v1_copy.representation_cache.size() == 0
+
+    def test_v1_gradient_checkpointing(self, img):
+        v1 = pop.PooledV1(.5, img.shape[2:], num_scales=3)
+        v1_ckpt = pop.PooledV1(.5, img.shape[2:], num_scales=3, gradient_checkpointing=True)
+        for model in [v1, v1_ckpt]:
+            model.store_intermediates = False
+        im = img.clone().requires_grad_()
+        im_ckpt = img.clone().requires_grad_()
+        rep = v1(im)
+        rep_ckpt = v1_ckpt(im_ckpt)
+        assert torch.allclose(rep, rep_ckpt)
+        rep.pow(2).sum().backward()
+        rep_ckpt.pow(2).sum().backward()
+        assert torch.allclose(im.grad, im_ckpt.grad, rtol=1e-4, atol=1e-6)
+
     def test_rgc_save_load(self, tmp_path):
         im = plt.imread(op.join(DATA_DIR, 'nuts.pgm'))
         im = torch.tensor(im, dtype=torch.float32).unsqueeze(0).unsqueeze(0)
@@ -133,6 +534,56 @@ class TestPooledVentralStream(object):
         # ...second time we load them
         rgc = pop.PooledRGC(.5, im.shape[2:], cache_dir=tmp_path)
 
+    def test_rgc_model_registry(self, img, tmp_path):
+        rgc = pop.PooledRGC(.5, img.shape[2:], cache_dir=tmp_path)
+        path = op.join(tmp_path, 'test_rgc_model_registry.pt')
+        rgc.save_reduced(path)
+        pop.model_registry.clear()
+        rgc_copy = pop.PooledRGC.load_reduced(path)
+        assert pop.PooledRGC.load_reduced(path) is rgc_copy
+        # this one can be safely modified
+        rgc_unshared = pop.PooledRGC.load_reduced(path, shared=False)
+        assert rgc_unshared is not rgc_copy
+        assert torch.equal(rgc_unshared(img), rgc_copy(img))
+        capacity = pop.model_registry.capacity
+        pop.model_registry.capacity = 0
+        assert len(pop.model_registry) == 0
+        assert pop.PooledRGC.load_reduced(path) is not rgc_copy
+        pop.model_registry.capacity = capacity
+
+    def test_rgc_mmap_cache(self, img, tmp_path):
+        rgc = pop.PooledRGC(.5, img.shape[2:], cache_dir=tmp_path)
+        path = pop.simulate.window_cache.window_cache_path(tmp_path, .5, img.shape[2:],
+                                                           transition_region_width=.5)
+        assert op.exists(op.join(path, 'metadata.pt'))
+        # this one should attach to the memory-mapped cache
+        rgc_copy = pop.PooledRGC(.5, img.shape[2:], cache_dir=tmp_path)
+        for k, v in rgc.PoolingWindows.angle_windows.items():
+            assert torch.equal(v, rgc_copy.PoolingWindows.angle_windows[k])
+            assert torch.equal(rgc.PoolingWindows.ecc_windows[k],
+                               rgc_copy.PoolingWindows.ecc_windows[k])
+        assert torch.equal(rgc(img), rgc_copy(img))
+        assert rgc_copy.state_dict_reduced['model_name'] == 'RGC'
+
+    def test_rgc_window_coverage(self, img, tmp_path):
+        rgc = pop.PooledRGC(.5, img.shape[2:], cache_dir=tmp_path)
+        rgc(img)
+        ones = torch.ones_like(rgc.representation['mean_luminance'])
+        coverage = rgc.PoolingWindows.project(ones).squeeze()
+        assert torch.allclose(rgc.window_coverage, coverage)
+        path = pop.simulate.window_cache.window_cache_path(tmp_path, .5, img.shape[2:],
+                                                           transition_region_width=.5)
+        assert op.exists(op.join(path, 'coverage_float32.npy'))
+        rgc_copy = pop.PooledRGC(.5, img.shape[2:], cache_dir=tmp_path)
+        assert torch.allclose(rgc_copy.window_coverage, coverage)
+        # windows stored in reduced precision get their own coverage
+        rgc_half = pop.PooledRGC(.5, img.shape[2:], cache_dir=tmp_path, window_dtype='bfloat16')
+        assert torch.allclose(rgc_half.window_coverage, coverage, atol=1e-2)
+        assert op.exists(op.join(path, 'coverage_bfloat16.npy'))
+        init = torch.rand_like(img)
+        recentered = fov.create_metamers.add_center_to_image(rgc, init, img)
+        assert torch.allclose(recentered, coverage * init + (1 - coverage) * img)
+
     def test_v1(self):
         im = plt.imread(op.join(DATA_DIR, 'nuts.pgm'))
         im = torch.tensor(im, dtype=DTYPE).unsqueeze(0).unsqueeze(0)
@@ -171,6 +622,31 @@ class TestPooledVentralStream(object):
         v1.plot_representation_image(ax=axes[1])
         plt.close('all')
 
+    def test_v1_norm_reduced(self, img):
+        v1 = pop.PooledV1(.5, img.shape[2:])
+        stats = pop.optim.generate_norm_stats(v1, DATA_DIR, img_shape=(256, 256))
+        reduced = pop.optim.reduce_norm_stats(stats)
+        rereduced = pop.optim.reduce_norm_stats(reduced)
+        assert rereduced.keys() == reduced.keys()
+        for k, v in reduced.items():
+            # values are either (mean, std) tuples or dicts of them
+            if isinstance(v, dict):
+                assert rereduced[k].keys() == v.keys()
+                pairs = [(rereduced[k][l], w) for l, w in v.items()]
+            else:
+                pairs = [(rereduced[k], v)]
+            for new, old in pairs:
+                assert len(new) == len(old) == 2
+                assert all(torch.equal(n, o) for n, o in zip(new, old))
+        v1 = pop.PooledV1(.5, img.shape[2:], normalize_dict=stats)
+        v1_reduced = pop.PooledV1(.5, img.shape[2:], normalize_dict=reduced)
+        assert isinstance(v1.state_dict_reduced['normalize_dict']['cone_responses'], tuple)
+        assert torch.allclose(v1(img), v1_reduced(img))
+        cone_responses = img.clone()
+        mn, std = reduced['cone_responses']
+        normed = pop.optim.zscore_stats(stats, cone_responses=cone_responses)
+        assert torch.allclose(normed['cone_responses'], (img - mn) / std)
+
     def test_v1_2(self):
         im = plt.imread(op.join(DATA_DIR, 'nuts.pgm'))
         im = torch.tensor(im, dtype=DTYPE).unsqueeze(0).unsqueeze(0)
@@ -189,6 +665,28 @@ class TestPooledVentralStream(object):
         v1.plot_representation_image(ax=axes[1])
         plt.close('all')
 
+    def test_v1_store_intermediates(self, img):
+        v1 = pop.PooledV1(.5, img.shape[2:])
+        rep = v1(img)
+        cone_responses = v1.cone_responses.clone()
+        pyr_coeffs = {k: v.clone() for k, v in v1.pyr_coeffs.items()}
+        v1.store_intermediates = False
+        lean_rep = v1(img)
+        assert torch.equal(rep, lean_rep)
+        assert v1._cone_responses is None and v1._pyr_coeffs is None
+        # these get recomputed when we ask for them
+        assert torch.equal(v1.cone_responses, cone_responses)
+        for k, v in pyr_coeffs.items():
+            assert torch.equal(v1.pyr_coeffs[k], v)
+        assert torch.equal(v1.representation_to_output(), lean_rep)
+        metamer = pop.Metamer(img, v1)
+        metamer.synthesize(max_iter=3)
+        assert v1.store_intermediates is False
+        v1.store_intermediates = True
+        metamer = pop.Metamer(img, v1)
+        metamer.synthesize(max_iter=3)
+        assert v1.store_intermediates is True
+
     def test_v1_mean_luminance(self):
         for fname in ['nuts', 'einstein']:
             im = plt.imread(op.join(DATA_DIR, fname+'.pgm'))
@@ -204,6 +702,23 @@ class TestPooledVentralStream(object):
                 raise Exception("Somehow V1's representation does not have the mean luminance "
                                 "in the location expected! for image %s!" % fname)
 
+    def test_moments_fused(self, img):
+        moments = pop.PooledMoments(.5, img.shape[2:])
+        rep = moments(img)
+        mean = moments.PoolingWindows(img)
+        # we can't check these with torch.equal: pooling is a sum over
+        # pixels, and BLAS picks a different kernel (and so a different
+        # summation order) for 4 stacked channels than for 1, so the
+        # fused values can differ from the separately-pooled ones in the
+        # last bit (about 1e-7, relative). allclose's default rtol of 1e-5
+        # is well above that, but far below any real difference
+        assert torch.allclose(moments.representation['mean_luminance'], mean)
+        for n, k in zip([2, 3, 4], ['second', 'third', 'fourth']):
+            mom = moments.PoolingWindows(img.pow(n)).clamp(min=0).pow(1/n)
+            assert torch.allclose(moments.representation[f'image_moment_{k}'], mom)
+        assert list(moments.representation.keys())[0] == 'mean_luminance'
+        assert rep.shape[-1] == 4 * mean.shape[-1]
+
     def test_v1_save_load(self, tmp_path):
         im = plt.imread(op.join(DATA_DIR, 'nuts.pgm'))
         im = torch.tensor(im, dtype=torch.float32).unsqueeze(0).unsqueeze(0)
@@ -251,6 +766,16 @@ class TestPooledVentralStream(object):
         metamer = pop.Metamer(im, v1)
         metamer.synthesize(max_iter=3)
 
+    def test_v1_metamer_coarse_to_fine(self, img):
+        v1 = pop.PooledV1(.5, img.shape[2:])
+        metamer = pop.Metamer(img, v1)
+        metamer.synthesize(max_iter=3, store_progress=1, coarse_to_fine='together')
+        # the loss is with respect to the scales we're currently optimizing...
+        assert np.allclose(metamer.loss, metamer.scales_loss)
+        # ...but the stored representation always includes all of them
+        assert metamer.saved_representation.shape[1:] == metamer.base_representation.shape
+        assert len(metamer.saved_representation) == 4
+
 
 class TestObserverModel(object):
 
@@ -282,6 +807,21 @@ class TestObserverModel(object):
         reduced_rep = obs.output_to_representation(reduced_rep, ['mean_luminance'])
         assert len(reduced_rep.keys()) == 1
 
+    def test_obs_gradient_checkpointing(self, img):
+        obs = fov.ObserverModel(1, img.shape[-2:], sf_weighting_slope=.5)
+        obs_ckpt = fov.ObserverModel(1, img.shape[-2:], sf_weighting_slope=.5,
+                                     gradient_checkpointing=True)
+        im = img.clone().requires_grad_()
+        im_ckpt = img.clone().requires_grad_()
+        rep = obs(im)
+        rep_ckpt = obs_ckpt(im_ckpt)
+        assert torch.allclose(rep, rep_ckpt)
+        rep.pow(2).sum().backward()
+        rep_ckpt.pow(2).sum().backward()
+        assert torch.allclose(im.grad, im_ckpt.grad, rtol=1e-4, atol=1e-6)
+        assert torch.allclose(obs.sf_weighting_slope.grad, obs_ckpt.sf_weighting_slope.grad,
+                              rtol=1e-4)
+
     @pytest.mark.parametrize('num_scales', [1, 4])
     @pytest.mark.parametrize('order', [1, 3])
     def test_obs_plot_rep(self, num_scales, order, img):
@@ -355,3 +895,13 @@ class TestObserverModel(object):
     def test_obs_metamer(self, img, obs):
         metamer = pop.Metamer(img, obs)
         metamer.synthesize(max_iter=3, coarse_to_fine='together')
+
+    def test_obs_metamer_target_cache(self, img, obs):
+        metamer = pop.Metamer(img, obs)
+        metamer.synthesize(max_iter=5, coarse_to_fine='together')
+        scale_sets = len(metamer.scales_finished) + 1
+        assert metamer._base_representation_cache_misses == scale_sets
+        assert len(metamer._base_representation_cache) == scale_sets
+        metamer.to(torch.float64)
+        assert len(metamer._base_representation_cache) == 0
+        metamer.to(torch.float32)